@@ -1,8 +1,85 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
-import psycopg2
+from tkinter import ttk, messagebox, filedialog
+import importlib
+import logging
+import queue
+import threading
+import time
 from datetime import datetime, timedelta
 
+import charts
+from db_worker import DbExecutor
+from paged_tree import PagedTreeview, TreeRows
+from ref_cache import CACHED_STATEMENTS, REFERENCE_CHANNEL, ReferenceCache
+
+
+class LazyModule:
+    # Imports the real module on first use, so psycopg2 and everything
+    # built on it stay off the path to the login window
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.name), attr)
+
+
+BACKEND_MODULES = ('library_db', 'query_metrics', 'analytics', 'circulation', 'book_bulk',
+                   'book_search', 'catalog_import', 'change_feed', 'hold_queue',
+                   'loan_partitions', 'local_replica', 'maintenance', 'report_export')
+
+library_db = LazyModule('library_db')
+query_metrics = LazyModule('query_metrics')
+analytics = LazyModule('analytics')
+circulation = LazyModule('circulation')
+book_bulk = LazyModule('book_bulk')
+book_search = LazyModule('book_search')
+catalog_import = LazyModule('catalog_import')
+change_feed = LazyModule('change_feed')
+hold_queue = LazyModule('hold_queue')
+local_replica = LazyModule('local_replica')
+maintenance = LazyModule('maintenance')
+report_export = LazyModule('report_export')
+
+
+def preload_backend():
+    # Runs in the background while the login window is up
+    for name in BACKEND_MODULES:
+        importlib.import_module(name)
+
+log = logging.getLogger('smartlibrary.gui')
+
+BOOKS_PAGE_SIZE = 200
+LOANS_PAGE_SIZE = 200
+SEARCH_DEBOUNCE_MS = 250
+SEARCH_POLL_MS = 20
+STATS_CACHE_TTL = 15  # seconds
+DB_WORKERS = 4
+SWEEP_INTERVAL_MS = 5 * 60 * 1000
+METRICS_EXPORT_MS = 15 * 1000
+REPLICA_SYNC_MS = 30 * 1000
+ROW_CHANGES_POLL_MS = 200
+DIAGNOSTICS_TOP = 15
+ANALYTICS_WINDOWS = {'Last 7 days': 7, 'Last 30 days': 30, 'Last 90 days': 90,
+                     'Last 365 days': 365}
+ANALYTICS_TOP = 10
+RECOMMENDATIONS_SHOWN = 5
+EXPORT_FILETYPES = [("CSV", "*.csv"), ("CSV, gzip", "*.csv.gz"), ("CSV, zstd", "*.csv.zst"),
+                    ("JSON Lines", "*.jsonl"), ("JSON Lines, gzip", "*.jsonl.gz"),
+                    ("JSON Lines, zstd", "*.jsonl.zst"), ("Parquet", "*.parquet"),
+                    ("All files", "*.*")]
+
+STATS_CARDS = [
+    ("Total Books", "#27ae60"),
+    ("Available", "#3498db"),
+    ("Members", "#f39c12"),
+    ("Active Loans", "#9b59b6"),
+    ("Overdue", "#e74c3c"),
+]
+
+
+def query(name, params=()):
+    return lambda conn: library_db.fetch_all(conn, name, params)
+
 
 class SmartLibraryGUI:
     def __init__(self, root):
@@ -11,12 +88,61 @@ class SmartLibraryGUI:
         self.root.geometry("1400x800")
         self.root.configure(bg='#f0f2f5')
 
-        self.conn = None
+        # Created on the first login (open_backend)
+        self.database = None
+        self.running_queries = set()
+        self.running_lock = threading.Lock()
         self.current_user = None
         self.current_role = None
+        self.book_search = None
+        self.search_after_id = None
+        self.search_polling = False
+        self.stats_cache = None
+        self.loading_label = None
+        # name -> (frame, refresh) for every screen built since login
+        self.screens = {}
+        self.current_screen = None
+        self.sweep_after_id = None
+        self.maintenance = None
+        self.metrics_after_id = None
+        # Authors, clubs and roles, invalidated through LISTEN (migrations/008)
+        self.ref_cache = ReferenceCache()
+        self.feed = None
+        self.feed_connected = False
+        # (table, ids) from the feed thread for the screens to patch (migrations/011)
+        self.row_changes = queue.Queue()
+        self.row_changes_after_id = None
+        # (screen, table) -> patch(ids) for screens that show those rows
+        self.row_watchers = {}
+        # Optional local copy for reads and offline circulation (local_replica.py)
+        self.replica = None
+        self.replica_ready = False
+        self.replica_syncing = False
+        self.replica_resync = False
+        self.replica_waiters = []
+        self.replica_after_id = None
+        self.replica_label = None
+
+        # All SQL runs on these workers; results come back through root.after
+        self.db = DbExecutor(root, cancel=self.cancel_queries, workers=DB_WORKERS,
+                             on_busy=self.set_loading)
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
 
         self.setup_styles()
         self.show_login()
+        threading.Thread(target=preload_backend, daemon=True).start()
+
+    def open_backend(self):
+        # By the first login preload_backend has normally finished importing
+        if self.database is not None:
+            return
+        self.database = library_db.Database()
+        replica_path = self.database.config['replica_path']
+        if replica_path:
+            self.replica = local_replica.LocalReplica(replica_path)
+            self.replica_ready = self.replica.ready
+        if self.database.config['metrics_file']:
+            self.export_metrics()
 
     def setup_styles(self):
         style = ttk.Style()
@@ -26,19 +152,131 @@ class SmartLibraryGUI:
         style.configure('Treeview', font=('Arial', 9), rowheight=30)
         style.configure('Treeview.Heading', font=('Arial', 10, 'bold'))
 
-    def connect_db(self):
+    def track_query(self, conn, running):
+        with self.running_lock:
+            if running:
+                self.running_queries.add(conn)
+            else:
+                self.running_queries.discard(conn)
+
+    def cancel_queries(self):
+        with self.running_lock:
+            for conn in self.running_queries:
+                conn.cancel()
+
+    def run_db(self, work, on_done=None, screen=True, on_error=None):
+        # work(conn) runs on a db worker in its own transaction on a pooled
+        # connection; screen reads are retried once if the connection dropped
+        if screen:
+            job = lambda: self.database.run(work, retry=True, track=self.track_query)
+        else:
+            job = lambda: self.database.run(work)
+        self.db.submit(job, on_done, on_error or self.show_db_error, screen)
+
+    def run_read(self, name, on_done, params=(), screen=True, on_error=None):
+        # Replicated lists come from the local copy once it exists
+        if self.replica_ready and name in local_replica.LOCAL_STATEMENTS:
+            self.db.submit(lambda: self.replica.fetch_all(name, params), on_done,
+                           on_error or self.show_db_error, screen)
+        else:
+            self.run_db(query(name, params), on_done, screen, on_error)
+
+    def run_cached(self, name, on_done, screen=True, on_error=None):
+        if self.replica_ready:
+            self.run_read(name, on_done, screen=screen, on_error=on_error)
+            return
+
+        # A hit is answered on the spot, without touching the database
+        rows = self.ref_cache.get(name)
+        if rows is not None:
+            on_done(rows)
+            return
+
+        tables = CACHED_STATEMENTS[name]
+        token = self.ref_cache.begin(tables)
+
+        def store(rows):
+            self.ref_cache.put(name, rows, tables, token)
+            on_done(rows)
+
+        self.run_db(query(name), store, screen, on_error)
+
+    def cached_rows(self, conn, name):
+        # run_cached for work already running on a db worker
+        rows = self.ref_cache.get(name)
+        if rows is None:
+            tables = CACHED_STATEMENTS[name]
+            token = self.ref_cache.begin(tables)
+            rows = library_db.fetch_all(conn, name)
+            self.ref_cache.put(name, rows, tables, token)
+        return rows
+
+    def export_metrics(self):
+        # For the node_exporter textfile collector
         try:
-            self.conn = psycopg2.connect(
-                dbname="smartlibrary",
-                user="postgres",
-                password="Alhaji2007",  # Change this
-                host="localhost",
-                port="5432"
-            )
-            return True
-        except Exception as e:
-            messagebox.showerror("Database Error", f"Connection failed:\n{str(e)}")
-            return False
+            query_metrics.metrics.write_prometheus(self.database.config['metrics_file'])
+        except OSError:
+            pass
+        self.metrics_after_id = self.root.after(METRICS_EXPORT_MS, self.export_metrics)
+
+    def sync_replica(self, then=None):
+        # Replays offline carts and pulls changes in the background; `then`
+        # runs once the local copy includes everything committed so far
+        if self.replica is None:
+            if then:
+                then()
+            return
+        if then:
+            self.replica_waiters.append(then)
+        if self.replica_syncing:
+            # The sync in flight may have started before our last write
+            self.replica_resync = True
+            return
+        self.replica_syncing = True
+
+        def finished(online):
+            self.replica_syncing = False
+            self.show_replica_state(online)
+            if self.replica_resync:
+                self.replica_resync = False
+                self.sync_replica()
+                return
+            waiters, self.replica_waiters = self.replica_waiters, []
+            for waiter in waiters:
+                waiter()
+
+        def done(result):
+            self.replica_ready = True
+            finished(True)
+
+        self.db.submit(lambda: self.replica.sync(self.database), done,
+                       lambda e: finished(False), screen=False)
+
+    def schedule_replica_sync(self):
+        self.sync_replica()
+        self.replica_after_id = self.root.after(REPLICA_SYNC_MS, self.schedule_replica_sync)
+
+    def show_replica_state(self, online):
+        if self.replica_label is None or not self.replica_label.winfo_exists():
+            return
+        pending = self.replica.pending_count()
+        if online:
+            text = f"Replica synced {datetime.now():%H:%M}"
+        else:
+            text = f"OFFLINE - {pending} cart(s) queued"
+        self.replica_label.configure(text=text, fg='#bdc3c7' if online else '#f39c12')
+
+    def show_db_error(self, error):
+        messagebox.showerror("Error", str(error))
+
+    def set_loading(self, busy):
+        if self.loading_label is None or not self.loading_label.winfo_exists():
+            return
+        if busy:
+            self.loading_label.place(in_=self.content_frame, relx=0.5, rely=0.5, anchor='center')
+            self.loading_label.lift()
+        else:
+            self.loading_label.place_forget()
 
     def show_login(self):
         for widget in self.root.winfo_children():
@@ -63,11 +301,28 @@ class SmartLibraryGUI:
         password_entry.pack(pady=(0, 30))
 
         def attempt_login():
-            if self.login(username_entry.get(), password_entry.get()):
-                self.show_main_interface()
-            else:
+            username, password = username_entry.get(), password_entry.get()
+            if not username or not password:
+                messagebox.showerror("Error", "Invalid credentials")
+                return
+
+            def done(result):
+                if self.login(username, result):
+                    self.show_main_interface()
+                    return
+                login_btn.configure(state='normal', text="Login")
                 messagebox.showerror("Error", "Invalid credentials")
 
+            def failed(e):
+                login_btn.configure(state='normal', text="Login")
+                messagebox.showerror("Database Error", f"Connection failed:\n{str(e)}")
+
+            login_btn.configure(state='disabled', text="Logging in...")
+            self.open_backend()
+            self.db.submit(lambda: self.database.run(
+                lambda conn: self.fetch_login(conn, username)),
+                done, failed, screen=False)
+
         login_btn = tk.Button(login_frame, text="Login", command=attempt_login,
                               bg='#27ae60', fg='white', font=('Arial', 12, 'bold'),
                               padx=60, pady=12, cursor='hand2', bd=0)
@@ -78,37 +333,24 @@ class SmartLibraryGUI:
         tk.Label(login_frame, text="Demo: admin / password123",
                  font=('Arial', 9), bg='#ffffff', fg='#95a5a6').pack(pady=(25, 0))
 
-    def login(self, username, password):
-        if not username or not password:
-            return False
-
-        if not self.connect_db():
-            return False
-
-        try:
-            cursor = self.conn.cursor()
-            # Simplified query without crypt
-            cursor.execute("""
-                SELECT u.id, u.name, r.name 
-                FROM users u JOIN roles r ON u.role_id = r.id 
-                WHERE u.username = %s
-            """, (username,))
-
-            result = cursor.fetchone()
-            if result:
-                user_id, name, role = result
-                # For testing: store passwords as plain text
-                # This is NOT secure - only for testing!
-                self.current_user = {'id': user_id, 'name': name, 'username': username}
-                self.current_role = role
-                cursor.close()
-                return True
-
-            cursor.close()
-            return False
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            return False
+    def fetch_login(self, conn, username):
+        # Db worker: the user row, with the role name from the cached roles
+        user = library_db.fetch_one(conn, 'login', (username,))
+        if user is None:
+            return None
+        user_id, name, role_id = user
+        roles = dict(self.cached_rows(conn, 'role_names'))
+        return (user_id, name, roles[role_id]) if role_id in roles else None
+
+    def login(self, username, result):
+        if result:
+            user_id, name, role = result
+            # For testing: store passwords as plain text
+            # This is NOT secure - only for testing!
+            self.current_user = {'id': user_id, 'name': name, 'username': username}
+            self.current_role = role
+            return True
+        return False
 
     def show_main_interface(self):
         for widget in self.root.winfo_children():
@@ -122,8 +364,84 @@ class SmartLibraryGUI:
         self.content_frame = tk.Frame(main_container, bg='#ffffff')
         self.content_frame.pack(side='right', fill='both', expand=True, padx=10, pady=10)
 
+        self.loading_label = tk.Label(main_container, text="Loading...", font=('Arial', 12),
+                                      bg='#2c3e50', fg='white', padx=20, pady=10)
+
+        if self.feed is None:
+            self.feed = change_feed.ChangeFeed(
+                self.database.connect, [REFERENCE_CHANNEL, change_feed.ROWS_CHANNEL],
+                on_notify=self.on_notify, on_state=self.on_feed_state).start()
+        self.poll_row_changes()
+
         self.show_dashboard()
 
+        if self.replica is not None and self.replica_after_id is None:
+            self.schedule_replica_sync()
+
+        if self.current_role == 'Librarian':
+            self.run_sweep()
+            # Not in the sidebar: Ctrl+Shift+D opens the query diagnostics
+            self.root.bind('<Control-D>', lambda e: self.show_diagnostics())
+
+    def on_notify(self, channel, payload):
+        # Feed thread: only the thread-safe cache and queue are touched here
+        if channel == REFERENCE_CHANNEL:
+            self.ref_cache.invalidate(payload)
+        else:
+            self.row_changes.put(change_feed.parse_row_change(payload))
+
+    def on_feed_state(self, connected):
+        self.ref_cache.set_listening(connected)
+        # Row changes sent while the feed was down are lost: reload instead
+        if connected and self.feed_connected:
+            self.row_changes.put(('books', None))
+            self.row_changes.put(('loans', None))
+        self.feed_connected = self.feed_connected or connected
+
+    def poll_row_changes(self):
+        # Everything that arrived since the last tick, merged per table
+        changed = {}
+        while True:
+            try:
+                table, ids = self.row_changes.get_nowait()
+            except queue.Empty:
+                break
+            if ids is None or changed.get(table, ()) is None:
+                changed[table] = None
+            else:
+                changed.setdefault(table, set()).update(ids)
+
+        for table, ids in changed.items():
+            self.stats_cache = None
+            if table == 'books':
+                self.sync_replica()
+            # Hidden screens refresh anyway when they are shown again
+            patch = self.row_watchers.get((self.current_screen, table))
+            if patch:
+                patch(ids)
+        self.row_changes_after_id = self.root.after(ROW_CHANGES_POLL_MS, self.poll_row_changes)
+
+    def watch_rows(self, screen, table, patch):
+        # patch(ids) gets the changed ids, or None when everything may have changed
+        self.row_watchers[(screen, table)] = patch
+
+    def run_sweep(self):
+        # Librarian desks keep the Overdue status current; SKIP LOCKED lets
+        # several desks sweep at once without blocking each other. The other
+        # maintenance steps run after it; each failure is logged on its own.
+        if self.maintenance is None:
+            self.maintenance = maintenance.Maintenance(self.database)
+
+        def done(results):
+            sweep = results.get('overdue sweep')
+            if sweep is not None and sweep.marked:
+                self.stats_cache = None
+
+        # A failed run is logged and retried on the next tick
+        self.db.submit(self.maintenance.run, done,
+                       on_error=lambda e: log.error("Maintenance failed: %s", e), screen=False)
+        self.sweep_after_id = self.root.after(SWEEP_INTERVAL_MS, self.run_sweep)
+
     def create_sidebar(self, parent):
         sidebar = tk.Frame(parent, bg='#2c3e50', width=250)
         sidebar.pack(side='left', fill='y')
@@ -142,9 +460,12 @@ class SmartLibraryGUI:
             ('Books', self.show_books),
             ('Members', self.show_members),
             ('Loans', self.show_loans),
+            ('Analytics', self.show_analytics),
             ('Authors', self.show_authors),
             ('Book Clubs', self.show_book_clubs),
         ]
+        if self.current_role == 'Librarian':
+            nav_items.insert(2, ('Circulation', self.show_circulation))
 
         for text, command in nav_items:
             btn = tk.Button(sidebar, text=text, command=command, bg='#2c3e50',
@@ -158,86 +479,90 @@ class SmartLibraryGUI:
                   fg='white', font=('Arial', 11, 'bold'), bd=0, pady=15,
                   cursor='hand2').pack(side='bottom', fill='x', padx=10, pady=10)
 
+        if self.replica is not None:
+            self.replica_label = tk.Label(sidebar, text="Replica not synced yet", bg='#2c3e50',
+                                          fg='#bdc3c7', font=('Arial', 9))
+            self.replica_label.pack(side='bottom', pady=(0, 5))
+
     def show_dashboard(self):
-        self.clear_content()
+        self.show_screen('dashboard', self.build_dashboard)
 
-        tk.Label(self.content_frame, text="Dashboard", font=('Arial', 26, 'bold'),
+    def build_dashboard(self, frame):
+        tk.Label(frame, text="Dashboard", font=('Arial', 26, 'bold'),
                  bg='#ffffff', fg='#2c3e50').pack(pady=20, anchor='w', padx=20)
 
-        stats_frame = tk.Frame(self.content_frame, bg='#ffffff')
+        stats_frame = tk.Frame(frame, bg='#ffffff')
         stats_frame.pack(fill='x', padx=20, pady=10)
 
-        try:
-            cursor = self.conn.cursor()
-            stats_queries = [
-                ("Total Books", "SELECT COUNT(*) FROM books", "#27ae60"),
-                ("Available", "SELECT COUNT(*) FROM books WHERE available = TRUE", "#3498db"),
-                ("Members", "SELECT COUNT(*) FROM members", "#f39c12"),
-                ("Active Loans", "SELECT COUNT(*) FROM loans WHERE status = 'Active'", "#9b59b6"),
-                ("Overdue", "SELECT COUNT(*) FROM loans WHERE status = 'Overdue'", "#e74c3c"),
-            ]
-
-            for i, (label, query, color) in enumerate(stats_queries):
-                cursor.execute(query)
-                value = cursor.fetchone()[0]
-
-                card = tk.Frame(stats_frame, bg=color, padx=25, pady=18)
-                card.grid(row=0, column=i, padx=8, sticky='ew')
-                stats_frame.columnconfigure(i, weight=1)
-
-                tk.Label(card, text=str(value), font=('Arial', 32, 'bold'),
-                         bg=color, fg='white').pack()
-                tk.Label(card, text=label, font=('Arial', 10),
-                         bg=color, fg='white').pack()
-
-            cursor.close()
-
-            # Recent loans
-            recent_frame = tk.LabelFrame(self.content_frame, text="Recent Loans",
-                                         font=('Arial', 14, 'bold'), bg='#ffffff',
-                                         padx=20, pady=15)
-            recent_frame.pack(fill='both', expand=True, padx=20, pady=20)
-
-            columns = ('ID', 'Book', 'Member', 'Due Date', 'Status')
-            tree = ttk.Treeview(recent_frame, columns=columns, show='headings', height=12)
+        value_labels = []
+        for i, (label, color) in enumerate(STATS_CARDS):
+            card = tk.Frame(stats_frame, bg=color, padx=25, pady=18)
+            card.grid(row=0, column=i, padx=8, sticky='ew')
+            stats_frame.columnconfigure(i, weight=1)
 
-            for col in columns:
-                tree.heading(col, text=col)
-                tree.column(col, width=150)
+            value_label = tk.Label(card, text="...", font=('Arial', 32, 'bold'),
+                                   bg=color, fg='white')
+            value_label.pack()
+            value_labels.append(value_label)
+            tk.Label(card, text=label, font=('Arial', 10),
+                     bg=color, fg='white').pack()
 
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                SELECT l.id, b.title, u.name, l.due_date, l.status
-                FROM loans l
-                JOIN books b ON l.book_id = b.id
-                JOIN members m ON l.member_id = m.id
-                JOIN users u ON m.user_id = u.id
-                WHERE l.status IN ('Active', 'Overdue')
-                ORDER BY l.due_date
-                LIMIT 15
-            """)
+        # Recent loans
+        recent_frame = tk.LabelFrame(frame, text="Recent Loans",
+                                     font=('Arial', 14, 'bold'), bg='#ffffff',
+                                     padx=20, pady=15)
+        recent_frame.pack(fill='both', expand=True, padx=20, pady=20)
 
-            for loan in cursor.fetchall():
-                tag = 'overdue' if loan[4] == 'Overdue' else 'active'
-                tree.insert('', 'end', values=loan, tags=(tag,))
+        columns = ('ID', 'Book', 'Member', 'Due Date', 'Status')
+        tree = ttk.Treeview(recent_frame, columns=columns, show='headings', height=12)
 
-            cursor.close()
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=150)
+
+        tree.tag_configure('overdue', background='#fadbd8')
+        tree.tag_configure('active', background='#d5f4e6')
+
+        scrollbar = ttk.Scrollbar(recent_frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+
+        recent = TreeRows(tree, render_row=lambda loan: (
+            loan, ('overdue' if loan[4] == 'Overdue' else 'active',)))
+
+        def refresh():
+            cached_stats = self.cached_stats()
 
-            tree.tag_configure('overdue', background='#fadbd8')
-            tree.tag_configure('active', background='#d5f4e6')
+            def fetch(conn):
+                stats = cached_stats or library_db.fetch_one(conn, 'dashboard_stats')
+                return stats, library_db.fetch_all(conn, 'recent_loans')
 
-            scrollbar = ttk.Scrollbar(recent_frame, orient='vertical', command=tree.yview)
-            tree.configure(yscrollcommand=scrollbar.set)
-            tree.pack(side='left', fill='both', expand=True)
-            scrollbar.pack(side='right', fill='y')
+            def show(result):
+                stats, loans = result
+                if not cached_stats:
+                    self.stats_cache = (time.monotonic(), stats)
+                for value_label, value in zip(value_labels, stats):
+                    value_label.configure(text=str(value))
+                recent.sync(loans)
 
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+            self.run_db(fetch, show)
+
+        self.watch_rows('dashboard', 'books', lambda ids: refresh())
+        self.watch_rows('dashboard', 'loans', lambda ids: refresh())
+        return refresh
+
+    def cached_stats(self):
+        # Counters are trigger-maintained (migrations/003); cache briefly per desk
+        if self.stats_cache and time.monotonic() - self.stats_cache[0] < STATS_CACHE_TTL:
+            return self.stats_cache[1]
+        return None
 
     def show_books(self):
-        self.clear_content()
+        self.show_screen('books', self.build_books)
 
-        header_frame = tk.Frame(self.content_frame, bg='#ffffff')
+    def build_books(self, frame):
+        header_frame = tk.Frame(frame, bg='#ffffff')
         header_frame.pack(fill='x', padx=20, pady=20)
 
         tk.Label(header_frame, text="Books Management", font=('Arial', 26, 'bold'),
@@ -247,13 +572,20 @@ class SmartLibraryGUI:
             tk.Button(header_frame, text="+ Add Book", command=self.add_book_dialog,
                       bg='#27ae60', fg='white', font=('Arial', 10, 'bold'),
                       padx=20, pady=8, cursor='hand2', bd=0).pack(side='right', padx=5)
+            tk.Button(header_frame, text="Import...", command=self.import_books_dialog,
+                      bg='#16a085', fg='white', font=('Arial', 10),
+                      padx=20, pady=8, cursor='hand2', bd=0).pack(side='right', padx=5)
+
+        tk.Button(header_frame, text="Export...", command=lambda: self.export_dialog('catalog'),
+                  bg='#7f8c8d', fg='white', font=('Arial', 10),
+                  padx=20, pady=8, cursor='hand2', bd=0).pack(side='right', padx=5)
 
         tk.Button(header_frame, text="↻ Refresh", command=self.show_books,
                   bg='#3498db', fg='white', font=('Arial', 10),
                   padx=20, pady=8, cursor='hand2', bd=0).pack(side='right')
 
         # Search
-        search_frame = tk.Frame(self.content_frame, bg='#ffffff')
+        search_frame = tk.Frame(frame, bg='#ffffff')
         search_frame.pack(fill='x', padx=20, pady=10)
 
         tk.Label(search_frame, text="Search:", bg='#ffffff',
@@ -261,6 +593,8 @@ class SmartLibraryGUI:
 
         search_entry = ttk.Entry(search_frame, font=('Arial', 10), width=40)
         search_entry.pack(side='left')
+        search_entry.bind('<KeyRelease>', lambda e: self.schedule_search(search_entry.get()))
+        search_entry.bind('<Return>', lambda e: self.load_books(search_entry.get()))
 
         tk.Button(search_frame, text="Search",
                   command=lambda: self.load_books(search_entry.get()),
@@ -268,7 +602,7 @@ class SmartLibraryGUI:
                   padx=15, pady=5, cursor='hand2', bd=0).pack(side='left', padx=10)
 
         # Table
-        table_frame = tk.Frame(self.content_frame, bg='#ffffff')
+        table_frame = tk.Frame(frame, bg='#ffffff')
         table_frame.pack(fill='both', expand=True, padx=20, pady=10)
 
         columns = ('ID', 'Title', 'ISBN', 'Author', 'Genre', 'Available')
@@ -278,53 +612,152 @@ class SmartLibraryGUI:
             self.books_tree.heading(col, text=col)
             self.books_tree.column(col, width=150)
 
+        self.books_tree.tag_configure('available', background='#d5f4e6')
+        self.books_tree.tag_configure('borrowed', background='#fadbd8')
+
         scrollbar = ttk.Scrollbar(table_frame, orient='vertical', command=self.books_tree.yview)
-        self.books_tree.configure(yscrollcommand=scrollbar.set)
         self.books_tree.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
 
+        self.books_search = None
+        self.books_shown_term = None
+        self.books_pager = PagedTreeview(self.books_tree, scrollbar, self.fetch_books_page,
+                                         row_key=lambda b: (b[1], b[0]),
+                                         render_row=self.render_book_row,
+                                         page_size=BOOKS_PAGE_SIZE)
+
+        self.also_borrowed_label = tk.Label(frame, text="", bg='#ffffff', fg='#7f8c8d',
+                                            font=('Arial', 9), anchor='w', justify='left',
+                                            wraplength=900)
+        self.also_borrowed_label.pack(fill='x', padx=20)
+        self.books_tree.bind('<<TreeviewSelect>>', self.show_also_borrowed)
+
         if self.current_role == 'Librarian':
-            action_frame = tk.Frame(self.content_frame, bg='#ffffff')
+            action_frame = tk.Frame(frame, bg='#ffffff')
             action_frame.pack(fill='x', padx=20, pady=10)
 
-            tk.Button(action_frame, text="Delete Selected", command=self.delete_book,
+            tk.Button(action_frame, text="Delete Selected", command=self.delete_books,
                       bg='#e74c3c', fg='white', font=('Arial', 10),
                       padx=20, pady=8, cursor='hand2', bd=0).pack(side='left', padx=5)
+            tk.Button(action_frame, text="Edit Selected...", command=self.edit_books_dialog,
+                      bg='#f39c12', fg='white', font=('Arial', 10),
+                      padx=20, pady=8, cursor='hand2', bd=0).pack(side='left', padx=5)
+            tk.Label(action_frame, text="Ctrl+A selects every loaded row", bg='#ffffff',
+                     fg='#95a5a6', font=('Arial', 9)).pack(side='left', padx=10)
+            self.books_tree.bind('<Control-a>', lambda e: self.books_tree.selection_set(
+                self.books_tree.get_children()))
+
+        self.watch_rows('books', 'books', self.patch_books)
+        return lambda: self.load_books(self.books_search or '', refresh=True)
+
+    def load_books(self, search='', refresh=False):
+        # refresh: same term or page window again, patching only changed rows
+        if self.search_after_id:
+            self.root.after_cancel(self.search_after_id)
+            self.search_after_id = None
+
+        search = search.strip()
+        if search == self.books_search and not refresh:
+            return
+        self.books_search = search
 
-        self.load_books()
+        if search and self.replica_ready:
+            def show(rows):
+                if search == self.books_search and self.books_tree.winfo_exists():
+                    self.show_search_results(search, rows)
 
-    def load_books(self, search=''):
-        try:
-            cursor = self.conn.cursor()
-            if search:
-                cursor.execute("""
-                    SELECT b.id, b.title, b.isbn, a.name, b.genre, b.available
-                    FROM books b LEFT JOIN authors a ON b.author_id = a.id
-                    WHERE b.title ILIKE %s OR b.isbn ILIKE %s OR a.name ILIKE %s
-                    ORDER BY b.title
-                """, (f'%{search}%', f'%{search}%', f'%{search}%'))
-            else:
-                cursor.execute("""
-                    SELECT b.id, b.title, b.isbn, a.name, b.genre, b.available
-                    FROM books b LEFT JOIN authors a ON b.author_id = a.id
-                    ORDER BY b.title
-                """)
+            self.db.submit(lambda: self.replica.search_books(search), show,
+                           self.show_db_error, screen=True)
+            return
+
+        if search:
+            if self.book_search is None:
+                self.book_search = book_search.BookSearch(self.database.connect)
+            self.book_search.submit(search)
+            if not self.search_polling:
+                self.search_polling = True
+                self.poll_search()
+            return
+
+        self.books_shown_term = None
+        if refresh:
+            self.books_pager.refresh()
+        else:
+            self.books_pager.reset()
 
-            for item in self.books_tree.get_children():
-                self.books_tree.delete(item)
+    def patch_books(self, ids):
+        search = self.books_search
+        if ids is None:
+            self.load_books(search or '', refresh=True)
+            return
+        if search:
+            # Search hits only change in place; new books show up on the next search
+            ids = [book_id for book_id in ids if str(book_id) in self.books_pager.keys]
+            if not ids:
+                return
+
+        def patch(rows):
+            if search == self.books_search and self.books_tree.winfo_exists():
+                self.books_pager.patch(ids, rows)
+
+        # Not a screen job: no loading overlay for a background patch
+        self.run_db(query('books_by_id', (list(ids),)), patch, screen=False,
+                    on_error=lambda e: None)
+
+    def show_search_results(self, term, rows):
+        # A new term starts at the top; the same term again keeps the scroll position
+        self.books_pager.show_rows(rows, to_top=term != self.books_shown_term)
+        self.books_shown_term = term
+
+    def schedule_search(self, search):
+        # Debounce typing; each new term cancels the search still in flight
+        if self.search_after_id:
+            self.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.root.after(SEARCH_DEBOUNCE_MS,
+                                               lambda: self.load_books(search))
+
+    def poll_search(self):
+        if self.book_search is None:
+            self.search_polling = False
+            return
+        result = self.book_search.poll()
+        if result is None:
+            if self.book_search.busy():
+                self.root.after(SEARCH_POLL_MS, self.poll_search)
+            else:
+                self.search_polling = False
+            return
+        self.search_polling = False
 
-            for book in cursor.fetchall():
-                data = list(book)
-                data[5] = 'Yes' if book[5] else 'No'
-                tag = 'available' if book[5] else 'borrowed'
-                self.books_tree.insert('', 'end', values=data, tags=(tag,))
+        term, rows, error = result
+        if term != self.books_search or not self.books_tree.winfo_exists():
+            return
+        if error is not None:
+            messagebox.showerror("Error", str(error))
+            return
+        self.show_search_results(term, rows)
 
-            self.books_tree.tag_configure('available', background='#d5f4e6')
-            self.books_tree.tag_configure('borrowed', background='#fadbd8')
+    def fetch_books_page(self, direction, key, limit, done):
+        def failed(e):
+            self.books_pager.fail_load()
+            self.show_db_error(e)
 
-            cursor.close()
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+        if self.replica_ready:
+            self.db.submit(lambda: self.replica.books_page(direction, key, limit),
+                           done, failed, screen=True)
+            return
+        self.run_db(lambda conn: library_db.books_page(conn, direction, key, limit),
+                    done, on_error=failed)
+
+    def render_book_row(self, book):
+        # Server rows carry the title's copy counts; replica rows only the flag
+        data = list(book[:6])
+        if len(book) > 7 and book[7] is not None:
+            data[5] = f"{book[6]} of {book[7]}"
+        else:
+            data[5] = 'Yes' if book[5] else 'No'
+        tag = 'available' if book[5] else 'borrowed'
+        return data, (tag,)
 
     def add_book_dialog(self):
         dialog = tk.Toplevel(self.root)
@@ -354,20 +787,21 @@ class SmartLibraryGUI:
 
         tk.Label(frame, text="Author:", bg='#ffffff').pack(anchor='w', pady=(10, 5))
 
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT id, name FROM authors ORDER BY name")
-            authors = cursor.fetchall()
-            cursor.close()
-
-            author_var = tk.StringVar()
-            author_combo = ttk.Combobox(frame, textvariable=author_var,
-                                        font=('Arial', 10), width=43)
-            author_combo['values'] = [f"{a[0]} - {a[1]}" for a in authors]
-            author_combo.pack(fill='x')
-        except:
-            dialog.destroy()
-            return
+        author_var = tk.StringVar()
+        author_combo = ttk.Combobox(frame, textvariable=author_var,
+                                    font=('Arial', 10), width=43)
+        author_combo.pack(fill='x')
+
+        def show_authors(authors):
+            if author_combo.winfo_exists():
+                author_combo['values'] = [f"{a[0]} - {a[1]}" for a in authors]
+
+        def authors_failed(e):
+            if dialog.winfo_exists():
+                dialog.destroy()
+            self.show_db_error(e)
+
+        self.run_cached('author_names', show_authors, screen=False, on_error=authors_failed)
 
         def save():
             if not all([title_entry.get(), isbn_entry.get(), author_var.get()]):
@@ -376,58 +810,349 @@ class SmartLibraryGUI:
 
             try:
                 author_id = int(author_var.get().split(' - ')[0])
-                cursor = self.conn.cursor()
-                cursor.execute("""
-                    INSERT INTO books (title, isbn, genre, author_id, available)
-                    VALUES (%s, %s, %s, %s, TRUE)
-                """, (title_entry.get(), isbn_entry.get(), genre_entry.get(), author_id))
-                self.conn.commit()
+            except ValueError:
+                messagebox.showwarning("Error", "Pick an author from the list")
+                return
+            values = (title_entry.get(), isbn_entry.get(), genre_entry.get(), author_id)
+
+            def insert(conn):
+                cursor = conn.cursor()
+                library_db.execute(cursor, 'book_insert', values)
                 cursor.close()
+
+            def saved(_):
+                self.stats_cache = None
                 messagebox.showinfo("Success", "Book added!")
-                dialog.destroy()
-                self.show_books()
-            except Exception as e:
-                self.conn.rollback()
+                if dialog.winfo_exists():
+                    dialog.destroy()
+                # The new row arrives through the change feed
+                self.sync_replica()
+
+            def failed(e):
+                save_btn.configure(state='normal')
                 messagebox.showerror("Error", str(e))
 
+            save_btn.configure(state='disabled')
+            self.run_db(insert, saved, screen=False, on_error=failed)
+
         btn_frame = tk.Frame(frame, bg='#ffffff')
         btn_frame.pack(pady=30)
 
-        tk.Button(btn_frame, text="Save", command=save, bg='#27ae60',
-                  fg='white', font=('Arial', 11, 'bold'),
-                  padx=30, pady=10, cursor='hand2', bd=0).pack(side='left', padx=5)
+        save_btn = tk.Button(btn_frame, text="Save", command=save, bg='#27ae60',
+                             fg='white', font=('Arial', 11, 'bold'),
+                             padx=30, pady=10, cursor='hand2', bd=0)
+        save_btn.pack(side='left', padx=5)
 
         tk.Button(btn_frame, text="Cancel", command=dialog.destroy,
                   bg='#95a5a6', fg='white', font=('Arial', 11),
                   padx=30, pady=10, cursor='hand2', bd=0).pack(side='left', padx=5)
 
-    def delete_book(self):
+    def import_books_dialog(self):
+        path = filedialog.askopenfilename(
+            title="Import Catalog",
+            filetypes=[("CSV / TSV files", "*.csv *.tsv *.txt"), ("All files", "*.*")])
+        if not path:
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Importing Catalog")
+        dialog.geometry("420x160")
+        dialog.configure(bg='#ffffff')
+        dialog.transient(self.root)
+
+        frame = tk.Frame(dialog, bg='#ffffff', padx=30, pady=20)
+        frame.pack(fill='both', expand=True)
+
+        tk.Label(frame, text="Importing catalog...", font=('Arial', 12, 'bold'),
+                 bg='#ffffff', fg='#2c3e50').pack(anchor='w')
+        bar = ttk.Progressbar(frame, maximum=100, length=360)
+        bar.pack(fill='x', pady=10)
+        status = tk.Label(frame, text="Starting...", bg='#ffffff', fg='#7f8c8d')
+        status.pack(anchor='w')
+
+        # Written by the db worker, read by the Tk thread
+        progress = {'fraction': 0.0, 'rows': 0, 'finished': False}
+
+        def report(fraction, rows):
+            progress['fraction'] = fraction
+            progress['rows'] = rows
+
+        def refresh():
+            if progress['finished'] or not dialog.winfo_exists():
+                return
+            bar['value'] = progress['fraction'] * 100
+            status.configure(text=f"{progress['rows']:,} rows read")
+            dialog.after(200, refresh)
+
+        def done(result):
+            progress['finished'] = True
+            dialog.destroy()
+            self.stats_cache = None
+            # Don't wait for our own NOTIFY to come back
+            self.ref_cache.invalidate('authors')
+            messagebox.showinfo("Import Complete",
+                                f"{result.books_inserted:,} books added, "
+                                f"{result.books_updated:,} updated, "
+                                f"{result.authors_added:,} new authors\n"
+                                f"{result.skipped:,} of {result.rows:,} rows skipped "
+                                f"({result.seconds:.1f}s)")
+            self.sync_replica()
+
+        def failed(e):
+            progress['finished'] = True
+            dialog.destroy()
+            messagebox.showerror("Import Failed", str(e))
+
+        refresh()
+        self.run_db(lambda conn: catalog_import.import_catalog(conn, path, progress=report),
+                    done, screen=False, on_error=failed)
+
+    def selected_book_ids(self):
+        # Item iids are the book ids (PagedTreeview)
         selected = self.books_tree.selection()
         if not selected:
-            messagebox.showwarning("Error", "Select a book")
+            messagebox.showwarning("Error", "Select one or more books")
+        return [int(iid) for iid in selected]
+
+    def show_also_borrowed(self, event=None):
+        selected = self.books_tree.selection()
+        if len(selected) != 1:
+            self.also_borrowed_label.configure(text="")
+            return
+
+        def show(rows):
+            # Skip answers for a selection the user already moved away from
+            if not self.books_tree.winfo_exists() or self.books_tree.selection() != selected:
+                return
+            titles = ", ".join(row[1] for row in rows) or "no recommendations yet"
+            self.also_borrowed_label.configure(
+                text=f"Members who borrowed this also borrowed: {titles}")
+
+        # Best effort: a missing or stale recommendation table is no reason for a dialog
+        self.run_db(query('also_borrowed', (int(selected[0]), RECOMMENDATIONS_SHOWN)), show,
+                    on_error=lambda e: None)
+
+    def books_changed(self, result):
+        # One incremental refresh of our own rows; other desks get the NOTIFY
+        self.stats_cache = None
+        if self.books_tree.winfo_exists():
+            self.patch_books(result.ids)
+        self.sync_replica()
+
+    def delete_books(self):
+        book_ids = self.selected_book_ids()
+        if not book_ids:
+            return
+
+        def confirm(impact):
+            if not impact.books:
+                messagebox.showinfo("Nothing to Delete", str(impact))
+                return
+            if not messagebox.askyesno("Confirm Delete", f"{impact}\n\nContinue?"):
+                return
+
+            def deleted(result):
+                self.books_changed(result)
+                messagebox.showinfo("Success", f"{result}.")
+
+            self.run_db(lambda conn: book_bulk.delete_books(conn, book_ids), deleted,
+                        screen=False)
+
+        # Cascade preview first: loans go with their books (ON DELETE CASCADE)
+        self.run_db(lambda conn: book_bulk.preview_delete(conn, book_ids), confirm,
+                    screen=False)
+
+    def edit_books_dialog(self):
+        book_ids = self.selected_book_ids()
+        if not book_ids:
             return
 
-        book_id = self.books_tree.item(selected[0])['values'][0]
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Edit Books")
+        dialog.geometry("460x500")
+        dialog.configure(bg='#ffffff')
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        frame = tk.Frame(dialog, bg='#ffffff', padx=30, pady=20)
+        frame.pack(fill='both', expand=True)
+
+        tk.Label(frame, text=f"Edit {len(book_ids):,} Book(s)", font=('Arial', 20, 'bold'),
+                 bg='#ffffff', fg='#2c3e50').pack(pady=(0, 10))
+        tk.Label(frame, text="Leave a field blank to keep it as it is.", bg='#ffffff',
+                 fg='#7f8c8d').pack(pady=(0, 15))
+
+        tk.Label(frame, text="Genre:", bg='#ffffff').pack(anchor='w', pady=(10, 5))
+        genre_entry = ttk.Entry(frame, font=('Arial', 10), width=40)
+        genre_entry.pack(fill='x')
 
-        if messagebox.askyesno("Confirm", "Delete this book?"):
+        tk.Label(frame, text="Author:", bg='#ffffff').pack(anchor='w', pady=(10, 5))
+        author_var = tk.StringVar()
+        author_combo = ttk.Combobox(frame, textvariable=author_var,
+                                    font=('Arial', 10), width=38)
+        author_combo.pack(fill='x')
+
+        def show_authors(authors):
+            if author_combo.winfo_exists():
+                author_combo['values'] = [f"{a[0]} - {a[1]}" for a in authors]
+
+        self.run_cached('author_names', show_authors, screen=False, on_error=lambda e: None)
+
+        tk.Label(frame, text="Availability:", bg='#ffffff').pack(anchor='w', pady=(10, 5))
+        available_var = tk.StringVar(value='Unchanged')
+        ttk.Combobox(frame, textvariable=available_var, state='readonly', width=38,
+                     values=('Unchanged', 'Available', 'Unavailable')).pack(fill='x')
+
+        tk.Label(frame, text="Add copies to each book, at branch:",
+                 bg='#ffffff').pack(anchor='w', pady=(10, 5))
+        copies_frame = tk.Frame(frame, bg='#ffffff')
+        copies_frame.pack(fill='x')
+        copies_entry = ttk.Entry(copies_frame, font=('Arial', 10), width=6)
+        copies_entry.pack(side='left')
+        branch_entry = ttk.Entry(copies_frame, font=('Arial', 10))
+        branch_entry.insert(0, book_bulk.DEFAULT_BRANCH)
+        branch_entry.pack(side='left', fill='x', expand=True, padx=(10, 0))
+
+        def save():
+            author_id = None
+            if author_var.get():
+                try:
+                    author_id = int(author_var.get().split(' - ')[0])
+                except ValueError:
+                    messagebox.showwarning("Error", "Pick an author from the list")
+                    return
             try:
-                cursor = self.conn.cursor()
-                cursor.execute("DELETE FROM books WHERE id = %s", (book_id,))
-                self.conn.commit()
-                cursor.close()
-                messagebox.showinfo("Success", "Book deleted!")
-                self.show_books()
-            except Exception as e:
-                self.conn.rollback()
+                copies = int(copies_entry.get() or 0)
+            except ValueError:
+                copies = -1
+            if not 0 <= copies <= 1000:
+                messagebox.showwarning("Error", "Copies must be a number from 0 to 1000")
+                return
+            branch = branch_entry.get().strip() or book_bulk.DEFAULT_BRANCH
+            available = {'Available': True, 'Unavailable': False}.get(available_var.get())
+            changes = {'genre': genre_entry.get().strip() or None, 'author_id': author_id,
+                       'available': available}
+            if all(value is None for value in changes.values()) and not copies:
+                messagebox.showwarning("Error", "Nothing to change")
+                return
+            changes.update(copies=copies, branch=branch)
+
+            def saved(result):
+                if dialog.winfo_exists():
+                    dialog.destroy()
+                self.books_changed(result)
+                messagebox.showinfo("Success", f"{result}.")
+
+            def failed(e):
+                save_btn.configure(state='normal')
                 messagebox.showerror("Error", str(e))
 
+            save_btn.configure(state='disabled')
+            self.run_db(lambda conn: book_bulk.update_books(conn, book_ids, **changes), saved,
+                        screen=False, on_error=failed)
+
+        btn_frame = tk.Frame(frame, bg='#ffffff')
+        btn_frame.pack(pady=25)
+
+        save_btn = tk.Button(btn_frame, text="Apply", command=save, bg='#27ae60',
+                             fg='white', font=('Arial', 11, 'bold'),
+                             padx=30, pady=10, cursor='hand2', bd=0)
+        save_btn.pack(side='left', padx=5)
+
+        tk.Button(btn_frame, text="Cancel", command=dialog.destroy,
+                  bg='#95a5a6', fg='white', font=('Arial', 11),
+                  padx=30, pady=10, cursor='hand2', bd=0).pack(side='left', padx=5)
+
+    def export_dialog(self, report, filters=None):
+        path = filedialog.asksaveasfilename(
+            title=f"Export {report.title()}", initialfile=f"{report}.csv",
+            defaultextension='.csv', filetypes=EXPORT_FILETYPES)
+        if not path:
+            return
+        try:
+            report_export.guess_format(path)
+        except ValueError as e:
+            messagebox.showerror("Export", str(e))
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Exporting")
+        dialog.geometry("420x180")
+        dialog.configure(bg='#ffffff')
+        dialog.transient(self.root)
+
+        frame = tk.Frame(dialog, bg='#ffffff', padx=30, pady=20)
+        frame.pack(fill='both', expand=True)
+
+        tk.Label(frame, text=f"Exporting {report}...", font=('Arial', 12, 'bold'),
+                 bg='#ffffff', fg='#2c3e50').pack(anchor='w')
+        bar = ttk.Progressbar(frame, maximum=100, length=360)
+        bar.pack(fill='x', pady=10)
+        status = tk.Label(frame, text="Starting...", bg='#ffffff', fg='#7f8c8d')
+        status.pack(anchor='w')
+
+        # Runs on its own thread and connection, not a db worker: a large
+        # export takes minutes and must not hold up the screens
+        cancel = threading.Event()
+        progress = {'fraction': 0.0, 'rows': 0, 'result': None, 'error': None}
+
+        def report_progress(fraction, rows):
+            progress['fraction'] = fraction
+            progress['rows'] = rows
+
+        def run():
+            try:
+                conn = self.database.connect()
+                try:
+                    progress['result'] = report_export.export_report(
+                        conn, report, path, filters=filters, progress=report_progress,
+                        cancel=cancel)
+                finally:
+                    conn.close()
+            except Exception as e:
+                progress['error'] = e
+
+        def poll():
+            result, error = progress['result'], progress['error']
+            if result is None and error is None:
+                if dialog.winfo_exists():
+                    bar['value'] = progress['fraction'] * 100
+                    status.configure(text=f"{progress['rows']:,} rows written")
+                else:
+                    # Closed along with the main window (logout)
+                    cancel.set()
+                self.root.after(200, poll)
+                return
+            if dialog.winfo_exists():
+                dialog.destroy()
+            if result is not None:
+                messagebox.showinfo("Export Complete",
+                                    f"{result.rows:,} rows, {result.bytes / 1e6:,.1f} MB "
+                                    f"in {result.seconds:.1f}s\n{result.path}")
+            elif not isinstance(error, report_export.ExportCancelled):
+                messagebox.showerror("Export Failed", str(error))
+
+        tk.Button(frame, text="Cancel", command=cancel.set, bg='#95a5a6', fg='white',
+                  font=('Arial', 10), padx=20, pady=5, cursor='hand2', bd=0).pack(anchor='e')
+        dialog.protocol('WM_DELETE_WINDOW', cancel.set)
+
+        threading.Thread(target=run, name='smartlibrary-export', daemon=True).start()
+        poll()
+
     def show_members(self):
-        self.clear_content()
+        self.show_screen('members', self.build_members)
 
-        tk.Label(self.content_frame, text="Members", font=('Arial', 26, 'bold'),
-                 bg='#ffffff', fg='#2c3e50').pack(pady=20, anchor='w', padx=20)
+    def build_members(self, frame):
+        header_frame = tk.Frame(frame, bg='#ffffff')
+        header_frame.pack(fill='x', padx=20, pady=20)
 
-        table_frame = tk.Frame(self.content_frame, bg='#ffffff')
+        tk.Label(header_frame, text="Members", font=('Arial', 26, 'bold'),
+                 bg='#ffffff', fg='#2c3e50').pack(side='left')
+        tk.Button(header_frame, text="Export...", command=lambda: self.export_dialog('members'),
+                  bg='#7f8c8d', fg='white', font=('Arial', 10),
+                  padx=20, pady=8, cursor='hand2', bd=0).pack(side='right')
+
+        table_frame = tk.Frame(frame, bg='#ffffff')
         table_frame.pack(fill='both', expand=True, padx=20, pady=10)
 
         columns = ('ID', 'Student ID', 'Name', 'Email', 'Contact', 'Active Loans')
@@ -442,27 +1167,41 @@ class SmartLibraryGUI:
         tree.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
 
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                SELECT m.id, m.student_id, u.name, u.email, m.contact,
-                       (SELECT COUNT(*) FROM loans WHERE member_id = m.id AND status = 'Active')
-                FROM members m JOIN users u ON m.user_id = u.id
-                ORDER BY m.student_id
-            """)
-            for member in cursor.fetchall():
-                tree.insert('', 'end', values=member)
-            cursor.close()
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+        rows = TreeRows(tree)
+        return lambda: self.run_read('members_list', rows.sync)
 
     def show_loans(self):
-        self.clear_content()
+        self.show_screen('loans', self.build_loans)
 
-        tk.Label(self.content_frame, text="Loans", font=('Arial', 26, 'bold'),
+    def build_loans(self, frame):
+        tk.Label(frame, text="Loans", font=('Arial', 26, 'bold'),
                  bg='#ffffff', fg='#2c3e50').pack(pady=20, anchor='w', padx=20)
 
-        table_frame = tk.Frame(self.content_frame, bg='#ffffff')
+        # Filters
+        filter_frame = tk.Frame(frame, bg='#ffffff')
+        filter_frame.pack(fill='x', padx=20, pady=10)
+
+        tk.Label(filter_frame, text="Status:", bg='#ffffff',
+                 font=('Arial', 10)).pack(side='left', padx=(0, 5))
+        status_var = tk.StringVar(value='All')
+        ttk.Combobox(filter_frame, textvariable=status_var, state='readonly', width=10,
+                     values=('All', 'Active', 'Overdue', 'Returned')).pack(side='left')
+
+        filters = {}
+        for field, label, width in (('student_id', "Student ID:", 14),
+                                    ('date_from', "From:", 12),
+                                    ('date_to', "To:", 12)):
+            tk.Label(filter_frame, text=label, bg='#ffffff',
+                     font=('Arial', 10)).pack(side='left', padx=(15, 5))
+            entry = ttk.Entry(filter_frame, font=('Arial', 10), width=width)
+            entry.pack(side='left')
+            entry.bind('<Return>', lambda e: apply_filters())
+            filters[field] = entry
+
+        tk.Label(filter_frame, text="(YYYY-MM-DD)", bg='#ffffff', fg='#95a5a6',
+                 font=('Arial', 9)).pack(side='left', padx=5)
+
+        table_frame = tk.Frame(frame, bg='#ffffff')
         table_frame.pack(fill='both', expand=True, padx=20, pady=10)
 
         columns = ('ID', 'Book', 'Member', 'Borrow', 'Due', 'Return', 'Status')
@@ -472,34 +1211,363 @@ class SmartLibraryGUI:
             tree.heading(col, text=col)
             tree.column(col, width=120)
 
+        tree.tag_configure('overdue', background='#fadbd8')
+        tree.tag_configure('active', background='#d5f4e6')
+
+        scrollbar = ttk.Scrollbar(table_frame, orient='vertical', command=tree.yview)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+
+        applied = {}
+
+        def fetch_page(direction, key, limit, done):
+            criteria = dict(applied)
+
+            def failed(e):
+                pager.fail_load()
+                self.show_db_error(e)
+
+            self.run_db(lambda conn: library_db.loans_page(conn, direction, key, limit,
+                                                           **criteria),
+                        done, on_error=failed)
+
+        def render_row(loan):
+            tag = {'Overdue': 'overdue', 'Active': 'active'}.get(loan[6], '')
+            return [value if value is not None else '' for value in loan], (tag,)
+
+        pager = PagedTreeview(tree, scrollbar, fetch_page,
+                              row_key=lambda loan: (loan[3], loan[0]),
+                              render_row=render_row, page_size=LOANS_PAGE_SIZE,
+                              descending=True)
+
+        def patch(ids):
+            if ids is None:
+                pager.refresh()
+                return
+            criteria = dict(applied)
+
+            def apply(rows):
+                if criteria == applied and tree.winfo_exists():
+                    pager.patch(ids, rows)
+
+            self.run_db(lambda conn: library_db.loans_by_id(conn, ids, **criteria), apply,
+                        screen=False, on_error=lambda e: None)
+
+        self.watch_rows('loans', 'loans', patch)
+
+        def apply_filters():
+            criteria = {'status': status_var.get() if status_var.get() != 'All' else None,
+                        'student_id': filters['student_id'].get().strip() or None}
+            for field in ('date_from', 'date_to'):
+                text = filters[field].get().strip()
+                try:
+                    criteria[field] = datetime.strptime(text, '%Y-%m-%d').date() if text else None
+                except ValueError:
+                    messagebox.showwarning("Error", "Dates must be YYYY-MM-DD")
+                    return
+            applied.clear()
+            applied.update(criteria)
+            pager.reset()
+
+        tk.Button(filter_frame, text="Apply", command=apply_filters,
+                  bg='#3498db', fg='white', font=('Arial', 10),
+                  padx=15, pady=5, cursor='hand2', bd=0).pack(side='left', padx=10)
+        # Exports what the applied filters show, the whole history by default
+        tk.Button(filter_frame, text="Export...",
+                  command=lambda: self.export_dialog('loans', dict(applied)),
+                  bg='#7f8c8d', fg='white', font=('Arial', 10),
+                  padx=15, pady=5, cursor='hand2', bd=0).pack(side='right')
+
+        return pager.refresh
+
+    def show_analytics(self):
+        self.show_screen('analytics', self.build_analytics)
+
+    def build_analytics(self, frame):
+        header_frame = tk.Frame(frame, bg='#ffffff')
+        header_frame.pack(fill='x', padx=20, pady=(20, 5))
+
+        tk.Label(header_frame, text="Analytics", font=('Arial', 26, 'bold'),
+                 bg='#ffffff', fg='#2c3e50').pack(side='left')
+
+        window_var = tk.StringVar(value='Last 30 days')
+        window_combo = ttk.Combobox(header_frame, textvariable=window_var, state='readonly',
+                                    width=14, values=list(ANALYTICS_WINDOWS))
+        window_combo.pack(side='right')
+        window_combo.bind('<<ComboboxSelected>>', lambda e: refresh())
+
+        summary_label = tk.Label(frame, text="", bg='#ffffff', fg='#7f8c8d',
+                                 font=('Arial', 10))
+        summary_label.pack(anchor='w', padx=20)
+
+        # Charts: loans per day and by genre, late loans in red
+        chart_frame = tk.Frame(frame, bg='#ffffff')
+        chart_frame.pack(fill='x', padx=20, pady=10)
+        days_canvas = tk.Canvas(chart_frame, bg='#ffffff', height=220, highlightthickness=0)
+        days_canvas.pack(side='left', fill='both', expand=True)
+        genres_canvas = tk.Canvas(chart_frame, bg='#ffffff', height=220, width=380,
+                                  highlightthickness=0)
+        genres_canvas.pack(side='right', fill='y')
+
+        # Top books, members and authors
+        tables_frame = tk.Frame(frame, bg='#ffffff')
+        tables_frame.pack(fill='both', expand=True, padx=20, pady=10)
+
+        tables = {}
+        for i, (dimension, title) in enumerate((('books', "Most Borrowed Books"),
+                                                ('members', "Most Active Members"),
+                                                ('authors', "Most Borrowed Authors"))):
+            box = tk.LabelFrame(tables_frame, text=title, font=('Arial', 12, 'bold'),
+                                bg='#ffffff', padx=10, pady=10)
+            box.grid(row=0, column=i, padx=5, sticky='nsew')
+            tables_frame.columnconfigure(i, weight=1)
+            tree = ttk.Treeview(box, columns=('Name', 'Loans', 'Late'), show='headings',
+                                height=ANALYTICS_TOP)
+            tree.heading('Name', text='Name')
+            tree.heading('Loans', text='Loans')
+            tree.heading('Late', text='Late %')
+            tree.column('Name', width=220)
+            tree.column('Loans', width=70, anchor='e')
+            tree.column('Late', width=70, anchor='e')
+            tree.pack(fill='both', expand=True)
+            tables[dimension] = TreeRows(tree, render_row=lambda entry: (
+                (entry.name, f"{entry.loans:,}", f"{entry.late_rate:.0%}"), ()))
+        tables_frame.rowconfigure(0, weight=1)
+
+        shown = {}
+
+        def draw(event=None):
+            report = shown.get('report')
+            if report is None:
+                return
+            charts.draw_day_bars(days_canvas, "Loans per day (late in red)",
+                                 [(point.day, point.loans, point.late)
+                                  for point in report.series])
+            charts.draw_hbars(genres_canvas, "Loans by genre",
+                              [(entry.name, entry.loans, entry.late)
+                               for entry in report.top['genres']])
+
+        days_canvas.bind('<Configure>', draw)
+        genres_canvas.bind('<Configure>', draw)
+
+        def show(report):
+            shown['report'] = report
+            summary_label.configure(text=str(report))
+            for dimension, rows in tables.items():
+                rows.sync(report.top[dimension])
+            draw()
+
+        def refresh():
+            days = ANALYTICS_WINDOWS[window_var.get()]
+            # Rollups (migrations/012), recounted by the librarians' sweep
+            self.run_db(lambda conn: analytics.report(conn, days, ANALYTICS_TOP), show)
+
+        return refresh
+
+    def show_circulation(self):
+        self.show_screen('circulation', self.build_circulation)
+
+    def build_circulation(self, frame):
+        tk.Label(frame, text="Borrow & Return", font=('Arial', 26, 'bold'),
+                 bg='#ffffff', fg='#2c3e50').pack(pady=20, anchor='w', padx=20)
+
+        # Member
+        member_frame = tk.Frame(frame, bg='#ffffff')
+        member_frame.pack(fill='x', padx=20, pady=5)
+
+        tk.Label(member_frame, text="Student ID:", bg='#ffffff',
+                 font=('Arial', 10)).pack(side='left', padx=(0, 10))
+        student_entry = ttk.Entry(member_frame, font=('Arial', 10), width=20)
+        student_entry.pack(side='left')
+        member_label = tk.Label(member_frame, text="No member selected", bg='#ffffff',
+                                fg='#7f8c8d', font=('Arial', 10))
+        member_label.pack(side='left', padx=15)
+        suggestions_label = tk.Label(frame, text="", bg='#ffffff', fg='#7f8c8d',
+                                     font=('Arial', 9), anchor='w', justify='left',
+                                     wraplength=900)
+        suggestions_label.pack(fill='x', padx=20)
+
+        # Cart of scanned ISBNs or copy barcodes
+        scan_frame = tk.Frame(frame, bg='#ffffff')
+        scan_frame.pack(fill='x', padx=20, pady=5)
+
+        tk.Label(scan_frame, text="ISBN / Barcode:", bg='#ffffff',
+                 font=('Arial', 10)).pack(side='left', padx=(0, 10))
+        isbn_entry = ttk.Entry(scan_frame, font=('Arial', 10), width=20)
+        isbn_entry.pack(side='left')
+
+        table_frame = tk.Frame(frame, bg='#ffffff')
+        table_frame.pack(fill='both', expand=True, padx=20, pady=10)
+
+        columns = ('ISBN / Barcode', 'Result', 'Loan / Hold ID')
+        tree = ttk.Treeview(table_frame, columns=columns, show='headings')
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=200)
+        tree.tag_configure('ok', background='#d5f4e6')
+        tree.tag_configure('failed', background='#fadbd8')
+
         scrollbar = ttk.Scrollbar(table_frame, orient='vertical', command=tree.yview)
         tree.configure(yscrollcommand=scrollbar.set)
         tree.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
 
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                SELECT l.id, b.title, u.name, l.borrow_date, l.due_date, l.return_date, l.status
-                FROM loans l
-                JOIN books b ON l.book_id = b.id
-                JOIN members m ON l.member_id = m.id
-                JOIN users u ON m.user_id = u.id
-                ORDER BY l.borrow_date DESC
-            """)
-            for loan in cursor.fetchall():
-                tree.insert('', 'end', values=loan)
-            cursor.close()
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+        member = {}
+        scanned = []
+
+        def find_member():
+            student_id = student_entry.get().strip()
+            if not student_id:
+                return
+
+            def found(result):
+                member.clear()
+                suggestions_label.configure(text="")
+                if result is None:
+                    member_label.configure(text="No such member", fg='#e74c3c')
+                    return
+                member.update(id=result[0], name=result[1])
+                member_label.configure(text=f"{result[1]} - {result[2]} active loan(s)",
+                                       fg='#2c3e50')
+                isbn_entry.focus_set()
+                self.run_read('member_suggestions', show_suggestions,
+                              params=(result[0], RECOMMENDATIONS_SHOWN), on_error=lambda e: None)
+
+            def show_suggestions(rows):
+                if suggestions_label.winfo_exists():
+                    suggestions_label.configure(
+                        text="Suggested: " + "; ".join(f"{row[1]} ({row[2]})" for row in rows)
+                        if rows else "")
+
+            if self.replica_ready:
+                self.run_read('member_by_student', lambda rows: found(rows[0] if rows else None),
+                              params=(student_id,))
+            else:
+                self.run_db(lambda conn: circulation.find_member(conn, student_id), found)
+
+        def add_isbn():
+            isbn = isbn_entry.get().strip()
+            isbn_entry.delete(0, 'end')
+            if isbn:
+                # Treeview turns digit strings into ints, so keep the cart separately
+                scanned.append(isbn)
+                tree.insert('', 'end', values=(isbn, "In cart", ""))
+
+        def clear_cart():
+            scanned.clear()
+            tree.delete(*tree.get_children())
+
+        def show_results(lines, ok, texts):
+            if not tree.winfo_exists():
+                return
+            clear_cart()
+            # Cart lines carry a loan id, hold lines a hold id
+            for isbn, number, status in lines:
+                tree.insert('', 'end', values=(isbn, texts.get(status, status), number or ""),
+                            tags=('ok' if status in ok or status == 'queued' else 'failed',))
+            self.stats_cache = None
+            self.sync_replica()
+            for button in buttons:
+                button.configure(state='normal')
+            if 'borrowed' in ok:
+                # Refresh the member's active loan count
+                find_member()
+
+        def failed(e):
+            if tree.winfo_exists():
+                for button in buttons:
+                    button.configure(state='normal')
+            self.show_db_error(e)
+
+        def run(work, ok, texts=circulation.STATUS_TEXT):
+            isbns = list(scanned)
+            if not isbns:
+                messagebox.showwarning("Error", "Scan at least one ISBN or barcode")
+                return
+            for button in buttons:
+                button.configure(state='disabled')
+            # Whole cart in one transaction; not tied to the screen so a
+            # checkout is never cancelled halfway by navigating away
+            self.db.submit(lambda: work(isbns), lambda lines: show_results(lines, ok, texts),
+                           failed, screen=False)
+
+        def borrow():
+            if not member:
+                messagebox.showwarning("Error", "Find the member first")
+                return
+            member_id = member['id']
+            if self.replica_ready:
+                # Queued on the replica if the server cannot be reached
+                run(lambda isbns: self.replica.checkout(self.database, member_id, isbns),
+                    ('borrowed',))
+            else:
+                run(lambda isbns: circulation.checkout(self.database, member_id, isbns),
+                    ('borrowed',))
+
+        def give_back():
+            if self.replica_ready:
+                run(lambda isbns: self.replica.checkin(self.database, isbns),
+                    circulation.RETURNED)
+            else:
+                run(lambda isbns: circulation.checkin(self.database, isbns),
+                    circulation.RETURNED)
+
+        def hold(action):
+            # Holds need the server; there is no offline queue for them
+            if not member:
+                messagebox.showwarning("Error", "Find the member first")
+                return
+            member_id = member['id']
+            if action == 'place':
+                run(lambda isbns: hold_queue.place(self.database, member_id, isbns),
+                    ('placed',), hold_queue.STATUS_TEXT)
+            else:
+                run(lambda isbns: hold_queue.cancel(self.database, member_id, isbns),
+                    ('cancelled',), hold_queue.STATUS_TEXT)
+
+        student_entry.bind('<Return>', lambda e: find_member())
+        isbn_entry.bind('<Return>', lambda e: add_isbn())
+
+        tk.Button(member_frame, text="Find", command=find_member,
+                  bg='#3498db', fg='white', font=('Arial', 10),
+                  padx=15, pady=5, cursor='hand2', bd=0).pack(side='left')
+        tk.Button(scan_frame, text="Add", command=add_isbn,
+                  bg='#3498db', fg='white', font=('Arial', 10),
+                  padx=15, pady=5, cursor='hand2', bd=0).pack(side='left', padx=10)
+
+        action_frame = tk.Frame(frame, bg='#ffffff')
+        action_frame.pack(fill='x', padx=20, pady=10)
+
+        buttons = [
+            tk.Button(action_frame, text="Check Out Cart", command=borrow,
+                      bg='#27ae60', fg='white', font=('Arial', 10, 'bold'),
+                      padx=20, pady=8, cursor='hand2', bd=0),
+            tk.Button(action_frame, text="Return Items", command=give_back,
+                      bg='#f39c12', fg='white', font=('Arial', 10),
+                      padx=20, pady=8, cursor='hand2', bd=0),
+            tk.Button(action_frame, text="Place Hold", command=lambda: hold('place'),
+                      bg='#8e44ad', fg='white', font=('Arial', 10),
+                      padx=20, pady=8, cursor='hand2', bd=0),
+            tk.Button(action_frame, text="Cancel Hold", command=lambda: hold('cancel'),
+                      bg='#7f8c8d', fg='white', font=('Arial', 10),
+                      padx=20, pady=8, cursor='hand2', bd=0),
+            tk.Button(action_frame, text="Clear", command=clear_cart,
+                      bg='#95a5a6', fg='white', font=('Arial', 10),
+                      padx=20, pady=8, cursor='hand2', bd=0),
+        ]
+        for button in buttons:
+            button.pack(side='left', padx=5)
+
+        return student_entry.focus_set
 
     def show_authors(self):
-        self.clear_content()
+        self.show_screen('authors', self.build_authors)
 
-        tk.Label(self.content_frame, text="Authors", font=('Arial', 26, 'bold'),
+    def build_authors(self, frame):
+        tk.Label(frame, text="Authors", font=('Arial', 26, 'bold'),
                  bg='#ffffff', fg='#2c3e50').pack(pady=20, anchor='w', padx=20)
 
-        table_frame = tk.Frame(self.content_frame, bg='#ffffff')
+        table_frame = tk.Frame(frame, bg='#ffffff')
         table_frame.pack(fill='both', expand=True, padx=20, pady=10)
 
         columns = ('ID', 'Name', 'Bio')
@@ -514,22 +1582,17 @@ class SmartLibraryGUI:
         tree.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
 
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT id, name, bio FROM authors ORDER BY name")
-            for author in cursor.fetchall():
-                tree.insert('', 'end', values=author)
-            cursor.close()
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+        rows = TreeRows(tree)
+        return lambda: self.run_cached('authors_list', rows.sync)
 
     def show_book_clubs(self):
-        self.clear_content()
+        self.show_screen('book_clubs', self.build_book_clubs)
 
-        tk.Label(self.content_frame, text="Book Clubs", font=('Arial', 26, 'bold'),
+    def build_book_clubs(self, frame):
+        tk.Label(frame, text="Book Clubs", font=('Arial', 26, 'bold'),
                  bg='#ffffff', fg='#2c3e50').pack(pady=20, anchor='w', padx=20)
 
-        table_frame = tk.Frame(self.content_frame, bg='#ffffff')
+        table_frame = tk.Frame(frame, bg='#ffffff')
         table_frame.pack(fill='both', expand=True, padx=20, pady=10)
 
         columns = ('ID', 'Name', 'Description', 'Members')
@@ -544,31 +1607,152 @@ class SmartLibraryGUI:
         tree.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
 
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                SELECT bc.id, bc.name, bc.description,
-                       (SELECT COUNT(*) FROM book_club_members WHERE club_id = bc.id)
-                FROM book_clubs bc
-                ORDER BY bc.name
-            """)
-            for club in cursor.fetchall():
-                tree.insert('', 'end', values=club)
-            cursor.close()
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-
-    def clear_content(self):
-        for widget in self.content_frame.winfo_children():
-            widget.destroy()
+        rows = TreeRows(tree)
+        return lambda: self.run_cached('clubs_list', rows.sync)
+
+    def show_diagnostics(self):
+        self.show_screen('diagnostics', self.build_diagnostics)
+
+    def build_diagnostics(self, frame):
+        tk.Label(frame, text="Diagnostics", font=('Arial', 26, 'bold'),
+                 bg='#ffffff', fg='#2c3e50').pack(pady=20, anchor='w', padx=20)
+
+        summary_label = tk.Label(frame, text="", font=('Arial', 10),
+                                 bg='#ffffff', fg='#7f8c8d', justify='left')
+        summary_label.pack(anchor='w', padx=20)
+
+        columns = ('Statement', 'Calls', 'Mean ms', 'p95 ms', 'Max ms', 'Rows', 'Errors',
+                   'Call Site')
+        trees = []
+        for title in ("Slowest Statements (p95)", "Most Frequent Statements"):
+            box = tk.LabelFrame(frame, text=title, font=('Arial', 12, 'bold'),
+                                bg='#ffffff', padx=10, pady=5)
+            box.pack(fill='both', expand=True, padx=20, pady=5)
+            tree = ttk.Treeview(box, columns=columns, show='headings', height=6)
+            for col in columns:
+                tree.heading(col, text=col)
+                tree.column(col, width=260 if col in ('Statement', 'Call Site') else 80)
+            tree.pack(fill='both', expand=True)
+            trees.append(tree)
+
+        slow_frame = tk.LabelFrame(frame,
+                                   text=f"Slow Queries (over {query_metrics.metrics.slow_ms:g} ms)",
+                                   font=('Arial', 12, 'bold'), bg='#ffffff', padx=10, pady=5)
+        slow_frame.pack(fill='both', expand=True, padx=20, pady=5)
+        slow_tree = ttk.Treeview(slow_frame, columns=('Time', 'ms', 'Statement', 'Call Site'),
+                                 show='headings', height=5)
+        for col, width in (('Time', 90), ('ms', 80), ('Statement', 400), ('Call Site', 260)):
+            slow_tree.heading(col, text=col)
+            slow_tree.column(col, width=width)
+        slow_tree.pack(side='left', fill='both', expand=True)
+        plan_text = tk.Text(slow_frame, height=8, width=60, font=('Courier', 9))
+        plan_text.pack(side='right', fill='both', expand=True, padx=(10, 0))
+
+        plans = {}
+
+        def show_plan(event):
+            plan_text.delete('1.0', 'end')
+            for item in slow_tree.selection():
+                plan_text.insert('end', plans.get(item) or "(plan not captured)")
+
+        slow_tree.bind('<<TreeviewSelect>>', show_plan)
+
+        def refresh():
+            for tree, by in zip(trees, ('p95_ms', 'calls')):
+                tree.delete(*tree.get_children())
+                for key, s in query_metrics.metrics.top(by, DIAGNOSTICS_TOP):
+                    tree.insert('', 'end', values=(
+                        key, s['calls'], f"{s['mean_ms']:.1f}", f"{s['p95_ms']:.1f}",
+                        f"{s['max_ms']:.1f}", s['rows'], s['errors'], s['site']))
+            slow_tree.delete(*slow_tree.get_children())
+            plans.clear()
+            for logged, key, ms, site, plan in reversed(query_metrics.metrics.slow_queries()):
+                item = slow_tree.insert('', 'end', values=(
+                    datetime.fromtimestamp(logged).strftime('%H:%M:%S'), f"{ms:.1f}", key, site))
+                plans[item] = plan
+            cache = self.ref_cache.stats()
+            summary_label.configure(text=(
+                f"Reference cache: {cache['entries']} entries, "
+                f"{cache['hit_rate']:.0%} hit rate ({cache['hits']} hits, {cache['misses']} misses), "
+                f"{cache['invalidations']} invalidations, "
+                f"{'listening' if cache['listening'] else 'not listening'}"))
+
+        def reset():
+            query_metrics.metrics.reset()
+            refresh()
+
+        buttons = tk.Frame(frame, bg='#ffffff')
+        buttons.pack(fill='x', padx=20, pady=10)
+        tk.Button(buttons, text="Refresh", command=refresh, bg='#3498db', fg='white',
+                  font=('Arial', 10, 'bold'), padx=15, pady=6, cursor='hand2',
+                  bd=0).pack(side='left', padx=5)
+        tk.Button(buttons, text="Reset", command=reset, bg='#e74c3c', fg='white',
+                  font=('Arial', 10, 'bold'), padx=15, pady=6, cursor='hand2',
+                  bd=0).pack(side='left', padx=5)
+
+        return refresh
+
+    def show_screen(self, name, build):
+        # Screens are built on first use and kept: switching hides the current
+        # frame and re-shows the cached one, which then refreshes its rows.
+        # build(frame) fills the frame and returns that refresh function.
+        self.leave_screen()
+        if name not in self.screens:
+            frame = tk.Frame(self.content_frame, bg='#ffffff')
+            self.screens[name] = (frame, build(frame))
+        if self.current_screen not in (None, name):
+            self.screens[self.current_screen][0].pack_forget()
+        frame, refresh = self.screens[name]
+        frame.pack(fill='both', expand=True)
+        self.current_screen = name
+        refresh()
+
+    def leave_screen(self):
+        # Whatever the previous screen was still loading is no longer wanted
+        self.db.cancel_screen()
+        if self.search_after_id:
+            self.root.after_cancel(self.search_after_id)
+            self.search_after_id = None
 
     def logout(self):
-        if self.conn:
-            self.conn.close()
+        self.db.cancel_screen()
+        if self.replica_after_id:
+            self.root.after_cancel(self.replica_after_id)
+            self.replica_after_id = None
+        self.replica_label = None
+        self.root.unbind('<Control-D>')
+        if self.row_changes_after_id:
+            self.root.after_cancel(self.row_changes_after_id)
+            self.row_changes_after_id = None
+        if self.sweep_after_id:
+            self.root.after_cancel(self.sweep_after_id)
+            self.sweep_after_id = None
+        if self.book_search:
+            self.book_search.close()
+            self.book_search = None
         self.current_user = None
         self.current_role = None
+        self.stats_cache = None
+        self.loading_label = None
+        self.screens.clear()
+        self.row_watchers.clear()
+        self.current_screen = None
         self.show_login()
 
+    def on_close(self):
+        self.db.shutdown()
+        if self.metrics_after_id:
+            self.root.after_cancel(self.metrics_after_id)
+        if self.feed:
+            self.feed.stop()
+        if self.book_search:
+            self.book_search.close()
+        if self.replica is not None:
+            self.replica.close()
+        if self.database is not None:
+            self.database.close()
+        self.root.destroy()
+
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,60 @@
+from collections import namedtuple
+from datetime import date, timedelta
+
+import library_db
+
+DEFAULT_DAYS = 30
+DEFAULT_TOP = 10
+DIMENSIONS = ('books', 'members', 'authors', 'genres')
+
+DayCount = namedtuple('DayCount', 'day loans late')
+
+
+class Ranked(namedtuple('Ranked', 'key name loans late')):
+    @property
+    def late_rate(self):
+        return self.late / self.loans if self.loans else 0.0
+
+    def __str__(self):
+        return f"{self.name}: {self.loans:,} loans, {self.late_rate:.0%} late"
+
+
+class Report(namedtuple('Report', 'since series top')):
+    """Loans per day from `since` on, and the top entries per dimension."""
+
+    @property
+    def loans(self):
+        return sum(point.loans for point in self.series)
+
+    @property
+    def late_rate(self):
+        return sum(point.late for point in self.series) / self.loans if self.loans else 0.0
+
+    def __str__(self):
+        return (f"{self.loans:,} loans since {self.since}, {self.late_rate:.1%} late "
+                f"(overdue or returned after the due date)")
+
+
+def refresh_rollups(db):
+    """Recount the days whose loans changed; returns how many days."""
+    return db.run(lambda conn: library_db.fetch_one(conn, 'refresh_loan_rollups')[0])
+
+
+def loans_per_day(conn, since):
+    # Every day up to today, including the ones without loans
+    counts = {day: (loans, late)
+              for day, loans, late in library_db.fetch_all(conn, 'loans_per_day', (since,))}
+    days = (date.today() - since).days + 1
+    return [DayCount(day, *counts.get(day, (0, 0)))
+            for day in (since + timedelta(days=i) for i in range(days))]
+
+
+def top(conn, dimension, since, limit=DEFAULT_TOP):
+    rows = library_db.fetch_all(conn, f'top_{dimension}', (since, limit))
+    return [Ranked(*row) for row in rows]
+
+
+def report(conn, days=DEFAULT_DAYS, limit=DEFAULT_TOP):
+    since = date.today() - timedelta(days=days - 1)
+    return Report(since, loans_per_day(conn, since),
+                  {dimension: top(conn, dimension, since, limit) for dimension in DIMENSIONS})
@@ -0,0 +1,86 @@
+import asyncio
+import math
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+
+class LoadResult(namedtuple('LoadResult', 'requests errors not_modified seconds latencies')):
+    @property
+    def rate(self):
+        return self.requests / self.seconds if self.seconds else 0.0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+    def __str__(self):
+        return (f"{self.requests:,} requests in {self.seconds:.2f}s = {self.rate:,.0f} req/s; "
+                f"p50 {self.percentile(50) * 1000:.1f} ms, p99 {self.percentile(99) * 1000:.1f} ms; "
+                f"{self.errors} errors, {self.not_modified} not modified")
+
+
+async def _read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length') or 0)
+    if length:
+        await reader.readexactly(length)
+    return status, headers
+
+
+async def _client(host, port, target, count, conditional, token, result):
+    reader, writer = await asyncio.open_connection(host, port)
+    etag = None
+    auth = f'Authorization: Bearer {token}\r\n' if token else ''
+    try:
+        for _ in range(count):
+            extra = auth + (f'If-None-Match: {etag}\r\n' if conditional and etag else '')
+            request = f'GET {target} HTTP/1.1\r\nHost: {host}\r\n{extra}\r\n'.encode('latin-1')
+            started = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, headers = await _read_response(reader)
+            result['latencies'].append(time.perf_counter() - started)
+            if status == 304:
+                result['not_modified'] += 1
+            elif status >= 400:
+                result['errors'] += 1
+            etag = headers.get('etag', etag)
+    finally:
+        writer.close()
+
+
+async def _run(url, concurrency, requests, conditional, token):
+    parts = urlsplit(url)
+    target = parts.path or '/'
+    if parts.query:
+        target += '?' + parts.query
+    port = parts.port or 80
+
+    result = {'latencies': [], 'errors': 0, 'not_modified': 0}
+    per_client = [requests // concurrency + (1 if i < requests % concurrency else 0)
+                  for i in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.gather(*(_client(parts.hostname, port, target, count, conditional, token,
+                                   result)
+                           for count in per_client if count))
+    return LoadResult(len(result['latencies']), result['errors'], result['not_modified'],
+                      time.perf_counter() - started, result['latencies'])
+
+
+def load_test(url, concurrency=32, requests=2000, conditional=False, token=None):
+    """Hit one GET endpoint from `concurrency` keep-alive connections.
+
+    With conditional=True every client replays the last ETag it saw, so
+    the run measures the 304 Not Modified path. The token is sent as a
+    bearer token on every request.
+    """
+    return asyncio.run(_run(url, concurrency, requests, conditional, token))
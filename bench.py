@@ -0,0 +1,204 @@
+import json
+import os
+import statistics
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+import library_db
+from book_search import search_books
+
+DEFAULT_ITERATIONS = 20
+WARMUP = 2
+# A query regresses when its median is this much slower than the baseline
+# *and* at least MIN_REGRESSION_MS slower (sub-millisecond noise is ignored)
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_MS = 1.0
+
+Timing = namedtuple('Timing', 'name median_ms p95_ms min_ms rows')
+
+SAMPLE_SQL = {
+    'username': "SELECT username FROM users ORDER BY id LIMIT 1",
+    # The busiest borrower: the worst case for the member filter
+    'student_id': """
+        SELECT m.student_id FROM loans l JOIN members m ON m.id = l.member_id
+        GROUP BY m.student_id
+        ORDER BY COUNT(*) DESC
+        LIMIT 1
+    """,
+    'middle_title': """
+        SELECT title, id FROM books ORDER BY title, id
+        OFFSET (SELECT COUNT(*) / 2 FROM books) LIMIT 1
+    """,
+    'isbn': "SELECT isbn FROM books ORDER BY id DESC LIMIT 1",
+    'title_word': "SELECT split_part(title, ' ', 1) FROM books ORDER BY id LIMIT 1",
+    # Filled in by library_cli.py recommend build; 0 (no rows) before that
+    'popular_book': "SELECT book_id FROM book_borrowers ORDER BY borrowers DESC LIMIT 1",
+    'member_id': "SELECT member_id FROM member_suggestions ORDER BY member_id LIMIT 1",
+    # The title with the most copies: availability must not grow with them
+    'most_copies': "SELECT book_id FROM copy_counts ORDER BY total DESC LIMIT 1",
+}
+
+
+def sample_inputs(conn):
+    # Parameters that exist in whatever data is loaded (demo or generated)
+    cursor = conn.cursor()
+    inputs = {}
+    try:
+        for name, sql in SAMPLE_SQL.items():
+            cursor.execute(sql)
+            row = cursor.fetchone()
+            inputs[name] = (row if len(row) > 1 else row[0]) if row else None
+    finally:
+        cursor.close()
+    conn.rollback()
+    return inputs
+
+
+def gui_queries(inputs):
+    """(name, work(conn)) for every query the screens issue."""
+    def statement(name, params=()):
+        return lambda conn: library_db.fetch_all(conn, name, params)
+
+    middle = tuple(inputs['middle_title'] or ('', 0))
+    return [
+        ('login', statement('login', (inputs['username'],))),
+        ('dashboard_stats', statement('dashboard_stats')),
+        ('recent_loans', statement('recent_loans')),
+        ('books_first_page', lambda conn: library_db.books_page(conn, 'after', None, 200)),
+        ('books_middle_page', lambda conn: library_db.books_page(conn, 'after', middle, 200)),
+        ('books_prev_page', lambda conn: library_db.books_page(conn, 'before', middle, 200)),
+        ('search_title', lambda conn: search_books(conn, inputs['title_word'] or 'a')),
+        ('search_isbn', lambda conn: search_books(conn, inputs['isbn'] or '0000000000')),
+        ('members_list', statement('members_list')),
+        ('member_by_student', statement('member_by_student', (inputs['student_id'],))),
+        ('loans_first_page', lambda conn: library_db.loans_page(conn, 'after', None, 200)),
+        ('loans_overdue', lambda conn: library_db.loans_page(conn, 'after', None, 200,
+                                                             status='Overdue')),
+        ('loans_member', lambda conn: library_db.loans_page(
+            conn, 'after', None, 200, student_id=inputs['student_id'])),
+        ('loans_last_month', lambda conn: library_db.loans_page(
+            conn, 'after', None, 200, date_from=date.today() - timedelta(days=30))),
+        ('author_names', statement('author_names')),
+        ('authors_list', statement('authors_list')),
+        ('clubs_list', statement('clubs_list')),
+        ('also_borrowed', statement('also_borrowed', (inputs['popular_book'] or 0, 5))),
+        ('member_suggestions', statement('member_suggestions', (inputs['member_id'] or 0, 5))),
+        ('books_by_id', statement('books_by_id', ([inputs['most_copies'] or 0],))),
+    ]
+
+
+class _ExplainCursor:
+    # Runs EXPLAIN (ANALYZE, BUFFERS) in place of each query and keeps the plans
+    def __init__(self, conn, plans):
+        self.conn = conn
+        self.cursor = conn.raw.cursor()
+        self.plans = plans
+        self.itersize = 0
+
+    @property
+    def connection(self):
+        return self.conn
+
+    def execute(self, sql, params=None):
+        if sql.lstrip().upper().startswith('PREPARE'):
+            self.cursor.execute(sql, params)
+            return
+        self.cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+        self.plans.append('\n'.join(row[0] for row in self.cursor.fetchall()))
+
+    def fetchall(self):
+        return []
+
+    def fetchmany(self, size=None):
+        return []
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        self.cursor.close()
+
+
+class _ExplainConnection:
+    def __init__(self, raw):
+        self.raw = raw
+        self.plans = []
+
+    @property
+    def prepared(self):
+        return self.raw.prepared
+
+    def cursor(self, name=None):
+        # Named (server-side) cursors cannot DECLARE an EXPLAIN
+        return _ExplainCursor(self, self.plans)
+
+
+def explain(conn, work):
+    proxy = _ExplainConnection(conn)
+    try:
+        work(proxy)
+    finally:
+        conn.rollback()
+    return proxy.plans
+
+
+def time_query(conn, work, iterations):
+    for _ in range(WARMUP):
+        work(conn)
+        conn.rollback()
+    samples, rows = [], 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = work(conn)
+        samples.append((time.perf_counter() - started) * 1000)
+        conn.rollback()
+        rows = len(result) if result is not None else 0
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return statistics.median(samples), p95, samples[0], rows
+
+
+def run_benchmarks(conn, iterations=DEFAULT_ITERATIONS, plans_dir=None, only=None):
+    """Time every GUI query on conn; optionally write one plan file per query."""
+    inputs = sample_inputs(conn)
+    timings = []
+    for name, work in gui_queries(inputs):
+        if only and name not in only:
+            continue
+        median, p95, fastest, rows = time_query(conn, work, iterations)
+        timings.append(Timing(name, median, p95, fastest, rows))
+        if plans_dir:
+            os.makedirs(plans_dir, exist_ok=True)
+            with open(os.path.join(plans_dir, f'{name}.txt'), 'w', encoding='utf-8') as f:
+                f.write('\n\n'.join(explain(conn, work)) + '\n')
+    return timings
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path, timings):
+    baseline = {t.name: {'median_ms': round(t.median_ms, 3), 'p95_ms': round(t.p95_ms, 3)}
+                for t in timings}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def regressions(timings, baseline, tolerance=DEFAULT_TOLERANCE):
+    """(timing, baseline median) for every query slower than the baseline allows."""
+    slower = []
+    for timing in timings:
+        expected = baseline.get(timing.name, {}).get('median_ms')
+        if expected is None:
+            continue
+        if (timing.median_ms > expected * (1 + tolerance)
+                and timing.median_ms - expected > MIN_REGRESSION_MS):
+            slower.append((timing, expected))
+    return slower
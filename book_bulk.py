@@ -0,0 +1,146 @@
+from collections import namedtuple
+
+import library_db
+
+OPEN_LOAN = ("EXISTS (SELECT 1 FROM loans o WHERE o.book_id = b.id "
+             "AND o.status IN ('Active', 'Overdue'))")
+
+DEFAULT_BRANCH = 'Main'
+
+# Availability moves copies between the shelf and withdrawn; copies on
+# loan, on the hold shelf, lost or in repair stay as they are
+SHELVE_COPIES_SQL = """
+    UPDATE copies c SET status = %s
+    WHERE c.book_id = ANY(%s) AND c.status = %s
+    RETURNING c.book_id
+"""
+
+ADD_COPIES_SQL = """
+    INSERT INTO copies (book_id, branch)
+    SELECT b.id, %s FROM books b CROSS JOIN generate_series(1, %s)
+    WHERE b.id = ANY(%s)
+    ORDER BY b.id
+    RETURNING book_id
+"""
+
+
+class DeleteImpact(namedtuple('DeleteImpact', 'books on_loan loans')):
+    def __str__(self):
+        text = (f"{self.books:,} book(s) will be deleted along with "
+                f"{self.loans:,} past loan record(s).")
+        if self.on_loan:
+            text += f"\n{self.on_loan:,} selected book(s) are on loan and will be kept."
+        return text
+
+
+class BulkResult(namedtuple('BulkResult', 'ids skipped')):
+    def __str__(self):
+        text = f"{len(self.ids):,} book(s) changed"
+        if self.skipped:
+            text += f", {self.skipped:,} skipped (no copy to change, or gone)"
+        return text
+
+
+def _lock_books(cursor, ids):
+    # Same id order as return_books, so a batch and a return queue
+    # instead of deadlocking; once locked, no desk can lend these books
+    # before the next statement looks at their loans
+    cursor.execute("SELECT id FROM books WHERE id = ANY(%s) ORDER BY id FOR UPDATE", (ids,))
+
+
+def preview_delete(conn, ids):
+    """What deleting these books would cascade to in loans."""
+    return DeleteImpact(*library_db.fetch_one(conn, 'books_delete_impact', (list(ids),)))
+
+
+def delete_books(conn, ids):
+    """Delete the books that are not on loan, with their loan history.
+
+    One statement for the whole selection, in the caller's transaction.
+    """
+    ids = list(ids)
+    cursor = conn.cursor()
+    try:
+        _lock_books(cursor, ids)
+        cursor.execute(f"DELETE FROM books b WHERE b.id = ANY(%s) AND NOT {OPEN_LOAN} "
+                       f"RETURNING b.id", (ids,))
+        deleted = [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+    return BulkResult(deleted, len(ids) - len(deleted))
+
+
+def update_books(conn, ids, genre=None, author_id=None, available=None, copies=0,
+                 branch=DEFAULT_BRANCH):
+    """Set genre, author and/or availability on every book in ids, and add copies.
+
+    None leaves a field as it is. Making books unavailable withdraws their
+    copies on the shelf; making them available puts withdrawn copies back.
+    Copies that reach the shelf, new ones included, go to the hold queue first.
+    """
+    ids = list(ids)
+    assignments, params = [], []
+    for column, value in (('genre', genre), ('author_id', author_id)):
+        if value is not None:
+            assignments.append(f"{column} = %s")
+            params.append(value)
+    if not assignments and available is None and not copies:
+        return BulkResult([], 0)
+
+    updated = set()
+    cursor = conn.cursor()
+    try:
+        _lock_books(cursor, ids)
+        if assignments:
+            cursor.execute(f"UPDATE books b SET {', '.join(assignments)} "
+                           f"WHERE b.id = ANY(%s) RETURNING b.id", params + [ids])
+            updated.update(row[0] for row in cursor.fetchall())
+        shelved = set()
+        if available is not None:
+            moves = ('Available', 'Withdrawn') if available else ('Withdrawn', 'Available')
+            cursor.execute(SHELVE_COPIES_SQL, (moves[0], ids, moves[1]))
+            changed = {row[0] for row in cursor.fetchall()}
+            updated |= changed
+            if available:
+                shelved |= changed
+        if copies:
+            cursor.execute(ADD_COPIES_SQL, (branch, copies, ids))
+            shelved.update(row[0] for row in cursor.fetchall())
+            updated |= shelved
+        if shelved:
+            cursor.execute("SELECT allocate_holds(%s)", (sorted(shelved),))
+    finally:
+        cursor.close()
+    updated = sorted(updated)
+    return BulkResult(updated, len(ids) - len(updated))
+
+
+def update_copies(conn, barcodes, status=None, condition=None, branch=None):
+    """Set status, condition and/or branch on the copies with these barcodes.
+
+    Copies on loan or on the hold shelf keep their status. Copies put back
+    on the shelf go to the hold queue first. Returns the barcodes changed.
+    """
+    barcodes = list(barcodes)
+    assignments, params = [], []
+    for column, value in (('status', status), ('condition', condition), ('branch', branch)):
+        if value is not None:
+            assignments.append(f"{column} = %s")
+            params.append(value)
+    if not assignments:
+        return []
+
+    condition_sql = "AND c.status NOT IN ('OnLoan', 'OnHold')" if status else ""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT DISTINCT book_id FROM copies WHERE barcode = ANY(%s)", (barcodes,))
+        _lock_books(cursor, [row[0] for row in cursor.fetchall()])
+        cursor.execute(f"UPDATE copies c SET {', '.join(assignments)} "
+                       f"WHERE c.barcode = ANY(%s) {condition_sql} "
+                       f"RETURNING c.barcode, c.book_id", params + [barcodes])
+        rows = cursor.fetchall()
+        if status == 'Available' and rows:
+            cursor.execute("SELECT allocate_holds(%s)", (sorted({row[1] for row in rows}),))
+    finally:
+        cursor.close()
+    return [row[0] for row in rows]
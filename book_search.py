@@ -0,0 +1,164 @@
+import re
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+SEARCH_LIMIT = 200
+
+ISBN_PATTERN = re.compile(r'^[0-9Xx-]{10,17}$')
+ISBN_PREFIX_PATTERN = re.compile(r'^[0-9][0-9Xx-]{2,16}$')
+
+ISBN_SQL = """
+    SELECT b.id, b.title, b.isbn, a.name, b.genre, b.available, cc.available, cc.total
+    FROM books b LEFT JOIN authors a ON b.author_id = a.id
+    LEFT JOIN copy_counts cc ON cc.book_id = b.id
+    WHERE b.isbn = %s
+"""
+
+# Every branch is served by an index (tsvector or trigram GIN, or the
+# text_pattern_ops index for ISBN prefixes); the best score per book wins
+# and only the top rows are joined for display.
+RANKED_SQL = """
+    WITH q AS (SELECT to_tsquery('simple', %(tsquery)s) AS tsq),
+    hits AS (
+        SELECT b.id, ts_rank(b.search_vector, q.tsq) * 2 AS score
+        FROM books b, q
+        WHERE b.search_vector @@ q.tsq
+        UNION ALL
+        SELECT b.id, ts_rank(a.search_vector, q.tsq)
+        FROM authors a JOIN books b ON b.author_id = a.id, q
+        WHERE a.search_vector @@ q.tsq
+        UNION ALL
+        SELECT b.id, similarity(b.title, %(term)s)
+        FROM books b
+        WHERE b.title %% %(term)s
+        UNION ALL
+        SELECT b.id, similarity(a.name, %(term)s) * 0.5
+        FROM authors a JOIN books b ON b.author_id = a.id
+        WHERE a.name %% %(term)s
+        UNION ALL
+        SELECT b.id, 2.0
+        FROM books b
+        WHERE b.isbn LIKE %(isbn_prefix)s
+    ),
+    top AS (
+        SELECT id, MAX(score) AS score
+        FROM hits
+        GROUP BY id
+        ORDER BY score DESC
+        LIMIT %(limit)s
+    )
+    SELECT b.id, b.title, b.isbn, a.name, b.genre, b.available, cc.available, cc.total
+    FROM top
+    JOIN books b ON b.id = top.id
+    LEFT JOIN authors a ON b.author_id = a.id
+    LEFT JOIN copy_counts cc ON cc.book_id = b.id
+    ORDER BY top.score DESC, b.title
+"""
+
+
+def prefix_tsquery(term):
+    words = re.findall(r'\w+', term.lower())
+    return ' & '.join(f'{word}:*' for word in words)
+
+
+def search_books(conn, term, limit=SEARCH_LIMIT):
+    term = term.strip()
+    cursor = conn.cursor()
+    try:
+        if ISBN_PATTERN.match(term):
+            cursor.execute(ISBN_SQL, (term.replace('-', '').upper(),))
+            rows = cursor.fetchall()
+            if rows:
+                return rows
+
+        tsquery = prefix_tsquery(term)
+        if not tsquery:
+            return []
+        isbn_prefix = None
+        if ISBN_PREFIX_PATTERN.match(term):
+            isbn_prefix = term.replace('-', '').upper() + '%'
+        cursor.execute(RANKED_SQL, {'tsquery': tsquery, 'term': term,
+                                    'isbn_prefix': isbn_prefix, 'limit': limit})
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+class BookSearch:
+    """Runs searches on a dedicated connection in a background thread.
+
+    Only the most recent term is kept; submitting a new one cancels the
+    query still running for the previous term. Finished searches are
+    handed to the GUI through poll() as (term, rows, error).
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.conn = None
+        self.cond = threading.Condition()
+        self.pending = None
+        self.running = None
+        self.result = None
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, term):
+        with self.cond:
+            self.pending = term
+            self.result = None
+            if self.running is not None and self.conn is not None:
+                self.conn.cancel()
+            self.cond.notify()
+
+    def poll(self):
+        with self.cond:
+            result, self.result = self.result, None
+            return result
+
+    def busy(self):
+        with self.cond:
+            return self.pending is not None or self.running is not None
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            if self.running is not None and self.conn is not None:
+                self.conn.cancel()
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    break
+                term, self.pending = self.pending, None
+                self.running = term
+
+            rows, error, canceled = None, None, False
+            try:
+                if self.conn is None or self.conn.closed:
+                    self.conn = self.connect()
+                    self.conn.autocommit = True
+                rows = search_books(self.conn, term)
+            except psycopg2.extensions.QueryCanceledError:
+                canceled = True
+            except Exception as e:
+                error = e
+
+            with self.cond:
+                self.running = None
+                if self.pending is None and not self.closed:
+                    if canceled:
+                        # A late cancel hit this query instead of the one it targeted
+                        self.pending = term
+                    else:
+                        self.result = (term, rows, error)
+
+        if self.conn is not None:
+            self.conn.close()
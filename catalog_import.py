@@ -0,0 +1,208 @@
+import csv
+import io
+import os
+import time
+from collections import namedtuple
+
+ImportResult = namedtuple('ImportResult', 'rows skipped authors_added books_inserted '
+                                          'books_updated seconds')
+
+# Header aliases, including MARC-style tag columns (245$a title, 020$a ISBN, ...)
+COLUMN_ALIASES = {
+    'title': ('title', '245$a', '245a', '245'),
+    'isbn': ('isbn', 'isbn13', 'isbn10', '020$a', '020a', '020'),
+    'genre': ('genre', 'subject', '650$a', '650a', '650'),
+    'author': ('author', 'author_name', 'creator', '100$a', '100a', '100'),
+}
+
+COPY_BATCH_ROWS = 1000
+
+STAGING_SQL = """
+    CREATE TEMP TABLE import_books (
+        title TEXT,
+        isbn TEXT,
+        genre TEXT,
+        author_name TEXT
+    ) ON COMMIT DROP
+"""
+
+# authors.name is not unique, so new names are inserted under a lock that
+# keeps two concurrent imports from adding the same author twice
+AUTHORS_SQL = """
+    INSERT INTO authors (name)
+    SELECT DISTINCT s.author_name
+    FROM import_books s
+    WHERE s.author_name IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM authors a WHERE a.name = s.author_name)
+"""
+
+MERGE_SQL = """
+    WITH resolved AS (
+        SELECT name, MIN(id) AS id
+        FROM authors
+        WHERE name IN (SELECT author_name FROM import_books)
+        GROUP BY name
+    ),
+    merged AS (
+        INSERT INTO books (title, isbn, genre, author_id)
+        SELECT DISTINCT ON (s.isbn) s.title, s.isbn, s.genre, r.id
+        FROM import_books s
+        LEFT JOIN resolved r ON r.name = s.author_name
+        ORDER BY s.isbn
+        ON CONFLICT (isbn) DO UPDATE SET
+            title = EXCLUDED.title,
+            genre = COALESCE(EXCLUDED.genre, books.genre),
+            author_id = COALESCE(EXCLUDED.author_id, books.author_id)
+        WHERE (books.title, books.genre, books.author_id) IS DISTINCT FROM
+              (EXCLUDED.title, COALESCE(EXCLUDED.genre, books.genre),
+               COALESCE(EXCLUDED.author_id, books.author_id))
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted)
+    FROM merged
+"""
+
+
+def normalize_isbn(value):
+    return ''.join(ch for ch in value if ch.isalnum()).upper()
+
+
+def resolve_columns(header):
+    lookup = {name.strip().lower(): i for i, name in enumerate(header)}
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in lookup:
+                columns[field] = lookup[alias]
+                break
+    missing = {'title', 'isbn'} - columns.keys()
+    if missing:
+        raise ValueError(f"Import file has no {' / '.join(sorted(missing))} column")
+    return columns
+
+
+class _CountingReader(io.RawIOBase):
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.raw.readinto(buffer)
+        self.bytes_read += n or 0
+        return n
+
+
+class CatalogReader:
+    """Iterates (title, isbn, genre, author) tuples from a CSV/TSV dump."""
+
+    def __init__(self, path, delimiter=None, encoding='utf-8-sig'):
+        self.path = path
+        self.size = os.path.getsize(path) or 1
+        self.counter = _CountingReader(open(path, 'rb'))
+        self.text = io.TextIOWrapper(io.BufferedReader(self.counter), encoding=encoding,
+                                     newline='')
+        if delimiter is None:
+            sample = self.text.readline()
+            delimiter = '\t' if sample.count('\t') > sample.count(',') else ','
+            header = next(csv.reader([sample], delimiter=delimiter))
+        else:
+            header = None
+        self.reader = csv.reader(self.text, delimiter=delimiter)
+        self.columns = resolve_columns(header or next(self.reader))
+        self.rows = 0
+        self.skipped = 0
+
+    def progress(self):
+        return min(self.counter.bytes_read / self.size, 1.0)
+
+    def __iter__(self):
+        columns = self.columns
+
+        def field(record, name):
+            i = columns.get(name)
+            if i is None or i >= len(record):
+                return None
+            return record[i].strip() or None
+
+        for record in self.reader:
+            self.rows += 1
+            title = field(record, 'title')
+            isbn = normalize_isbn(field(record, 'isbn') or '')
+            if not title or not isbn or len(isbn) > 20:
+                self.skipped += 1
+                continue
+            genre, author = field(record, 'genre'), field(record, 'author')
+            yield title[:300], isbn, genre and genre[:100], author and author[:200]
+
+    def close(self):
+        self.text.close()
+
+
+class CopyStream:
+    """File-like object feeding rows to COPY ... FROM STDIN in CSV format."""
+
+    def __init__(self, rows, on_batch=None):
+        self.rows = iter(rows)
+        self.on_batch = on_batch
+        self.buffer = b''
+        self.done = False
+
+    def read(self, size=-1):
+        while not self.done and (size < 0 or len(self.buffer) < size):
+            chunk = io.StringIO()
+            writer = csv.writer(chunk, lineterminator='\n')
+            count = 0
+            for row in self.rows:
+                writer.writerow(row)
+                count += 1
+                if count >= COPY_BATCH_ROWS:
+                    break
+            if count < COPY_BATCH_ROWS:
+                self.done = True
+            self.buffer += chunk.getvalue().encode('utf-8')
+            if self.on_batch:
+                self.on_batch()
+
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def import_catalog(conn, path, delimiter=None, progress=None):
+    """Stream a catalog dump into books/authors in one transaction.
+
+    progress(fraction, rows) is called as the file is read; the caller
+    commits (Database.run does).
+    """
+    started = time.monotonic()
+    reader = CatalogReader(path, delimiter)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(STAGING_SQL)
+
+        def on_batch():
+            if progress:
+                progress(reader.progress() * 0.9, reader.rows)
+
+        cursor.copy_expert(
+            "COPY import_books (title, isbn, genre, author_name) FROM STDIN WITH (FORMAT csv)",
+            CopyStream(reader, on_batch))
+        cursor.execute("ANALYZE import_books")
+
+        cursor.execute("LOCK TABLE authors IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(AUTHORS_SQL)
+        authors_added = cursor.rowcount
+        cursor.execute(MERGE_SQL)
+        inserted, updated = cursor.fetchone()
+    finally:
+        cursor.close()
+        reader.close()
+
+    if progress:
+        progress(1.0, reader.rows)
+    return ImportResult(reader.rows, reader.skipped, authors_added, inserted, updated,
+                        time.monotonic() - started)
@@ -0,0 +1,87 @@
+import json
+import logging
+import select
+import threading
+
+import psycopg2
+
+log = logging.getLogger('smartlibrary.changes')
+
+POLL_TIMEOUT = 1.0  # seconds; how quickly stop() is noticed
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 30.0
+
+# Ids written to books and loans (migrations/011)
+ROWS_CHANNEL = 'smartlibrary_rows'
+
+
+def parse_row_change(payload):
+    """(table, ids) from a ROWS_CHANNEL payload; ids is None for "reload"."""
+    change = json.loads(payload)
+    return change['table'], change['ids']
+
+
+class ChangeFeed:
+    """Listens for NOTIFY on a dedicated connection in a background thread.
+
+    on_notify(channel, payload) is called for every notification and
+    on_state(connected) whenever the LISTEN connection comes up or drops;
+    both run on the feed's thread. Notifications sent while disconnected
+    are lost, so listeners should treat a reconnect as "anything changed".
+    """
+
+    def __init__(self, connect, channels, on_notify, on_state=None):
+        self.connect = connect
+        self.channels = list(channels)
+        self.on_notify = on_notify
+        self.on_state = on_state
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='smartlibrary-changes',
+                                       daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        delay = RETRY_DELAY
+        while not self.stopping.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                conn.autocommit = True
+                cursor = conn.cursor()
+                for channel in self.channels:
+                    cursor.execute(f"LISTEN {channel}")
+                cursor.close()
+                delay = RETRY_DELAY
+                self.set_state(True)
+                self.listen(conn)
+            except (psycopg2.Error, OSError) as e:
+                log.warning("Change feed disconnected: %s", e)
+            finally:
+                if conn is not None:
+                    conn.close()
+                    self.set_state(False)
+            if self.stopping.wait(delay):
+                break
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def listen(self, conn):
+        while not self.stopping.is_set():
+            if select.select([conn], [], [], POLL_TIMEOUT) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    self.on_notify(notify.channel, notify.payload)
+                except Exception:
+                    log.exception("Change feed callback failed")
+
+    def set_state(self, connected):
+        if self.on_state:
+            self.on_state(connected)
@@ -0,0 +1,73 @@
+PAD_LEFT = 50
+PAD_RIGHT = 15
+PAD_TOP = 25
+PAD_BOTTOM = 30
+LABEL_WIDTH = 130
+FONT = ('Arial', 8)
+TITLE_FONT = ('Arial', 10, 'bold')
+
+
+def _nice_max(value):
+    # Axis top: 1, 2 or 5 times a power of ten, at least value
+    step = 1
+    while True:
+        for factor in (1, 2, 5):
+            if step * factor >= value:
+                return step * factor
+        step *= 10
+
+
+def draw_day_bars(canvas, title, points, color='#3498db', late_color='#e74c3c'):
+    """Bars per day: points are (day, total, late); late is drawn over the total."""
+    canvas.delete('all')
+    width, height = canvas.winfo_width(), canvas.winfo_height()
+    canvas.create_text(PAD_LEFT, 5, text=title, anchor='nw', font=TITLE_FONT)
+    if not points or width <= PAD_LEFT + PAD_RIGHT or height <= PAD_TOP + PAD_BOTTOM:
+        return
+
+    top = _nice_max(max(total for _, total, _ in points) or 1)
+    plot_w = width - PAD_LEFT - PAD_RIGHT
+    plot_h = height - PAD_TOP - PAD_BOTTOM
+    bottom = PAD_TOP + plot_h
+    for fraction in (0, 0.5, 1):
+        y = bottom - plot_h * fraction
+        canvas.create_line(PAD_LEFT, y, width - PAD_RIGHT, y, fill='#ecf0f1')
+        canvas.create_text(PAD_LEFT - 5, y, text=f"{top * fraction:g}", anchor='e', font=FONT)
+
+    slot = plot_w / len(points)
+    bar = max(slot * 0.8, 1)
+    label_every = max(1, int(60 / slot))
+    for i, (day, total, late) in enumerate(points):
+        x = PAD_LEFT + i * slot
+        if total:
+            canvas.create_rectangle(x, bottom - plot_h * total / top, x + bar, bottom,
+                                    fill=color, width=0)
+        if late:
+            canvas.create_rectangle(x, bottom - plot_h * late / top, x + bar, bottom,
+                                    fill=late_color, width=0)
+        if i % label_every == 0:
+            canvas.create_text(x, bottom + 4, text=f"{day:%d %b}", anchor='nw', font=FONT)
+
+
+def draw_hbars(canvas, title, items, color='#9b59b6', late_color='#e74c3c'):
+    """Horizontal bars: items are (label, total, late), largest first."""
+    canvas.delete('all')
+    width, height = canvas.winfo_width(), canvas.winfo_height()
+    canvas.create_text(10, 5, text=title, anchor='nw', font=TITLE_FONT)
+    if not items or width <= LABEL_WIDTH + PAD_RIGHT + 60:
+        return
+
+    top = max(total for _, total, _ in items) or 1
+    plot_w = width - LABEL_WIDTH - PAD_RIGHT - 60
+    row = min((height - PAD_TOP - 5) / len(items), 24)
+    for i, (label, total, late) in enumerate(items):
+        y = PAD_TOP + i * row
+        canvas.create_text(LABEL_WIDTH - 5, y + row / 2, text=str(label)[:20], anchor='e',
+                           font=FONT)
+        canvas.create_rectangle(LABEL_WIDTH, y + 2, LABEL_WIDTH + plot_w * total / top,
+                                y + row - 2, fill=color, width=0)
+        if late:
+            canvas.create_rectangle(LABEL_WIDTH, y + 2, LABEL_WIDTH + plot_w * late / top,
+                                    y + row - 2, fill=late_color, width=0)
+        canvas.create_text(LABEL_WIDTH + plot_w * total / top + 5, y + row / 2,
+                           text=f"{total:,}", anchor='w', font=FONT)
@@ -0,0 +1,256 @@
+import json
+import random
+import threading
+import time
+from collections import Counter, namedtuple
+
+import psycopg2
+import psycopg2.errors
+
+import library_db
+
+MAX_LOANS = 3
+LOAN_DAYS = 7
+LOCK_RETRIES = 3
+
+CartLine = namedtuple('CartLine', 'isbn loan_id status')
+
+# A return that went to the next hold went through all the same
+RETURNED = ('returned', 'held')
+
+STATUS_TEXT = {
+    'borrowed': "Checked out",
+    'returned': "Returned",
+    'not_found': "No such ISBN or barcode",
+    'busy': "In use at another desk, try again",
+    'unavailable': "No copy on the shelf",
+    'on_hold': "On the hold shelf for another member",
+    'limit_reached': f"Member already has {MAX_LOANS} active loans",
+    'not_borrowed': "Not on loan",
+    'held': "Returned - put it on the hold shelf",
+    'queued': "Queued offline, sent when the server is back",
+}
+
+
+def normalize_isbns(isbns):
+    # ISBNs or copy barcodes. Scanners add dashes and spaces; keep the cart
+    # order, drop repeats
+    seen = []
+    for isbn in isbns:
+        isbn = ''.join(ch for ch in isbn if ch.isalnum()).upper()
+        if isbn and isbn not in seen:
+            seen.append(isbn)
+    return seen
+
+
+def find_member(conn, student_id):
+    return library_db.fetch_one(conn, 'member_by_student', (student_id,))
+
+
+def _run_locked(db, work):
+    # Two desks returning overlapping carts can still deadlock against the
+    # overdue sweeper, and a checkout taking a title's last copy against a
+    # return of it; the loser is rolled back whole, so retry it
+    for attempt in range(1, LOCK_RETRIES + 1):
+        try:
+            return db.run(work)
+        except (psycopg2.errors.DeadlockDetected, psycopg2.errors.SerializationFailure):
+            if attempt == LOCK_RETRIES:
+                raise
+            time.sleep(random.uniform(0.01, 0.05) * attempt)
+
+
+def checkout(db, member_id, isbns, days=LOAN_DAYS):
+    """Borrow a cart of ISBNs or copy barcodes for one member in a single transaction."""
+    isbns = normalize_isbns(isbns)
+    if not isbns:
+        return []
+    rows = _run_locked(db, lambda conn: library_db.fetch_all(
+        conn, 'borrow_books', (member_id, isbns, days)))
+    return [CartLine(*row) for row in rows]
+
+
+def checkin(db, isbns):
+    """Return a batch of ISBNs or copy barcodes in a single transaction."""
+    isbns = normalize_isbns(isbns)
+    if not isbns:
+        return []
+    rows = _run_locked(db, lambda conn: library_db.fetch_all(conn, 'return_books', (isbns,)))
+    return [CartLine(*row) for row in rows]
+
+
+def apply_queued(db, op_id, kind, member_id, isbns, days, queued_on):
+    """Replay a cart an offline desk queued (local_replica.py), dated queued_on.
+
+    The op id is recorded in the same transaction, so replaying a cart
+    whose commit was already applied returns the stored answer instead
+    of lending or returning the books twice.
+    """
+    def work(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("INSERT INTO replica_applied_ops (op_id) VALUES (%s) "
+                           "ON CONFLICT DO NOTHING", (op_id,))
+            if cursor.rowcount == 0:
+                cursor.execute("SELECT result FROM replica_applied_ops WHERE op_id = %s",
+                               (op_id,))
+                return cursor.fetchone()[0] or []
+            if kind == 'borrow':
+                rows = library_db.fetch_all(conn, 'borrow_books_on',
+                                            (member_id, isbns, days, queued_on))
+            else:
+                rows = library_db.fetch_all(conn, 'return_books_on', (isbns, queued_on))
+            cursor.execute("UPDATE replica_applied_ops SET result = %s WHERE op_id = %s",
+                           (json.dumps(rows), op_id))
+            return rows
+        finally:
+            cursor.close()
+
+    return [CartLine(*row) for row in _run_locked(db, work)]
+
+
+STRESS_BOOKS_SQL = """
+    SELECT b.isbn, c.available
+    FROM books b JOIN copy_counts c ON c.book_id = b.id
+    WHERE c.available > 0
+    ORDER BY random() LIMIT %s
+"""
+
+STRESS_LENT_SQL = """
+    SELECT c.barcode FROM loans l JOIN copies c ON c.id = l.copy_id WHERE l.id = ANY(%s)
+"""
+
+STRESS_MEMBERS_SQL = """
+    SELECT id, %s - active_loan_count FROM members WHERE active_loan_count < %s
+"""
+
+# Copies lent or shelved twice or whose status disagrees with their loans
+# and holds, and titles whose counts drifted from their copies
+COPY_CHECK_SQL = """
+    SELECT 'copy ' || c.barcode || ' of ' || b.isbn || ': ' || c.status || ', '
+           || u.open_loans || ' open loan(s), ' || u.ready || ' ready hold(s)'
+    FROM books b
+    JOIN copies c ON c.book_id = b.id
+    CROSS JOIN LATERAL (
+        SELECT (SELECT COUNT(*) FROM loans l
+                WHERE l.copy_id = c.id AND l.status IN ('Active', 'Overdue')) AS open_loans,
+               (SELECT COUNT(*) FROM holds h
+                WHERE h.copy_id = c.id AND h.status = 'Ready') AS ready
+    ) u
+    WHERE b.isbn = ANY(%s)
+      AND (u.open_loans + u.ready > 1
+           OR (u.open_loans = 1) <> (c.status = 'OnLoan')
+           OR (u.ready = 1) <> (c.status = 'OnHold'))
+    UNION ALL
+    SELECT 'book ' || isbn || ': counted ' || stored_available || ' of ' || stored_total
+           || ' on the shelf, actually ' || available || ' of ' || total
+           || ', available=' || flagged
+    FROM copy_count_drift
+    WHERE isbn = ANY(%s)
+"""
+
+# The above, and members whose counter drifted
+STRESS_CHECK_SQL = COPY_CHECK_SQL + """
+    UNION ALL
+    SELECT 'member ' || member_id || ': active_loan_count ' || stored || ', actual ' || actual
+    FROM active_loan_count_drift
+"""
+
+
+class StressResult(namedtuple('StressResult', 'rounds carts borrowed busy double_lent '
+                                              'over_limit errors problems seconds')):
+    @property
+    def passed(self):
+        return not (self.double_lent or self.over_limit or self.problems)
+
+    def __str__(self):
+        return (f"{self.rounds} rounds, {self.carts:,} carts, {self.borrowed:,} loans in "
+                f"{self.seconds:.1f}s ({self.busy:,} busy): {self.double_lent} double-lent, "
+                f"{self.over_limit} over the limit, {self.errors} failed carts, "
+                f"{len(self.problems)} consistency problems")
+
+
+def stress_test(db, workers=16, rounds=20, pool_size=10, cart_size=3):
+    """Race many desks for the same few books and check nothing is lent twice.
+
+    Each round every worker checks out a random cart at the same instant
+    (through a barrier); afterwards no ISBN may have been borrowed more
+    times than it had copies on the shelf and no member may exceed the loan
+    limit. Everything borrowed in a round is returned (by copy barcode)
+    before the next one, and the tables are checked for leftover
+    inconsistencies at the end. Returned loans stay in the history.
+    """
+    def setup(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(STRESS_BOOKS_SQL, (pool_size,))
+            books = dict(cursor.fetchall())
+            cursor.execute(STRESS_MEMBERS_SQL, (MAX_LOANS, MAX_LOANS))
+            return books, dict(cursor.fetchall())
+        finally:
+            cursor.close()
+
+    books, headroom = db.run(setup)
+    if not books or not headroom:
+        raise RuntimeError("Stress test needs available books and members below the loan limit")
+
+    started = time.monotonic()
+    members = list(headroom)
+    totals = Counter()
+    for _ in range(rounds):
+        barrier = threading.Barrier(workers)
+        lines, lock = [], threading.Lock()
+
+        def desk():
+            member_id = random.choice(members)
+            cart = random.sample(list(books), min(cart_size, len(books)))
+            barrier.wait()
+            try:
+                result = checkout(db, member_id, cart)
+            except psycopg2.Error:
+                with lock:
+                    totals['errors'] += 1
+                return
+            with lock:
+                lines.extend((member_id, line) for line in result)
+
+        threads = [threading.Thread(target=desk) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        lent = Counter(line.isbn for _, line in lines if line.status == 'borrowed')
+        per_member = Counter(member_id for member_id, line in lines if line.status == 'borrowed')
+        totals['carts'] += workers
+        totals['borrowed'] += sum(lent.values())
+        totals['busy'] += sum(1 for _, line in lines if line.status == 'busy')
+        totals['double_lent'] += sum(1 for isbn, count in lent.items() if count > books[isbn])
+        totals['over_limit'] += sum(1 for member_id, count in per_member.items()
+                                    if count > headroom[member_id])
+        loan_ids = [line.loan_id for _, line in lines if line.status == 'borrowed']
+        if loan_ids:
+            checkin(db, db.run(lambda conn: _lent_barcodes(conn, loan_ids)))
+
+    problems = db.run(lambda conn: _fetch_problems(conn, list(books)))
+    return StressResult(rounds, totals['carts'], totals['borrowed'], totals['busy'],
+                        totals['double_lent'], totals['over_limit'], totals['errors'], problems,
+                        time.monotonic() - started)
+
+
+def _lent_barcodes(conn, loan_ids):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(STRESS_LENT_SQL, (loan_ids,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _fetch_problems(conn, books):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(STRESS_CHECK_SQL, (books, books))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
@@ -0,0 +1,241 @@
+import itertools
+import random
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+from catalog_import import CopyStream
+
+GenerateResult = namedtuple('GenerateResult', 'authors members books loans open_loans clubs seconds')
+
+# Rows per COPY statement/transaction: keeps the statement-level trigger
+# transition tables (migrations/003) and WAL per commit bounded
+COPY_CHUNK_ROWS = 200_000
+
+FIRST_NAMES = ('Aisha', 'Ben', 'Chen', 'Diego', 'Emma', 'Farah', 'Gopal', 'Hana', 'Ivan', 'Jia',
+               'Kofi', 'Lena', 'Musa', 'Nadia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sami', 'Tara',
+               'Umar', 'Vera', 'Wei', 'Ximena', 'Yusuf', 'Zara')
+LAST_NAMES = ('Abdullah', 'Brown', 'Chong', 'Da Silva', 'Evans', 'Fernandez', 'Goh', 'Hassan',
+              'Ibrahim', 'Johnson', 'Khan', 'Lim', 'Mensah', 'Nguyen', 'Okafor', 'Patel',
+              'Rahman', 'Smith', 'Tan', 'Ueda', 'Wong', 'Yamada', 'Zhang')
+TITLE_WORDS = ('Shadow', 'River', 'Empire', 'Garden', 'Silent', 'Stars', 'Winter', 'Secret',
+               'Last', 'City', 'Ocean', 'Fire', 'Memory', 'Glass', 'Iron', 'Night', 'Light',
+               'Machine', 'Island', 'Storm', 'Letters', 'House', 'Road', 'Crown', 'Forest',
+               'Mountain', 'Code', 'Dream', 'Song', 'War')
+# Genre weights are deliberately uneven, like a real catalog
+GENRES = (('Fiction', 30), ('Fantasy', 14), ('Science Fiction', 10), ('Mystery', 10),
+          ('Romance', 8), ('History', 7), ('Biography', 5), ('Science', 5), ('Computing', 4),
+          ('Horror', 3), ('Poetry', 2), ('Philosophy', 2))
+
+ZIPF_EXPONENT = 1.1  # book popularity: a few titles get most of the loans
+LOAN_DAYS = 7
+OPEN_LOAN_SHARE = 0.05  # of books currently on loan
+MAX_OPEN_PER_MEMBER = 3
+
+
+def zipf_weights(n, exponent=ZIPF_EXPONENT):
+    return list(itertools.accumulate(1.0 / (rank + 1) ** exponent for rank in range(n)))
+
+
+def chunked(rows, size=COPY_CHUNK_ROWS):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def next_id(cursor, table):
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+    return cursor.fetchone()[0]
+
+
+def copy_rows(conn, table, columns, rows, progress=None):
+    # One COPY and one commit per chunk
+    copied = 0
+    for chunk in chunked(rows):
+        cursor = conn.cursor()
+        try:
+            cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                               CopyStream(chunk))
+        finally:
+            cursor.close()
+        conn.commit()
+        copied += len(chunk)
+        if progress:
+            progress(table, copied)
+    return copied
+
+
+def reset_sequence(conn, table):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                       f"(SELECT MAX(id) FROM {table}))")
+    finally:
+        cursor.close()
+    conn.commit()
+
+
+def generate(conn, books=1_000_000, members=100_000, loans=10_000_000, years=5, seed=42,
+             progress=None):
+    """Append a synthetic, skewed library to the database through COPY.
+
+    Generated rows use their own name spaces (gen_user*, GEN*, 999* ISBNs),
+    so the demo data stays in place. progress(table, rows) is called
+    after every chunk.
+    """
+    started = time.monotonic()
+    rng = random.Random(seed)
+    today = date.today()
+    span = years * 365
+    authors = max(books // 20, 1)
+    clubs = max(members // 2000, 1)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT crypt('password123', gen_salt('bf'))")
+        password_hash = '\\x' + cursor.fetchone()[0].encode('utf-8').hex()
+        cursor.execute("SELECT id FROM roles WHERE name = 'Member'")
+        member_role = cursor.fetchone()[0]
+        first_author, first_user = next_id(cursor, 'authors'), next_id(cursor, 'users')
+        first_member, first_book = next_id(cursor, 'members'), next_id(cursor, 'books')
+        first_loan, first_club = next_id(cursor, 'loans'), next_id(cursor, 'book_clubs')
+        # Offsets let the generator be run more than once
+        cursor.execute("SELECT COUNT(*) FROM users WHERE username LIKE 'gen\\_user%'")
+        offset = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM books WHERE isbn LIKE '999%'")
+        book_offset = cursor.fetchone()[0]
+        cursor.execute("SELECT ensure_loan_partitions(%s, %s)",
+                       (today - timedelta(days=span), today))
+    finally:
+        cursor.close()
+    conn.commit()
+
+    # Which books are out right now, and with whom (at most 3 per member)
+    open_count = min(int(books * OPEN_LOAN_SHARE), members * MAX_OPEN_PER_MEMBER)
+    on_loan = rng.sample(range(books), open_count)
+    borrowers = [m for m in range(members) for _ in range(MAX_OPEN_PER_MEMBER)]
+    rng.shuffle(borrowers)
+    open_loans = list(zip(on_loan, borrowers[:open_count]))
+    unavailable = set(on_loan)
+
+    def author_rows():
+        for i in range(authors):
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            yield first_author + i, name, f"Generated author #{offset + i}"
+
+    copy_rows(conn, 'authors', ('id', 'name', 'bio'), author_rows(), progress)
+    reset_sequence(conn, 'authors')
+
+    def user_rows():
+        for i in range(members):
+            n = offset + i
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            yield (first_user + i, f'gen_user{n}', password_hash, member_role, name,
+                   f'gen{n}@student.example.edu')
+
+    def member_rows():
+        for i in range(members):
+            yield (first_member + i, first_user + i, f'GEN{offset + i:07d}',
+                   f'+6011{rng.randrange(10 ** 7):07d}')
+
+    copy_rows(conn, 'users', ('id', 'username', 'password_hash', 'role_id', 'name', 'email'),
+              user_rows(), progress)
+    copy_rows(conn, 'members', ('id', 'user_id', 'student_id', 'contact'), member_rows(), progress)
+    reset_sequence(conn, 'users')
+    reset_sequence(conn, 'members')
+
+    author_weights = zipf_weights(authors)
+    genre_names = [name for name, _ in GENRES]
+    genre_weights = list(itertools.accumulate(weight for _, weight in GENRES))
+    isbn_base = 999 * 10 ** 10 + book_offset
+
+    def book_rows():
+        for chunk_start in range(0, books, COPY_CHUNK_ROWS):
+            count = min(COPY_CHUNK_ROWS, books - chunk_start)
+            picked_authors = rng.choices(range(authors), cum_weights=author_weights, k=count)
+            picked_genres = rng.choices(genre_names, cum_weights=genre_weights, k=count)
+            for j in range(count):
+                i = chunk_start + j
+                title = ' '.join(rng.sample(TITLE_WORDS, rng.randint(2, 4)))
+                yield (first_book + i, f"{title} {i}", str(isbn_base + i), picked_genres[j],
+                       i not in unavailable, first_author + picked_authors[j])
+
+    copy_rows(conn, 'books', ('id', 'title', 'isbn', 'genre', 'available', 'author_id'),
+              book_rows(), progress)
+    reset_sequence(conn, 'books')
+
+    book_weights = zipf_weights(books)
+    member_weights = zipf_weights(members, 0.8)
+
+    def loan_rows():
+        history = loans - open_count
+        loan_id = first_loan
+        random, fromordinal = rng.random, date.fromordinal
+        newest = today.toordinal() - LOAN_DAYS - 30
+        oldest = span - LOAN_DAYS - 30
+        for chunk_start in range(0, history, COPY_CHUNK_ROWS):
+            count = min(COPY_CHUNK_ROWS, history - chunk_start)
+            picked_books = rng.choices(range(books), cum_weights=book_weights, k=count)
+            picked_members = rng.choices(range(members), cum_weights=member_weights, k=count)
+            for j in range(count):
+                # Squaring skews borrow dates towards the present (growing usage);
+                # ordinals because this loop runs ten million times
+                borrowed = newest - int(oldest * random() ** 2)
+                yield (loan_id, first_book + picked_books[j], first_member + picked_members[j],
+                       fromordinal(borrowed), fromordinal(borrowed + LOAN_DAYS),
+                       fromordinal(borrowed + 1 + int(random() * 3 * LOAN_DAYS)), 'Returned')
+                loan_id += 1
+
+        for book, member in open_loans:
+            borrowed = today - timedelta(days=rng.randint(0, 3 * LOAN_DAYS))
+            due = borrowed + timedelta(days=LOAN_DAYS)
+            yield (loan_id, first_book + book, first_member + member, borrowed, due, None,
+                   'Active' if due >= today else 'Overdue')
+            loan_id += 1
+
+    copy_rows(conn, 'loans', ('id', 'book_id', 'member_id', 'borrow_date', 'due_date',
+                              'return_date', 'status'), loan_rows(), progress)
+    reset_sequence(conn, 'loans')
+
+    # The books insert trigger gave every book a copy (withdrawn if it is
+    # out); hand those to the open loans
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT backfill_copies()")
+    finally:
+        cursor.close()
+    conn.commit()
+
+    def club_rows():
+        for i in range(clubs):
+            yield (first_club + i, f"{rng.choice(TITLE_WORDS)} Readers {offset + i}",
+                   "Generated book club", None)
+
+    def club_member_rows():
+        club_weights = zipf_weights(clubs)
+        for i in range(members):
+            for club in set(rng.choices(range(clubs), cum_weights=club_weights,
+                                        k=rng.choice((0, 0, 1, 1, 2)))):
+                yield first_club + club, first_member + i
+
+    copy_rows(conn, 'book_clubs', ('id', 'name', 'description', 'created_by'), club_rows(),
+              progress)
+    reset_sequence(conn, 'book_clubs')
+    copy_rows(conn, 'book_club_members', ('club_id', 'member_id'), club_member_rows(), progress)
+
+    # Fresh statistics so the planner sees the new sizes and skew
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        cursor.execute("ANALYZE authors, users, members, books, copies, copy_counts, loans, "
+                       "book_clubs, book_club_members")
+    finally:
+        cursor.close()
+        conn.autocommit = autocommit
+
+    return GenerateResult(authors, members, books, loans, open_count, clubs,
+                          time.monotonic() - started)
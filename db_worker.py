@@ -0,0 +1,109 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Job:
+    def __init__(self, work, on_done, on_error, generation):
+        self.work = work
+        self.on_done = on_done
+        self.on_error = on_error
+        self.generation = generation
+
+
+class DbExecutor:
+    """Runs database work off the Tk thread and hands results back via root.after.
+
+    Jobs submitted with screen=True belong to the screen currently shown:
+    cancel_screen() skips the queued ones, interrupts the one running
+    (through the cancel callback, e.g. connection.cancel) and drops any
+    results that still arrive. Other jobs (logins, writes) always complete.
+    """
+
+    def __init__(self, root, cancel=None, workers=1, poll_ms=20, on_busy=None):
+        self.root = root
+        self.cancel = cancel
+        self.poll_ms = poll_ms
+        self.on_busy = on_busy
+
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='smartlibrary-db')
+        self.done = queue.Queue()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.running_screen_jobs = 0
+
+        # Only touched from the Tk thread
+        self.outstanding = 0
+        self.screen_outstanding = 0
+        self.polling = False
+
+    def submit(self, work, on_done=None, on_error=None, screen=True):
+        job = _Job(work, on_done, on_error, self.generation if screen else None)
+        self.outstanding += 1
+        if screen:
+            self.set_screen_outstanding(self.screen_outstanding + 1)
+        self.executor.submit(self.run, job)
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_ms, self.poll)
+
+    def cancel_screen(self):
+        with self.lock:
+            self.generation += 1
+            if self.running_screen_jobs and self.cancel:
+                self.cancel()
+
+    def shutdown(self):
+        self.cancel_screen()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, job):
+        screen = job.generation is not None
+        with self.lock:
+            if screen and job.generation != self.generation:
+                self.done.put((job, None, None))
+                return
+            if screen:
+                self.running_screen_jobs += 1
+
+        result, error = None, None
+        try:
+            result = job.work()
+        except Exception as e:
+            error = e
+        finally:
+            if screen:
+                with self.lock:
+                    self.running_screen_jobs -= 1
+        self.done.put((job, result, error))
+
+    def poll(self):
+        while True:
+            try:
+                job, result, error = self.done.get_nowait()
+            except queue.Empty:
+                break
+
+            self.outstanding -= 1
+            if job.generation is not None:
+                self.set_screen_outstanding(self.screen_outstanding - 1)
+                if job.generation != self.generation:
+                    continue
+
+            if error is not None:
+                if job.on_error:
+                    job.on_error(error)
+            elif job.on_done:
+                job.on_done(result)
+
+        if self.outstanding:
+            self.root.after(self.poll_ms, self.poll)
+        else:
+            self.polling = False
+
+    def set_screen_outstanding(self, count):
+        was_busy = self.screen_outstanding > 0
+        self.screen_outstanding = count
+        if self.on_busy and was_busy != (count > 0):
+            self.on_busy(count > 0)
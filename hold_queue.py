@@ -0,0 +1,385 @@
+import json
+import logging
+import random
+import shlex
+import subprocess
+import threading
+import time
+from collections import Counter, namedtuple
+
+import circulation
+import library_db
+
+log = logging.getLogger('smartlibrary.holds')
+
+MAX_HOLDS = 5  # open holds per member, enforced by place_holds()
+EXPIRE_BATCH = 1000
+NOTICE_BATCH = 100
+# A sender that died mid-batch leaves its claim behind; after this long the
+# notices are sent again. Longer than a batch of command notifiers can take.
+NOTICE_CLAIM_TIMEOUT = 3600  # seconds
+
+HoldLine = namedtuple('HoldLine', 'isbn hold_id status')
+Hold = namedtuple('Hold', 'id title isbn status placed_at expires_at position')
+
+STATUS_TEXT = {
+    'placed': "Hold placed",
+    'cancelled': "Hold cancelled",
+    'not_found': "No such ISBN",
+    'busy': "In use at another desk, try again",
+    'available': "On the shelf, borrow it instead",
+    'already_held': "Already on hold for this member",
+    'has_it': "Member has it on loan",
+    'hold_limit': f"Member already has {MAX_HOLDS} open holds",
+    'not_held': "No open hold for this member",
+}
+
+
+def place(db, member_id, isbns, priority=0):
+    """Queue the member for each ISBN that is out, in one transaction."""
+    isbns = circulation.normalize_isbns(isbns)
+    if not isbns:
+        return []
+    rows = db.run(lambda conn: library_db.fetch_all(conn, 'place_holds',
+                                                    (member_id, isbns, priority)))
+    return [HoldLine(*row) for row in rows]
+
+
+def cancel(db, member_id, isbns):
+    """Cancel the member's holds; a book on the shelf goes to the next in line."""
+    isbns = circulation.normalize_isbns(isbns)
+    if not isbns:
+        return []
+    rows = db.run(lambda conn: library_db.fetch_all(conn, 'cancel_holds', (member_id, isbns)))
+    return [HoldLine(*row) for row in rows]
+
+
+def member_holds(conn, member_id):
+    return [Hold(*row) for row in library_db.fetch_all(conn, 'member_holds', (member_id,))]
+
+
+def expire(db, batch_size=EXPIRE_BATCH):
+    # One short transaction per batch, as in sweep_overdue
+    expired = 0
+    while True:
+        count = db.run(lambda conn: library_db.fetch_one(
+            conn, 'expire_holds_batch', (batch_size,))[0])
+        expired += count
+        if count < batch_size:
+            return expired
+
+
+# Notices ------------------------------------------------------------------
+
+Notice = namedtuple('Notice', 'id kind hold_id student_id name email title isbn expires_at')
+
+CLAIM_SQL = """
+    WITH claimed AS (
+        UPDATE hold_notices n SET claimed_at = clock_timestamp()
+        WHERE n.id IN (SELECT o.id FROM hold_notices o
+                       WHERE o.sent_at IS NULL
+                         AND (o.claimed_at IS NULL
+                              OR o.claimed_at < clock_timestamp() - %s * INTERVAL '1 second')
+                       ORDER BY o.id
+                       LIMIT %s
+                       FOR UPDATE SKIP LOCKED)
+        RETURNING n.id, n.kind, n.hold_id
+    )
+    SELECT c.id, c.kind, h.id, m.student_id, u.name, u.email, b.title, b.isbn, h.expires_at
+    FROM claimed c
+    JOIN holds h ON h.id = c.hold_id
+    JOIN members m ON m.id = h.member_id
+    JOIN users u ON u.id = m.user_id
+    JOIN books b ON b.id = h.book_id
+    ORDER BY c.id
+"""
+
+# Failed notices are released for the next run
+SENT_SQL = "UPDATE hold_notices SET sent_at = clock_timestamp() WHERE id = ANY(%s)"
+RELEASE_SQL = "UPDATE hold_notices SET claimed_at = NULL WHERE id = ANY(%s)"
+
+
+def notice_text(notice):
+    if notice.kind == 'ready':
+        return (f"{notice.title} is waiting for you at the front desk until "
+                f"{notice.expires_at:%Y-%m-%d %H:%M}.")
+    return f"Your hold on {notice.title} was not collected in time and has expired."
+
+
+class LogNotifier:
+    def __call__(self, notice):
+        log.info("Hold notice for %s <%s>: %s", notice.name, notice.email, notice_text(notice))
+
+
+class FileNotifier:
+    # JSON Lines spool for a mailer or SMS gateway to pick up
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, notice):
+        record = dict(notice._asdict(), text=notice_text(notice))
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+
+class CommandNotifier:
+    # Runs CMD EMAIL KIND with the message on stdin (sendmail wrapper, notify-send, ...)
+    def __init__(self, command):
+        self.args = shlex.split(command)
+
+    def __call__(self, notice):
+        subprocess.run(self.args + [notice.email or '', notice.kind], input=notice_text(notice),
+                       text=True, check=True, timeout=30)
+
+
+# name -> factory(argument); add entries to plug in another channel
+NOTIFIERS = {'log': LogNotifier, 'file': FileNotifier, 'command': CommandNotifier}
+
+
+def make_notifier(spec):
+    """'log', 'file:PATH' or 'command:CMD' (hold_notifier in smartlibrary.ini)."""
+    name, _, argument = spec.partition(':')
+    if name not in NOTIFIERS:
+        raise ValueError(f"Unknown hold notifier {name!r} (one of {', '.join(NOTIFIERS)})")
+    return NOTIFIERS[name](argument) if argument else NOTIFIERS[name]()
+
+
+def deliver_notices(db, notifier, batch_size=NOTICE_BATCH, claim_timeout=NOTICE_CLAIM_TIMEOUT):
+    """Send unsent notices; returns how many went out.
+
+    Each batch is claimed in one short transaction, so two sweepers never
+    send the same notice, then sent with no transaction open and marked
+    sent in another. A notice whose send fails is released and tried again
+    on the next run; one left claimed by a crashed sender is sent again
+    after claim_timeout seconds.
+    """
+    def claim(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(CLAIM_SQL, (claim_timeout, batch_size))
+            return [Notice(*row) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def mark(conn, sent, failed):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(SENT_SQL, (sent,))
+            cursor.execute(RELEASE_SQL, (failed,))
+        finally:
+            cursor.close()
+
+    total = 0
+    while True:
+        notices = db.run(claim)
+        sent, failed = [], []
+        for notice in notices:
+            try:
+                notifier(notice)
+            except Exception:
+                log.exception("Hold notice %s failed", notice.id)
+                failed.append(notice.id)
+            else:
+                sent.append(notice.id)
+        if notices:
+            db.run(lambda conn: mark(conn, sent, failed))
+        total += len(sent)
+        if len(notices) < batch_size or not sent:
+            return total
+
+
+# Stress test --------------------------------------------------------------
+
+STRESS_MEMBERS_SQL = """
+    SELECT m.id FROM members m
+    WHERE m.active_loan_count = 0
+      AND NOT EXISTS (SELECT 1 FROM holds h
+                      WHERE h.member_id = m.id AND h.status IN ('Waiting', 'Ready'))
+    ORDER BY random()
+    LIMIT %s
+"""
+
+# Members of the test with an open loan or hold
+STRESS_BUSY_SQL = """
+    SELECT member_id FROM holds
+    WHERE member_id = ANY(%s) AND status IN ('Waiting', 'Ready')
+    UNION
+    SELECT member_id FROM loans
+    WHERE member_id = ANY(%s) AND status IN ('Active', 'Overdue')
+"""
+
+STRESS_HOLDERS_SQL = """
+    SELECT DISTINCT member_id FROM holds
+    WHERE member_id = ANY(%s) AND status IN ('Waiting', 'Ready')
+"""
+
+# Single-copy titles, so "every book out" and the shelf stay easy to follow
+STRESS_BOOKS_SQL = """
+    SELECT b.isbn
+    FROM books b JOIN copy_counts c ON c.book_id = b.id
+    WHERE c.available = 1 AND c.total = 1
+    ORDER BY random() LIMIT %s
+"""
+
+STRESS_SHELF_SQL = """
+    SELECT b.isbn, b.available, h.member_id
+    FROM books b LEFT JOIN holds h ON h.book_id = b.id AND h.status = 'Ready'
+    WHERE b.isbn = ANY(%s)
+"""
+
+# A copy is lent or shelved at most once and its status and counts agree
+# (circulation.COPY_CHECK_SQL), no copy sits on the shelf while its title
+# has a queue, and every hold made ready for a test member was the best
+# one waiting at that moment (they are all under the loan limit, so none
+# may be passed over)
+STRESS_CHECK_SQL = circulation.COPY_CHECK_SQL + """
+    UNION ALL
+    SELECT 'book ' || b.isbn || ': ' || c.available || ' on the shelf with '
+           || (SELECT COUNT(*) FROM holds h WHERE h.book_id = b.id AND h.status = 'Waiting')
+           || ' waiting'
+    FROM books b JOIN copy_counts c ON c.book_id = b.id
+    WHERE b.isbn = ANY(%s) AND c.available > 0
+      AND EXISTS (SELECT 1 FROM holds h WHERE h.book_id = b.id AND h.status = 'Waiting')
+    UNION ALL
+    SELECT 'hold ' || r.id || ' made ready while older hold ' || w.id || ' was waiting'
+    FROM holds r
+    JOIN books b ON b.id = r.book_id
+    JOIN holds w ON w.book_id = r.book_id AND w.id <> r.id
+    WHERE b.isbn = ANY(%s) AND r.ready_at IS NOT NULL
+      AND r.member_id = ANY(%s) AND w.member_id = ANY(%s)
+      AND w.placed_at < r.ready_at
+      AND (w.ready_at IS NULL OR w.ready_at > r.ready_at)
+      AND (w.closed_at IS NULL OR w.closed_at > r.ready_at)
+      AND (w.priority > r.priority OR (w.priority = r.priority AND w.id < r.id))
+"""
+
+
+class StressResult(namedtuple('StressResult', 'rounds returns held placed snatched collected '
+                                              'busy errors problems seconds')):
+    @property
+    def passed(self):
+        return not self.problems
+
+    def __str__(self):
+        return (f"{self.rounds} rounds in {self.seconds:.1f}s: {self.returns:,} returns "
+                f"({self.held:,} to the hold shelf), {self.placed:,} holds placed, "
+                f"{self.snatched:,} walk-up loans, {self.collected:,} holds collected, "
+                f"{self.busy:,} busy retries, {self.errors} errors, "
+                f"{len(self.problems)} consistency problems")
+
+
+def _fetch_rows(db, sql, params):
+    def work(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+    return db.run(work)
+
+
+def stress_test(db, workers=16, rounds=20, pool_size=4):
+    """Race returns, holds and walk-up borrows for a few books.
+
+    Each round a third of the workers return a random pool book, a third
+    place a hold on one and a third try to borrow one, all at the same
+    instant (through a barrier). Between rounds every book on the hold
+    shelf is collected by its member and books left on the shelf are lent
+    again, then the queue invariants are checked. Every test member has
+    at most one loan or hold at a time. Open holds are cancelled and the
+    books returned at the end; the history stays (use a test database).
+    """
+    rows = _fetch_rows(db, STRESS_BOOKS_SQL, (pool_size,))
+    books = [row[0] for row in rows]
+    members = [row[0] for row in _fetch_rows(db, STRESS_MEMBERS_SQL,
+                                               (workers + 2 * pool_size,))]
+    if len(books) < pool_size or len(members) < workers + 2 * pool_size:
+        raise RuntimeError("Hold stress test needs available books and members "
+                           "with no loans or holds")
+
+    started = time.monotonic()
+    totals = Counter()
+    problems = []
+
+    def idle_members():
+        busy = {row[0] for row in _fetch_rows(db, STRESS_BUSY_SQL, (members, members))}
+        return [member_id for member_id in members if member_id not in busy]
+
+    # Start with every book out, so the first holds have something to wait for
+    for isbn, member_id in zip(books, members):
+        circulation.checkout(db, member_id, [isbn])
+
+    done = 0
+    while done < rounds and not problems:
+        idle = idle_members()
+        random.shuffle(idle)
+        barrier = threading.Barrier(workers)
+        lock = threading.Lock()
+
+        def desk(k):
+            member_id = idle[k] if k < len(idle) else None
+            isbn = random.choice(books)
+            barrier.wait()
+            try:
+                if k % 3 == 0:
+                    status = circulation.checkin(db, [isbn])[0].status
+                    key = {'returned': 'returns', 'held': 'held'}.get(status)
+                elif member_id is None:
+                    return
+                elif k % 3 == 1:
+                    status = place(db, member_id, [isbn], random.choice((0, 0, 0, 1)))[0].status
+                    key = 'placed' if status == 'placed' else None
+                else:
+                    status = circulation.checkout(db, member_id, [isbn])[0].status
+                    key = 'snatched' if status == 'borrowed' else None
+            except Exception:
+                log.exception("Hold stress desk failed")
+                with lock:
+                    totals['errors'] += 1
+                return
+            with lock:
+                if key:
+                    totals[key] += 1
+                if status == 'busy':
+                    totals['busy'] += 1
+
+        threads = [threading.Thread(target=desk, args=(k,)) for k in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        done += 1
+
+        # Members pick up their holds; books nobody queued for go out again
+        shelf = _fetch_rows(db, STRESS_SHELF_SQL, (books,))
+        for isbn, _, held_for in shelf:
+            if held_for is None:
+                continue
+            status = circulation.checkout(db, held_for, [isbn])[0].status
+            if status == 'borrowed':
+                totals['collected'] += 1
+            else:
+                problems.append(f"member {held_for} could not collect {isbn}: {status}")
+        free = idle_members()
+        for isbn, available, held_for in shelf:
+            if available and free:
+                circulation.checkout(db, free.pop(), [isbn])
+
+        problems.extend(row[0] for row in _fetch_rows(db, STRESS_CHECK_SQL,
+                                                      (books, books, books, books,
+                                                       members, members)))
+
+    # Leave no queue behind: cancelling a ready hold can shelve the book for
+    # another test member, so repeat until nothing is open
+    for _ in range(len(members) + 1):
+        holders = _fetch_rows(db, STRESS_HOLDERS_SQL, (members,))
+        if not holders:
+            break
+        for (member_id,) in holders:
+            cancel(db, member_id, books)
+    circulation.checkin(db, books)
+
+    return StressResult(done, totals['returns'] + totals['held'], totals['held'],
+                        totals['placed'], totals['snatched'], totals['collected'],
+                        totals['busy'], totals['errors'], problems, time.monotonic() - started)
@@ -0,0 +1,414 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import psycopg2
+
+import circulation
+import hold_queue
+import library_db
+from book_search import search_books
+from query_metrics import metrics
+
+log = logging.getLogger('smartlibrary.api')
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+KEEPALIVE_TIMEOUT = 15  # seconds
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+MAX_RECOMMENDATIONS = 10  # recommender.TOP_K rows are stored per book and member
+
+BOOK_FIELDS = ('id', 'title', 'isbn', 'author', 'genre', 'available', 'copies_available',
+               'copies')
+LOAN_FIELDS = ('id', 'title', 'member', 'borrow_date', 'due_date', 'return_date', 'status')
+MEMBER_FIELDS = ('id', 'student_id', 'name', 'active_loans')
+STATS_FIELDS = ('total_books', 'available_books', 'members', 'active_loans', 'overdue_loans')
+RECOMMENDATION_FIELDS = ('id', 'title', 'isbn', 'author', 'score')
+HOLD_FIELDS = ('id', 'title', 'isbn', 'status', 'placed_at', 'expires_at', 'position')
+LOAN_STATUSES = ('Active', 'Overdue', 'Returned')
+
+Request = namedtuple('Request', 'method path query headers body')
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class AsyncDatabase:
+    """Awaitable front for Database.
+
+    psycopg2 has no asyncio support, so each call runs on a thread pool
+    sized to the connection pool; the event loop never blocks on SQL.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=int(db.config['maxconn']),
+                                           thread_name_prefix='smartlibrary-api')
+
+    async def call(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    async def run(self, work, retry=False):
+        return await self.call(lambda: self.db.run(work, retry=retry))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_cursor(key):
+    text = json.dumps(list(key), default=json_default)
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid cursor")
+    if not isinstance(key, list) or len(key) != 2:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid cursor")
+    return key
+
+
+def page_limit(query):
+    try:
+        limit = int(query.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "limit must be a number")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def parse_date(query, name):
+    text = query.get(name)
+    if not text:
+        return None
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be YYYY-MM-DD")
+
+
+def parse_json(body):
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Body must be JSON")
+    if not isinstance(data, dict):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+    return data
+
+
+def parse_isbns(data):
+    isbns = data.get('isbns')
+    if not isinstance(isbns, list) or not isbns or not all(isinstance(i, str) for i in isbns):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "isbns must be a non-empty list of strings")
+    return isbns
+
+
+def page(rows, fields, limit, key):
+    # Keyset paging: the cursor is the sort key of the last row
+    items = [dict(zip(fields, row)) for row in rows]
+    next_cursor = encode_cursor(key(rows[-1])) if len(rows) == limit else None
+    return {'items': items, 'next': next_cursor}
+
+
+def cart_lines(lines):
+    return [{'isbn': line.isbn, 'loan_id': line.loan_id, 'status': line.status,
+             'message': circulation.STATUS_TEXT.get(line.status, line.status)}
+            for line in lines]
+
+
+def hold_lines(lines):
+    return [{'isbn': line.isbn, 'hold_id': line.hold_id, 'status': line.status,
+             'message': hold_queue.STATUS_TEXT.get(line.status, line.status)}
+            for line in lines]
+
+
+class LibraryApi:
+    """JSON API over the same statements and modules the desktop app uses.
+
+    GET responses carry an ETag (hash of the body); a matching
+    If-None-Match gets 304 Not Modified without the body. Every request,
+    /metrics included, needs "Authorization: Bearer <token>".
+    """
+
+    def __init__(self, adb, token):
+        if not token:
+            raise ValueError("The API needs a token")
+        self.adb = adb
+        self.token = token
+        self.routes = {
+            ('GET', '/api/books'): self.books,
+            ('GET', '/api/loans'): self.loans,
+            ('GET', '/api/members'): self.members,
+            ('GET', '/api/stats'): self.stats,
+            ('GET', '/api/recommendations'): self.recommendations,
+            ('POST', '/api/borrow'): self.borrow,
+            ('POST', '/api/return'): self.give_back,
+            ('GET', '/api/holds'): self.holds,
+            ('POST', '/api/holds'): self.place_holds,
+            ('POST', '/api/holds/cancel'): self.cancel_holds,
+        }
+        self.paths = {path for _, path in self.routes}
+
+    async def books(self, request):
+        limit = page_limit(request.query)
+        term = request.query.get('q', '').strip()
+        if term:
+            rows = await self.adb.run(lambda conn: search_books(conn, term, limit), retry=True)
+            return {'items': [dict(zip(BOOK_FIELDS, row)) for row in rows], 'next': None}
+
+        key = decode_cursor(request.query.get('cursor'))
+        rows = await self.adb.run(lambda conn: library_db.books_page(conn, 'after', key, limit),
+                                  retry=True)
+        return page(rows, BOOK_FIELDS, limit, lambda book: (book[1], book[0]))
+
+    async def loans(self, request):
+        query = request.query
+        limit = page_limit(query)
+        status = query.get('status') or None
+        if status and status not in LOAN_STATUSES:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"status must be one of {', '.join(LOAN_STATUSES)}")
+        criteria = {'status': status,
+                    'student_id': query.get('student_id') or None,
+                    'date_from': parse_date(query, 'from'),
+                    'date_to': parse_date(query, 'to')}
+        key = decode_cursor(query.get('cursor'))
+        rows = await self.adb.run(
+            lambda conn: library_db.loans_page(conn, 'after', key, limit, **criteria), retry=True)
+        return page(rows, LOAN_FIELDS, limit, lambda loan: (loan[3], loan[0]))
+
+    async def members(self, request):
+        rows = await self.adb.run(
+            lambda conn: library_db.fetch_all(conn, 'members_summary'), retry=True)
+        return {'items': [dict(zip(MEMBER_FIELDS, row)) for row in rows]}
+
+    async def stats(self, request):
+        row = await self.adb.run(
+            lambda conn: library_db.fetch_one(conn, 'dashboard_stats'), retry=True)
+        return dict(zip(STATS_FIELDS, row))
+
+    async def recommendations(self, request):
+        # Reads the tables recommender.py precomputes: two index lookups
+        query = request.query
+        limit = min(page_limit(query), MAX_RECOMMENDATIONS)
+        if query.get('isbn'):
+            find, key, statement = 'book_by_isbn', query['isbn'], 'also_borrowed'
+        elif query.get('student_id'):
+            find, key, statement = 'member_by_student', query['student_id'], 'member_suggestions'
+        else:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Pass isbn or student_id")
+
+        def lookup(conn):
+            found = library_db.fetch_one(conn, find, (key,))
+            return found and library_db.fetch_all(conn, statement, (found[0], limit))
+
+        rows = await self.adb.run(lookup, retry=True)
+        if rows is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"Nothing found for {key}")
+        return {'items': [dict(zip(RECOMMENDATION_FIELDS, row)) for row in rows]}
+
+    async def borrow(self, request):
+        data = parse_json(request.body)
+        student_id = data.get('student_id')
+        if not isinstance(student_id, str) or not student_id:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "student_id is required")
+        isbns = parse_isbns(data)
+        days = data.get('days', circulation.LOAN_DAYS)
+        if not isinstance(days, int) or not 1 <= days <= 365:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "days must be between 1 and 365")
+
+        member = await self.adb.run(lambda conn: circulation.find_member(conn, student_id))
+        if member is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"No member with student ID {student_id}")
+        lines = await self.adb.call(circulation.checkout, self.adb.db, member[0], isbns, days)
+        return {'member': {'id': member[0], 'name': member[1]}, 'lines': cart_lines(lines)}
+
+    async def give_back(self, request):
+        isbns = parse_isbns(parse_json(request.body))
+        lines = await self.adb.call(circulation.checkin, self.adb.db, isbns)
+        return {'lines': cart_lines(lines)}
+
+    async def holds(self, request):
+        student_id = request.query.get('student_id')
+        if not student_id:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "student_id is required")
+        member = await self.member(student_id)
+        rows = await self.adb.run(lambda conn: hold_queue.member_holds(conn, member[0]),
+                                  retry=True)
+        return {'items': [dict(zip(HOLD_FIELDS, row)) for row in rows]}
+
+    async def place_holds(self, request):
+        data = parse_json(request.body)
+        member = await self.member(data.get('student_id'))
+        priority = data.get('priority', 0)
+        if not isinstance(priority, int):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "priority must be a number")
+        lines = await self.adb.call(hold_queue.place, self.adb.db, member[0],
+                                    parse_isbns(data), priority)
+        return {'lines': hold_lines(lines)}
+
+    async def cancel_holds(self, request):
+        data = parse_json(request.body)
+        member = await self.member(data.get('student_id'))
+        lines = await self.adb.call(hold_queue.cancel, self.adb.db, member[0], parse_isbns(data))
+        return {'lines': hold_lines(lines)}
+
+    async def member(self, student_id):
+        if not isinstance(student_id, str) or not student_id:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "student_id is required")
+        member = await self.adb.run(lambda conn: circulation.find_member(conn, student_id))
+        if member is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"No member with student ID {student_id}")
+        return member
+
+    async def dispatch(self, request):
+        """Returns (status, headers, body bytes)."""
+        if not self.authorized(request):
+            return self.error(HTTPStatus.UNAUTHORIZED, "Missing or wrong API token")
+        if (request.method, request.path) == ('GET', '/metrics'):
+            # Query latency histograms for Prometheus to scrape
+            body = metrics.render_prometheus().encode('utf-8')
+            return HTTPStatus.OK, {'Content-Type': 'text/plain; version=0.0.4'}, body
+        route = self.routes.get((request.method, request.path))
+        if route is None:
+            status = (HTTPStatus.METHOD_NOT_ALLOWED if request.path in self.paths
+                      else HTTPStatus.NOT_FOUND)
+            return self.error(status, status.phrase)
+
+        try:
+            result = await route(request)
+        except ApiError as e:
+            return self.error(e.status, e.message)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            log.warning("Database unavailable: %s", e)
+            return self.error(HTTPStatus.SERVICE_UNAVAILABLE, "Database unavailable")
+        except psycopg2.Error as e:
+            return self.error(HTTPStatus.CONFLICT, str(e).strip())
+        except Exception:
+            log.exception("%s %s failed", request.method, request.path)
+            return self.error(HTTPStatus.INTERNAL_SERVER_ERROR, "Internal error")
+
+        body = json.dumps(result, default=json_default, separators=(',', ':')).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if request.method == 'GET':
+            etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+            headers['ETag'] = etag
+            headers['Cache-Control'] = 'no-cache'
+            wanted = request.headers.get('if-none-match', '')
+            if etag in [tag.strip() for tag in wanted.split(',')] or wanted.strip() == '*':
+                return HTTPStatus.NOT_MODIFIED, headers, b''
+        return HTTPStatus.OK, headers, body
+
+    def authorized(self, request):
+        sent = request.headers.get('authorization', '')
+        return hmac.compare_digest(sent.encode('utf-8'), f'Bearer {self.token}'.encode('utf-8'))
+
+    def error(self, status, message):
+        body = json.dumps({'error': message}).encode('utf-8')
+        return status, {'Content-Type': 'application/json'}, body
+
+    async def handle(self, reader, writer):
+        # One task per connection; HTTP/1.1 keep-alive, no pipelining
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                                  KEEPALIVE_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, *self.error(
+                        HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Headers too large"), False)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                request_line, *header_lines = head.decode('latin-1').rstrip('\r\n').split('\r\n')
+                parts = request_line.split(' ')
+                if len(parts) != 3:
+                    await self.respond(writer, *self.error(HTTPStatus.BAD_REQUEST,
+                                                           "Bad request line"), False)
+                    break
+                method, target, version = parts
+
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_BODY_BYTES:
+                    await self.respond(writer, *self.error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                                           "Body too large"), False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                url = urlsplit(target)
+                query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+                status, response_headers, response_body = await self.dispatch(
+                    Request(method, url.path, query, headers, body))
+                await self.respond(writer, status, response_headers, response_body, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, headers, body, keep_alive):
+        lines = [f'HTTP/1.1 {status.value} {status.phrase}']
+        headers = dict(headers, **{'Content-Length': str(len(body)),
+                                   'Connection': 'keep-alive' if keep_alive else 'close'})
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+
+def api_token():
+    return os.environ.get('SMARTLIBRARY_API_TOKEN') or None
+
+
+async def serve(db, host='127.0.0.1', port=8080, token=None):
+    adb = AsyncDatabase(db)
+    api = LibraryApi(adb, token)
+    server = await asyncio.start_server(api.handle, host, port, limit=MAX_HEADER_BYTES)
+    log.info("API listening on http://%s:%s", host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        adb.close()
+
+
+def run_server(db, host='127.0.0.1', port=8080, token=None):
+    try:
+        asyncio.run(serve(db, host, port, token))
+    except KeyboardInterrupt:
+        log.info("API stopped")
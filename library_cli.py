@@ -0,0 +1,537 @@
+import argparse
+import logging
+import sys
+import time
+from datetime import date
+
+from library_db import Database
+
+
+def print_progress(fraction, rows, state={'last': 0.0}):
+    now = time.monotonic()
+    if now - state['last'] < 0.5 and fraction < 1.0:
+        return
+    state['last'] = now
+    print(f"\r  {fraction * 100:5.1f}%  {rows:,} rows read", end='', file=sys.stderr, flush=True)
+    if fraction >= 1.0:
+        print(file=sys.stderr)
+
+
+def cmd_import(db, args):
+    from catalog_import import import_catalog
+
+    result = db.run(lambda conn: import_catalog(conn, args.file, args.delimiter, print_progress))
+    print(f"Read {result.rows:,} rows ({result.skipped:,} skipped) in {result.seconds:.1f}s: "
+          f"{result.books_inserted:,} books added, {result.books_updated:,} updated, "
+          f"{result.authors_added:,} new authors")
+
+
+def cmd_sweep(db, args):
+    from overdue_sweeper import sweep_overdue
+
+    if args.daemon:
+        from maintenance import run_daemon
+
+        run_daemon(db, args.interval, args.batch_size)
+    else:
+        print(f"Sweep: {sweep_overdue(db, args.batch_size)}")
+
+
+def cmd_partitions(db, args):
+    from loan_partitions import archive_partitions, ensure_partitions
+
+    created = ensure_partitions(db, args.ahead)
+    print(f"Created {created} loans partition(s)")
+    if args.archive_before:
+        archived = archive_partitions(db, args.archive_before)
+        for name in archived:
+            print(f"  archived {name}")
+        print(f"Archived {len(archived)} partition(s) to loans_archive")
+
+
+def cmd_check_loan_counts(db, args):
+    import library_db
+
+    statement = 'repair_loan_counts' if args.repair else 'loan_count_drift'
+    rows = db.run(lambda conn: library_db.fetch_all(conn, statement))
+    for member_id, stored, actual in rows:
+        print(f"member {member_id}: stored {stored}, actual {actual}")
+    if not rows:
+        print("All active loan counts are consistent")
+    elif args.repair:
+        print(f"Repaired {len(rows)} member(s)")
+    else:
+        print(f"{len(rows)} member(s) out of sync; run with --repair to fix")
+        return 1
+
+
+def print_cart(lines):
+    from circulation import STATUS_TEXT
+
+    for line in lines:
+        loan = f"loan {line.loan_id}" if line.loan_id else ""
+        print(f"  {line.isbn:<20} {STATUS_TEXT.get(line.status, line.status):<36} {loan}")
+
+
+def cmd_borrow(db, args):
+    import circulation
+
+    member = db.run(lambda conn: circulation.find_member(conn, args.student_id))
+    if member is None:
+        print(f"No member with student ID {args.student_id}", file=sys.stderr)
+        return 1
+    member_id, name, active = member
+    print(f"{name} ({args.student_id}), {active} active loan(s)")
+    lines = circulation.checkout(db, member_id, args.isbns, args.days)
+    print_cart(lines)
+    return 0 if all(line.status == 'borrowed' for line in lines) else 1
+
+
+def cmd_return(db, args):
+    import circulation
+
+    lines = circulation.checkin(db, args.isbns)
+    print_cart(lines)
+    return 0 if all(line.status in circulation.RETURNED for line in lines) else 1
+
+
+def cmd_hold(db, args):
+    import circulation
+    import hold_queue
+
+    if args.action == 'expire':
+        print(f"Expired {hold_queue.expire(db):,} uncollected hold(s)")
+        notifier = hold_queue.make_notifier(db.config['hold_notifier'])
+        print(f"Sent {hold_queue.deliver_notices(db, notifier):,} notice(s)")
+        return 0
+    if not args.student_id:
+        print("Pass the member's student ID", file=sys.stderr)
+        return 1
+    member = db.run(lambda conn: circulation.find_member(conn, args.student_id))
+    if member is None:
+        print(f"No member with student ID {args.student_id}", file=sys.stderr)
+        return 1
+
+    if args.action == 'list':
+        for hold in db.run(lambda conn: hold_queue.member_holds(conn, member[0])):
+            where = (f"ready until {hold.expires_at:%Y-%m-%d %H:%M}" if hold.status == 'Ready'
+                     else f"#{hold.position} in the queue")
+            print(f"  {hold.isbn:<20} {where:<28} {hold.title}")
+        return 0
+    if not args.isbns:
+        print("Pass one or more ISBNs", file=sys.stderr)
+        return 1
+    if args.action == 'place':
+        lines, ok = hold_queue.place(db, member[0], args.isbns, args.priority), 'placed'
+    else:
+        lines, ok = hold_queue.cancel(db, member[0], args.isbns), 'cancelled'
+    for line in lines:
+        hold = f"hold {line.hold_id}" if line.hold_id else ""
+        print(f"  {line.isbn:<20} {hold_queue.STATUS_TEXT.get(line.status, line.status):<36} "
+              f"{hold}")
+    return 0 if all(line.status == ok for line in lines) else 1
+
+
+def cmd_copies(db, args):
+    import book_bulk
+    import library_db
+
+    if args.action == 'check':
+        statement = 'repair_copy_counts' if args.repair else 'copy_count_drift'
+        rows = db.run(lambda conn: library_db.fetch_all(conn, statement))
+        for isbn, stored_available, stored_total, available, total in rows:
+            print(f"book {isbn}: stored {stored_available} of {stored_total}, "
+                  f"actual {available} of {total}")
+        if not rows:
+            print("All copy counts are consistent")
+        elif args.repair:
+            print(f"Repaired {len(rows)} book(s)")
+        else:
+            print(f"{len(rows)} book(s) out of sync; run with --repair to fix")
+            return 1
+        return 0
+    if not args.codes:
+        print("Pass an ISBN (list, add) or one or more barcodes (set)", file=sys.stderr)
+        return 1
+
+    if args.action == 'set':
+        changed = db.run(lambda conn: book_bulk.update_copies(
+            conn, args.codes, args.status, args.condition, args.branch))
+        print(f"Changed {len(changed):,} of {len(args.codes):,} copies")
+        return 0 if len(changed) == len(args.codes) else 1
+
+    isbn = args.codes[0]
+    book = db.run(lambda conn: library_db.fetch_one(conn, 'book_by_isbn', (isbn,)))
+    if book is None:
+        print(f"No book with ISBN {isbn}", file=sys.stderr)
+        return 1
+    if args.action == 'add':
+        db.run(lambda conn: book_bulk.update_books(
+            conn, [book[0]], copies=args.count, branch=args.branch or book_bulk.DEFAULT_BRANCH))
+    copies = db.run(lambda conn: library_db.fetch_all(conn, 'title_copies', (isbn,)))
+    print(book[1])
+    for barcode, branch, condition, status, added_at in copies:
+        print(f"  {barcode:<14} {branch:<16} {condition:<8} {status:<10} "
+              f"added {added_at:%Y-%m-%d}")
+    shelved = sum(1 for copy in copies if copy[3] == 'Available')
+    print(f"{shelved:,} of {len(copies):,} copies on the shelf")
+    return 0
+
+
+def cmd_stress_borrow(db, args):
+    from circulation import stress_test
+
+    result = stress_test(db, args.workers, args.rounds, args.pool_size, args.cart_size)
+    print(f"Stress test: {result}")
+    for problem in result.problems:
+        print(f"  {problem}")
+    if not result.passed:
+        print("FAILED", file=sys.stderr)
+        return 1
+    print("No double lending detected")
+
+
+def cmd_stress_holds(db, args):
+    from hold_queue import stress_test
+
+    result = stress_test(db, args.workers, args.rounds, args.pool_size)
+    print(f"Hold stress test: {result}")
+    for problem in result.problems:
+        print(f"  {problem}")
+    if not result.passed:
+        print("FAILED", file=sys.stderr)
+        return 1
+    print("Every return went to the right hold and no book was lent or shelved twice")
+
+
+def cmd_replica(db, args):
+    from local_replica import LocalReplica, prune_changes
+
+    if args.prune:
+        print(f"Pruned {prune_changes(db):,} change log rows")
+    path = args.path or db.config['replica_path']
+    if not path:
+        print("No replica path: pass --path or set replica_path", file=sys.stderr)
+        return 1
+    replica = LocalReplica(path)
+    try:
+        print(f"Replica {path}: {replica.sync(db)}")
+        ops = replica.ops(('conflict', 'failed'))
+    finally:
+        replica.close()
+    for op in ops:
+        print(f"  {op.state.upper()} {op.kind} queued {op.queued_on}: {', '.join(op.isbns)}")
+        print(f"    {op.result}")
+    return 1 if ops else 0
+
+
+def cmd_analytics(db, args):
+    from analytics import DIMENSIONS, refresh_rollups, report
+
+    if args.refresh:
+        print(f"Recounted loan rollups for {refresh_rollups(db)} day(s)")
+    result = db.run(lambda conn: report(conn, args.days, args.top))
+    print(result)
+    for dimension in DIMENSIONS:
+        print(f"Top {dimension}:")
+        for entry in result.top[dimension]:
+            print(f"  {entry.loans:8,}  {entry.late_rate:4.0%} late  {entry.name}")
+
+
+def cmd_export(db, args):
+    from report_export import export_report
+
+    filters = {'status': args.status, 'student_id': args.student_id,
+               'date_from': args.date_from, 'date_to': args.date_to}
+    if args.report != 'loans' and any(filters.values()):
+        print("Filters only apply to the loans report", file=sys.stderr)
+        return 1
+    conn = db.connect()
+    try:
+        result = export_report(conn, args.report, args.path, args.format, args.compression,
+                               filters if args.report == 'loans' else None, print_progress)
+    finally:
+        conn.close()
+    print(f"Exported {result.rows:,} rows to {result.path} ({result.bytes / 1e6:,.1f} MB) "
+          f"in {result.seconds:.1f}s")
+
+
+def cmd_recommend(db, args):
+    import library_db
+    import recommender
+
+    if args.action in ('book', 'member'):
+        if not args.key:
+            print(f"Pass the {'ISBN' if args.action == 'book' else 'student ID'}",
+                  file=sys.stderr)
+            return 1
+
+        def lookup(conn):
+            if args.action == 'book':
+                found = library_db.fetch_one(conn, 'book_by_isbn', (args.key,))
+                name = 'also_borrowed'
+            else:
+                found = library_db.fetch_one(conn, 'member_by_student', (args.key,))
+                name = 'member_suggestions'
+            return found and library_db.fetch_all(conn, name, (found[0], args.top))
+
+        rows = db.run(lookup, retry=True)
+        if rows is None:
+            print(f"No {args.action} {args.key}", file=sys.stderr)
+            return 1
+        for _, title, isbn, author, score in rows:
+            print(f"  {score:6.3f}  {isbn}  {title} ({author or 'unknown author'})")
+        if not rows:
+            print("No recommendations yet (run 'recommend build')")
+        return 0
+
+    conn = db.connect()
+    try:
+        if args.action == 'build':
+            print(recommender.build(conn))
+        elif args.action == 'update':
+            print(recommender.update(conn))
+        else:
+            built, updated, timings = recommender.benchmark(conn, args.lookups, args.requeue)
+            print(built)
+            print(f"Update of {args.requeue:,} re-queued loans (rolled back): {updated}")
+            for timing in timings:
+                print(f"  {timing}")
+    finally:
+        conn.close()
+
+
+def cmd_serve(db, args):
+    from library_api import api_token, run_server
+
+    token = api_token()
+    if token is None:
+        print("Set SMARTLIBRARY_API_TOKEN before serving the API; every request must "
+              "send it as a bearer token", file=sys.stderr)
+        return 1
+    run_server(db, args.host, args.port, token)
+
+
+def cmd_loadtest(db, args):
+    from api_loadtest import load_test
+    from library_api import api_token
+
+    result = load_test(args.url, args.concurrency, args.requests, args.conditional, api_token())
+    print(f"Load test {args.url}: {result}")
+    return 1 if result.errors else 0
+
+
+def cmd_generate(db, args):
+    from datagen import generate
+
+    def progress(table, rows):
+        print(f"\r  {table:<18} {rows:,} rows", end='', file=sys.stderr, flush=True)
+
+    conn = db.connect()
+    try:
+        result = generate(conn, args.books, args.members, args.loans, args.years, args.seed,
+                          progress)
+    finally:
+        conn.close()
+    print(file=sys.stderr)
+    print(f"Generated {result.books:,} books, {result.authors:,} authors, "
+          f"{result.members:,} members, {result.loans:,} loans ({result.open_loans:,} open), "
+          f"{result.clubs:,} clubs in {result.seconds:.1f}s")
+
+
+def cmd_bench(db, args):
+    import bench
+
+    conn = db.connect()
+    try:
+        timings = bench.run_benchmarks(conn, args.iterations, args.plans_dir, args.only)
+    finally:
+        conn.close()
+
+    baseline = bench.load_baseline(args.baseline)
+    print(f"{'query':<20} {'median ms':>10} {'p95 ms':>10} {'min ms':>10} {'rows':>6} {'baseline':>10}")
+    for t in timings:
+        expected = baseline.get(t.name, {}).get('median_ms')
+        expected = f"{expected:10.2f}" if expected is not None else f"{'-':>10}"
+        print(f"{t.name:<20} {t.median_ms:10.2f} {t.p95_ms:10.2f} {t.min_ms:10.2f} {t.rows:6} {expected}")
+
+    if args.update_baseline:
+        bench.save_baseline(args.baseline, timings)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    slower = bench.regressions(timings, baseline, args.tolerance)
+    for timing, expected in slower:
+        print(f"REGRESSION {timing.name}: {timing.median_ms:.2f} ms vs baseline {expected:.2f} ms",
+              file=sys.stderr)
+    return 1 if slower else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='library_cli.py',
+                                     description="SmartLibrary command line tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('import', help="bulk import a CSV/TSV catalog dump")
+    p.add_argument('file')
+    p.add_argument('--delimiter', help="field delimiter (default: sniff comma or tab)")
+    p.set_defaults(func=cmd_import)
+
+    p = commands.add_parser('sweep', help="mark overdue loans in bounded batches")
+    p.add_argument('--daemon', action='store_true', help="every --interval seconds, sweep and run "
+                   "the other maintenance steps (see maintenance.py)")
+    p.add_argument('--interval', type=int, default=300)
+    p.add_argument('--batch-size', type=int, default=1000)
+    p.set_defaults(func=cmd_sweep)
+
+    p = commands.add_parser('partitions',
+                            help="create upcoming loans partitions and archive old ones")
+    p.add_argument('--ahead', type=int, default=3, help="months to create ahead (default: 3)")
+    p.add_argument('--archive-before', type=date.fromisoformat, metavar='YYYY-MM-DD',
+                   help="detach months ending on or before this date with no open loans")
+    p.set_defaults(func=cmd_partitions)
+
+    p = commands.add_parser('check-loan-counts',
+                            help="compare members.active_loan_count with the loans table")
+    p.add_argument('--repair', action='store_true', help="fix any counts that drifted")
+    p.set_defaults(func=cmd_check_loan_counts)
+
+    p = commands.add_parser('borrow', help="check out a cart of books for a member")
+    p.add_argument('student_id')
+    p.add_argument('isbns', nargs='+', metavar='isbn')
+    p.add_argument('--days', type=int, default=7, help="loan period (default: 7)")
+    p.set_defaults(func=cmd_borrow)
+
+    p = commands.add_parser('return', help="return one or more books")
+    p.add_argument('isbns', nargs='+', metavar='isbn')
+    p.set_defaults(func=cmd_return)
+
+    p = commands.add_parser('stress-borrow',
+                            help="race parallel checkouts and verify nothing is lent twice "
+                                 "(writes loan history; use a test database)")
+    p.add_argument('--workers', type=int, default=16)
+    p.add_argument('--rounds', type=int, default=20)
+    p.add_argument('--pool-size', type=int, default=10, help="books the workers compete for")
+    p.add_argument('--cart-size', type=int, default=3)
+    p.set_defaults(func=cmd_stress_borrow)
+
+    p = commands.add_parser('hold', help="place, cancel or list a member's holds, "
+                                         "or expire uncollected ones")
+    p.add_argument('action', choices=('place', 'cancel', 'list', 'expire'),
+                   help="expire also sends the pending notices (the sweeper does both)")
+    p.add_argument('student_id', nargs='?')
+    p.add_argument('isbns', nargs='*', metavar='isbn')
+    p.add_argument('--priority', type=int, default=0,
+                   help="higher is served first, e.g. 1 for course reserves (default: 0)")
+    p.set_defaults(func=cmd_hold)
+
+    p = commands.add_parser('copies', help="list, add or change a book's copies, "
+                                           "or check the per-book copy counts")
+    p.add_argument('action', choices=('list', 'add', 'set', 'check'))
+    p.add_argument('codes', nargs='*', metavar='isbn|barcode',
+                   help="the book's ISBN for list and add, copy barcodes for set")
+    p.add_argument('--count', type=int, default=1, help="copies to add (default: 1)")
+    p.add_argument('--branch', help="branch of new copies (default: Main), or move them here")
+    p.add_argument('--status', choices=('Available', 'Repair', 'Lost', 'Withdrawn'),
+                   help="copies on loan or on the hold shelf keep theirs")
+    p.add_argument('--condition', choices=('New', 'Good', 'Fair', 'Poor', 'Damaged'))
+    p.add_argument('--repair', action='store_true', help="check: fix any counts that drifted")
+    p.set_defaults(func=cmd_copies)
+
+    p = commands.add_parser('stress-holds',
+                            help="race returns, holds and walk-up borrows and verify every "
+                                 "book goes to the right hold (writes history; use a test database)")
+    p.add_argument('--workers', type=int, default=18)
+    p.add_argument('--rounds', type=int, default=30)
+    p.add_argument('--pool-size', type=int, default=4, help="books the workers compete for")
+    p.set_defaults(func=cmd_stress_holds)
+
+    p = commands.add_parser('generate',
+                            help="append synthetic library-scale data through COPY")
+    p.add_argument('--books', type=int, default=1_000_000)
+    p.add_argument('--members', type=int, default=100_000)
+    p.add_argument('--loans', type=int, default=10_000_000)
+    p.add_argument('--years', type=int, default=5, help="loan history to spread over")
+    p.add_argument('--seed', type=int, default=42)
+    p.set_defaults(func=cmd_generate)
+
+    p = commands.add_parser('bench', help="time every GUI query and check for regressions")
+    p.add_argument('--iterations', type=int, default=20)
+    p.add_argument('--baseline', default='bench_baseline.json')
+    p.add_argument('--update-baseline', action='store_true',
+                   help="store this run as the new baseline instead of comparing")
+    p.add_argument('--tolerance', type=float, default=0.25,
+                   help="allowed slowdown of the median (default: 0.25 = 25%%)")
+    p.add_argument('--plans-dir', help="write EXPLAIN (ANALYZE, BUFFERS) output per query here")
+    p.add_argument('--only', nargs='+', metavar='query', help="run just these queries")
+    p.set_defaults(func=cmd_bench)
+
+    p = commands.add_parser('replica', help="sync a desk's offline SQLite replica "
+                                            "and replay its queued carts")
+    p.add_argument('--path', help="SQLite file (default: replica_path from the config)")
+    p.add_argument('--prune', action='store_true',
+                   help="first drop server change log rows past the retention period")
+    p.set_defaults(func=cmd_replica)
+
+    p = commands.add_parser('analytics', help="most borrowed books, authors and genres, "
+                                              "most active members and overdue rates")
+    p.add_argument('--days', type=int, default=30, help="window ending today (default: 30)")
+    p.add_argument('--top', type=int, default=10)
+    p.add_argument('--refresh', action='store_true',
+                   help="first recount the days whose loans changed (nightly job)")
+    p.set_defaults(func=cmd_analytics)
+
+    p = commands.add_parser('export', help="stream the loans history, members or catalog "
+                                           "to CSV, JSON Lines or Parquet")
+    p.add_argument('report', choices=('loans', 'members', 'catalog'))
+    p.add_argument('path', help="e.g. loans.csv.gz, members.jsonl.zst, catalog.parquet")
+    p.add_argument('--format', choices=('csv', 'jsonl', 'parquet'),
+                   help="default: from the file name")
+    p.add_argument('--compression', choices=('none', 'gzip', 'zstd'),
+                   help="default: from the file name (.gz / .zst)")
+    p.add_argument('--status', choices=('Active', 'Overdue', 'Returned'))
+    p.add_argument('--student-id')
+    p.add_argument('--from', dest='date_from', type=date.fromisoformat, metavar='YYYY-MM-DD')
+    p.add_argument('--to', dest='date_to', type=date.fromisoformat, metavar='YYYY-MM-DD')
+    p.set_defaults(func=cmd_export)
+
+    p = commands.add_parser('recommend', help="build or update the precomputed recommendations, "
+                                              "or look them up for a book or member")
+    p.add_argument('action', choices=('build', 'update', 'bench', 'book', 'member'),
+                   help="build/update/bench need numpy and scipy")
+    p.add_argument('key', nargs='?', help="ISBN for book, student ID for member")
+    p.add_argument('--top', type=int, default=10)
+    p.add_argument('--lookups', type=int, default=1000, help="bench: lookups to time per query")
+    p.add_argument('--requeue', type=int, default=10_000,
+                   help="bench: latest loans to fold in as if new")
+    p.set_defaults(func=cmd_recommend)
+
+    p = commands.add_parser('serve', help="run the REST/JSON API "
+                                          "(every request needs SMARTLIBRARY_API_TOKEN)")
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8080)
+    p.set_defaults(func=cmd_serve)
+
+    p = commands.add_parser('loadtest', help="measure requests/sec and p99 latency of a GET endpoint")
+    p.add_argument('url', help="e.g. http://127.0.0.1:8080/api/books")
+    p.add_argument('--concurrency', type=int, default=32, help="keep-alive connections")
+    p.add_argument('--requests', type=int, default=2000)
+    p.add_argument('--conditional', action='store_true',
+                   help="send If-None-Match with the last ETag (measures 304 responses)")
+    p.set_defaults(func=cmd_loadtest)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    db = Database()
+    try:
+        return args.func(db, args) or 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,489 @@
+import configparser
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+from query_metrics import InstrumentedCursor, metrics
+
+CONFIG_FILE = os.environ.get(
+    'SMARTLIBRARY_CONFIG',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'smartlibrary.ini'))
+
+DEFAULTS = {
+    'dbname': 'smartlibrary',
+    'user': 'postgres',
+    'password': '',
+    'host': 'localhost',
+    'port': '5432',
+    'sslmode': '',
+    'connect_timeout': '5',
+    'minconn': '1',
+    'maxconn': '8',
+    # Statements slower than this are logged with their plan
+    'slow_query_ms': '200',
+    # Prometheus text file the GUI rewrites periodically (empty: off)
+    'metrics_file': '',
+    # Local SQLite replica for offline desks (empty: off)
+    'replica_path': '',
+    # Where hold pickup notices go: log, file:PATH or command:CMD (hold_queue.py)
+    'hold_notifier': 'log',
+}
+
+POOL_KEYS = ('minconn', 'maxconn')
+# Settings for this application rather than for libpq
+APP_KEYS = POOL_KEYS + ('slow_query_ms', 'metrics_file', 'replica_path', 'hold_notifier')
+
+# Connections idle for longer than this are pinged before being handed out
+HEALTH_CHECK_AFTER = 30  # seconds
+
+# Statements the screens run, prepared once per pooled connection.
+# Parameters use PREPARE's $n syntax.
+STATEMENTS = {
+    # The role name comes from role_names, which desks cache
+    'login': "SELECT u.id, u.name, u.role_id FROM users u WHERE u.username = $1",
+    'role_names': "SELECT id, name FROM roles ORDER BY id",
+    'dashboard_stats': """
+        SELECT total_books, available_books, members, active_loans, overdue_loans
+        FROM library_stats_totals
+    """,
+    'recent_loans': """
+        SELECT l.id, b.title, u.name, l.due_date, l.status
+        FROM loans l
+        JOIN books b ON l.book_id = b.id
+        JOIN members m ON l.member_id = m.id
+        JOIN users u ON m.user_id = u.id
+        WHERE l.status IN ('Active', 'Overdue')
+        ORDER BY l.due_date
+        LIMIT 15
+    """,
+    'book_insert': """
+        INSERT INTO books (title, isbn, genre, author_id, available)
+        VALUES ($1, $2, $3, $4, TRUE)
+    """,
+    # Books on loan are kept by a bulk delete (book_bulk.py)
+    'books_delete_impact': """
+        WITH picked AS (
+            SELECT b.id, EXISTS (SELECT 1 FROM loans o WHERE o.book_id = b.id
+                                   AND o.status IN ('Active', 'Overdue')) AS on_loan
+            FROM books b WHERE b.id = ANY($1)
+        )
+        SELECT COUNT(*) FILTER (WHERE NOT on_loan), COUNT(*) FILTER (WHERE on_loan),
+               (SELECT COUNT(*) FROM loans l JOIN picked p ON l.book_id = p.id
+                WHERE NOT p.on_loan)
+        FROM picked
+    """,
+    'books_by_id': """
+        SELECT b.id, b.title, b.isbn, a.name, b.genre, b.available, cc.available, cc.total
+        FROM books b LEFT JOIN authors a ON b.author_id = a.id
+        LEFT JOIN copy_counts cc ON cc.book_id = b.id
+        WHERE b.id = ANY($1)
+    """,
+    'author_names': "SELECT id, name FROM authors ORDER BY name",
+    'authors_list': "SELECT id, name, bio FROM authors ORDER BY name",
+    'members_list': """
+        SELECT m.id, m.student_id, u.name, u.email, m.contact, m.active_loan_count
+        FROM members m JOIN users u ON m.user_id = u.id
+        ORDER BY m.student_id
+    """,
+    'members_summary': """
+        SELECT m.id, m.student_id, u.name, m.active_loan_count
+        FROM members m JOIN users u ON m.user_id = u.id
+        ORDER BY m.student_id
+    """,
+    'mark_overdue_batch': "SELECT mark_overdue_batch($1)",
+    'ensure_loan_partitions': """
+        SELECT ensure_loan_partitions(CURRENT_DATE, (CURRENT_DATE + $1 * INTERVAL '1 month')::DATE)
+    """,
+    'archive_loan_partitions': "SELECT archive_loan_partitions($1)",
+    'loan_count_drift': """
+        SELECT member_id, stored, actual
+        FROM active_loan_count_drift
+        ORDER BY member_id
+    """,
+    'repair_loan_counts': """
+        SELECT member_id, stored, actual
+        FROM repair_active_loan_counts()
+        ORDER BY member_id
+    """,
+    'member_by_student': """
+        SELECT m.id, u.name, m.active_loan_count
+        FROM members m JOIN users u ON m.user_id = u.id
+        WHERE m.student_id = $1
+    """,
+    'borrow_books': "SELECT isbn, loan_id, status FROM borrow_books($1, $2, $3)",
+    'return_books': "SELECT isbn, loan_id, status FROM return_books($1)",
+    # Offline carts replayed with the day they were scanned (migrations/010)
+    'borrow_books_on': "SELECT isbn, loan_id, status FROM borrow_books($1, $2, $3, $4)",
+    'return_books_on': "SELECT isbn, loan_id, status FROM return_books($1, $2)",
+    'prune_replica_changes': "SELECT prune_replica_changes($1 * INTERVAL '1 day')",
+    'clubs_list': """
+        SELECT bc.id, bc.name, bc.description,
+               (SELECT COUNT(*) FROM book_club_members WHERE club_id = bc.id)
+        FROM book_clubs bc
+        ORDER BY bc.name
+    """,
+    # Analytics over the daily rollups (migrations/012): $1 first day, $2 limit
+    'refresh_loan_rollups': "SELECT refresh_loan_rollups()",
+    'loans_per_day': """
+        SELECT day, SUM(loans)::INTEGER, SUM(late)::INTEGER
+        FROM loan_rollup_genres
+        WHERE day >= $1
+        GROUP BY day
+        ORDER BY day
+    """,
+    'top_books': """
+        SELECT t.book_id, b.title, t.loans, t.late
+        FROM (SELECT book_id, SUM(loans)::INTEGER AS loans, SUM(late)::INTEGER AS late
+              FROM loan_rollup_books WHERE day >= $1
+              GROUP BY book_id ORDER BY 2 DESC, 1 LIMIT $2) t
+        JOIN books b ON b.id = t.book_id
+        ORDER BY t.loans DESC, t.book_id
+    """,
+    'top_members': """
+        SELECT t.member_id, u.name || ' (' || m.student_id || ')', t.loans, t.late
+        FROM (SELECT member_id, SUM(loans)::INTEGER AS loans, SUM(late)::INTEGER AS late
+              FROM loan_rollup_members WHERE day >= $1
+              GROUP BY member_id ORDER BY 2 DESC, 1 LIMIT $2) t
+        JOIN members m ON m.id = t.member_id
+        JOIN users u ON u.id = m.user_id
+        ORDER BY t.loans DESC, t.member_id
+    """,
+    'top_authors': """
+        SELECT t.author_id, a.name, t.loans, t.late
+        FROM (SELECT author_id, SUM(loans)::INTEGER AS loans, SUM(late)::INTEGER AS late
+              FROM loan_rollup_authors WHERE day >= $1
+              GROUP BY author_id ORDER BY 2 DESC, 1 LIMIT $2) t
+        JOIN authors a ON a.id = t.author_id
+        ORDER BY t.loans DESC, t.author_id
+    """,
+    'top_genres': """
+        SELECT genre, genre, SUM(loans)::INTEGER, SUM(late)::INTEGER
+        FROM loan_rollup_genres WHERE day >= $1
+        GROUP BY genre ORDER BY 3 DESC, 1 LIMIT $2
+    """,
+    'also_borrowed': """
+        SELECT b.id, b.title, b.isbn, a.name, n.score
+        FROM book_neighbours n
+        JOIN books b ON b.id = n.neighbour_id
+        LEFT JOIN authors a ON b.author_id = a.id
+        WHERE n.book_id = $1 AND n.rank <= $2
+        ORDER BY n.rank
+    """,
+    'member_suggestions': """
+        SELECT b.id, b.title, b.isbn, a.name, s.score
+        FROM member_suggestions s
+        JOIN books b ON b.id = s.book_id
+        LEFT JOIN authors a ON b.author_id = a.id
+        WHERE s.member_id = $1 AND s.rank <= $2
+        ORDER BY s.rank
+    """,
+    'book_by_isbn': "SELECT id, title FROM books WHERE isbn = $1",
+    'place_holds': "SELECT isbn, hold_id, status FROM place_holds($1, $2, $3)",
+    'cancel_holds': "SELECT isbn, hold_id, status FROM cancel_holds($1, $2)",
+    'expire_holds_batch': "SELECT expire_holds_batch($1)",
+    'member_holds': """
+        SELECT h.id, b.title, b.isbn, h.status, h.placed_at, h.expires_at,
+               CASE WHEN h.status = 'Waiting' THEN
+                   (SELECT COUNT(*) + 1 FROM holds q
+                    WHERE q.book_id = h.book_id AND q.status = 'Waiting'
+                      AND (q.priority > h.priority
+                           OR (q.priority = h.priority AND q.id < h.id)))
+               END
+        FROM holds h JOIN books b ON b.id = h.book_id
+        WHERE h.member_id = $1 AND h.status IN ('Waiting', 'Ready')
+        ORDER BY h.status, h.id
+    """,
+    'title_copies': """
+        SELECT c.barcode, c.branch, c.condition, c.status, c.added_at
+        FROM copies c JOIN books b ON b.id = c.book_id
+        WHERE b.isbn = $1
+        ORDER BY c.branch, c.id
+    """,
+    'copy_count_drift': """
+        SELECT isbn, stored_available, stored_total, available, total
+        FROM copy_count_drift ORDER BY book_id
+    """,
+    'repair_copy_counts': """
+        SELECT isbn, stored_available, stored_total, available, total
+        FROM repair_copy_counts() ORDER BY book_id
+    """,
+}
+
+BOOKS_PAGE_SQL = """
+    SELECT b.id, b.title, b.isbn, a.name, b.genre, b.available, cc.available, cc.total
+    FROM books b LEFT JOIN authors a ON b.author_id = a.id
+    LEFT JOIN copy_counts cc ON cc.book_id = b.id
+    {where}
+    ORDER BY {order}
+    LIMIT %s
+"""
+
+LOANS_PAGE_SQL = """
+    SELECT l.id, b.title, u.name, l.borrow_date, l.due_date, l.return_date, l.status
+    FROM loans l
+    JOIN books b ON l.book_id = b.id
+    JOIN members m ON l.member_id = m.id
+    JOIN users u ON m.user_id = u.id
+    {where}
+    ORDER BY {order}
+    LIMIT %s
+"""
+
+
+def load_config(path=CONFIG_FILE):
+    # Defaults < [database] section of the ini file < SMARTLIBRARY_DB_* variables
+    config = dict(DEFAULTS)
+    parser = configparser.ConfigParser()
+    if parser.read(path) and parser.has_section('database'):
+        config.update(parser['database'])
+    for key in DEFAULTS:
+        value = os.environ.get(f'SMARTLIBRARY_DB_{key.upper()}')
+        if value is not None:
+            config[key] = value
+    return config
+
+
+class LibraryConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+        self.cursor_factory = InstrumentedCursor
+
+
+def execute(cursor, name, params=()):
+    # Connections come from Database, so they carry their prepared set
+    prepared = cursor.connection.prepared
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {STATEMENTS[name]}")
+        prepared.add(name)
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+
+def fetch_all(conn, name, params=()):
+    cursor = conn.cursor()
+    try:
+        execute(cursor, name, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def fetch_one(conn, name, params=()):
+    cursor = conn.cursor()
+    try:
+        execute(cursor, name, params)
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def books_page(conn, direction, key, limit):
+    # Keyset pagination on (title, id) so each page is an index range scan
+    conditions, params = [], []
+    order = "b.title, b.id"
+    if key is not None:
+        if direction == 'after':
+            conditions.append("(b.title, b.id) > (%s, %s)")
+        else:
+            conditions.append("(b.title, b.id) < (%s, %s)")
+            order = "b.title DESC, b.id DESC"
+        params += list(key)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = conn.cursor(name='books_page')
+    cursor.itersize = limit
+    try:
+        cursor.execute(BOOKS_PAGE_SQL.format(where=where, order=order), params + [limit])
+        rows = cursor.fetchmany(limit)
+    finally:
+        cursor.close()
+
+    if direction == 'before':
+        rows.reverse()
+    return rows
+
+
+def loan_filters(status=None, student_id=None, date_from=None, date_to=None):
+    conditions, params = [], []
+    if status:
+        conditions.append("l.status = %s")
+        params.append(status)
+    if student_id:
+        conditions.append("l.member_id = (SELECT id FROM members WHERE student_id = %s)")
+        params.append(student_id)
+    if date_from:
+        conditions.append("l.borrow_date >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append("l.borrow_date <= %s")
+        params.append(date_to)
+    return conditions, params
+
+
+def loans_page(conn, direction, key, limit, **filters):
+    # Newest first, keyset on (borrow_date, id). Every filter combination
+    # is an index range scan (migrations/009), and a date range only
+    # touches the matching monthly partitions.
+    conditions, params = loan_filters(**filters)
+
+    order = "l.borrow_date DESC, l.id DESC"
+    if key is not None:
+        if direction == 'after':
+            conditions.append("(l.borrow_date, l.id) < (%s, %s)")
+        else:
+            conditions.append("(l.borrow_date, l.id) > (%s, %s)")
+            order = "l.borrow_date, l.id"
+        params += list(key)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(LOANS_PAGE_SQL.format(where=where, order=order), params + [limit])
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    if direction == 'before':
+        rows.reverse()
+    return rows
+
+
+def loans_by_id(conn, ids, **filters):
+    # The listed loans that still match the filters (row change patches)
+    ids = list(ids)
+    conditions, params = loan_filters(**filters)
+    conditions.append("l.id = ANY(%s)")
+    params.append(ids)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(LOANS_PAGE_SQL.format(where=f"WHERE {' AND '.join(conditions)}",
+                                             order="l.borrow_date DESC, l.id DESC"),
+                       params + [len(ids)])
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+class Database:
+    """Connection pool shared by every screen and background job."""
+
+    def __init__(self, config=None):
+        self.config = config or load_config()
+        self.pool = None
+        self.lock = threading.Lock()
+        # ThreadedConnectionPool raises when exhausted; make callers wait instead
+        self.slots = threading.BoundedSemaphore(int(self.config['maxconn']))
+        metrics.slow_ms = float(self.config['slow_query_ms'])
+
+    def connect_kwargs(self):
+        return {key: value for key, value in self.config.items()
+                if key not in APP_KEYS and value != ''}
+
+    def connect(self):
+        # A dedicated connection outside the pool (listeners, long searches)
+        return psycopg2.connect(connection_factory=LibraryConnection, **self.connect_kwargs())
+
+    def open(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = psycopg2.pool.ThreadedConnectionPool(
+                    int(self.config['minconn']), int(self.config['maxconn']),
+                    connection_factory=LibraryConnection, **self.connect_kwargs())
+        return self.pool
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+
+    def checkout(self):
+        pool = self.open()
+        self.slots.acquire()
+        try:
+            # Every pooled connection may be stale after a server restart
+            for _ in range(int(self.config['maxconn']) + 1):
+                conn = pool.getconn()
+                if self.healthy(conn):
+                    return conn
+                pool.putconn(conn, close=True)
+        except Exception:
+            self.slots.release()
+            raise
+        self.slots.release()
+        raise psycopg2.OperationalError("No healthy database connection available")
+
+    def healthy(self, conn):
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        if time.monotonic() - conn.last_used < HEALTH_CHECK_AFTER:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def release(self, conn):
+        conn.last_used = time.monotonic()
+        try:
+            self.pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+        finally:
+            self.release(conn)
+
+    def run(self, work, retry=False, track=None):
+        """Run work(conn) in one transaction on a pooled connection.
+
+        With retry=True (read-only work) a connection lost mid-query is
+        replaced and the work is run once more. track(conn, running) is
+        told which connection the work is on, so callers can cancel it.
+        """
+        attempts = 2 if retry else 1
+        for attempt in range(1, attempts + 1):
+            conn = None
+            try:
+                with self.connection() as conn:
+                    if track:
+                        track(conn, True)
+                    try:
+                        return work(conn)
+                    finally:
+                        if track:
+                            track(conn, False)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if attempt < attempts and conn is not None and conn.closed:
+                    continue
+                raise
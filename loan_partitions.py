@@ -0,0 +1,16 @@
+import library_db
+
+# Monthly partitions kept ready ahead of today (migrations/009)
+MONTHS_AHEAD = 3
+
+
+def ensure_partitions(db, months_ahead=MONTHS_AHEAD):
+    # Cheap when nothing is missing: one catalog lookup per month
+    return db.run(lambda conn: library_db.fetch_one(
+        conn, 'ensure_loan_partitions', (months_ahead,))[0])
+
+
+def archive_partitions(db, before):
+    """Detach closed months ending on or before `before` into loans_archive."""
+    rows = db.run(lambda conn: library_db.fetch_all(conn, 'archive_loan_partitions', (before,)))
+    return [row[0] for row in rows]
@@ -0,0 +1,366 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import date
+
+import psycopg2
+
+import circulation
+import library_db
+from book_search import ISBN_PATTERN, ISBN_PREFIX_PATTERN, SEARCH_LIMIT
+
+# Changes older than this are pruned on the server; a replica that has
+# not synced for that long takes a full copy again (migrations/010)
+RETENTION_DAYS = 7
+COPY_BATCH = 5000
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS authors (
+        id INTEGER PRIMARY KEY, name TEXT NOT NULL, bio TEXT
+    );
+    CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY, title TEXT NOT NULL, isbn TEXT NOT NULL, genre TEXT,
+        available INTEGER NOT NULL, author_id INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_books_title ON books (title, id);
+    CREATE INDEX IF NOT EXISTS idx_books_isbn ON books (isbn);
+    CREATE INDEX IF NOT EXISTS idx_books_author ON books (author_id);
+    CREATE TABLE IF NOT EXISTS members (
+        id INTEGER PRIMARY KEY, student_id TEXT NOT NULL, name TEXT, email TEXT, contact TEXT,
+        active_loan_count INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_members_student ON members (student_id);
+    CREATE TABLE IF NOT EXISTS book_clubs (
+        id INTEGER PRIMARY KEY, name TEXT NOT NULL, description TEXT, members INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY, value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS op_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        op_id TEXT NOT NULL UNIQUE,
+        kind TEXT NOT NULL,
+        member_id INTEGER,
+        isbns TEXT NOT NULL,
+        days INTEGER,
+        queued_on TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        result TEXT
+    );
+"""
+
+# Postgres query per replicated table; rows come out in the local column order
+SOURCES = {
+    'authors': ("SELECT id, name, bio FROM authors", 'id'),
+    'books': ("SELECT id, title, isbn, genre, available, author_id FROM books", 'id'),
+    'members': ("""
+        SELECT m.id, m.student_id, u.name, u.email, m.contact, m.active_loan_count
+        FROM members m JOIN users u ON m.user_id = u.id
+    """, 'm.id'),
+    'book_clubs': ("""
+        SELECT bc.id, bc.name, bc.description,
+               (SELECT COUNT(*) FROM book_club_members WHERE club_id = bc.id)
+        FROM book_clubs bc
+    """, 'bc.id'),
+}
+
+COLUMNS = {
+    'authors': ('id', 'name', 'bio'),
+    'books': ('id', 'title', 'isbn', 'genre', 'available', 'author_id'),
+    'members': ('id', 'student_id', 'name', 'email', 'contact', 'active_loan_count'),
+    'book_clubs': ('id', 'name', 'description', 'members'),
+}
+
+# The library_db statements a replica can answer, with the same columns
+LOCAL_STATEMENTS = {
+    'author_names': "SELECT id, name FROM authors ORDER BY name",
+    'authors_list': "SELECT id, name, bio FROM authors ORDER BY name",
+    'members_list': """
+        SELECT id, student_id, name, email, contact, active_loan_count
+        FROM members ORDER BY student_id
+    """,
+    'member_by_student': "SELECT id, name, active_loan_count FROM members WHERE student_id = ?",
+    'clubs_list': "SELECT id, name, description, members FROM book_clubs ORDER BY name",
+}
+
+LOCAL_BOOKS_SQL = """
+    SELECT b.id, b.title, b.isbn, a.name, b.genre, b.available
+    FROM books b LEFT JOIN authors a ON b.author_id = a.id
+    {where}
+    ORDER BY {order}
+    LIMIT ?
+"""
+
+CHANGES_SQL = """
+    SELECT table_name, array_agg(DISTINCT row_id)
+    FROM replica_changes
+    WHERE xid >= %s::xid8
+    GROUP BY table_name
+"""
+
+
+class SyncResult(namedtuple('SyncResult', 'full changed deleted replayed conflicts seconds')):
+    def __str__(self):
+        kind = "Full copy" if self.full else "Incremental sync"
+        return (f"{kind}: {self.changed:,} rows updated, {self.deleted:,} deleted, "
+                f"{self.replayed} queued cart(s) replayed ({self.conflicts} with conflicts) "
+                f"in {self.seconds:.2f}s")
+
+
+QueuedOp = namedtuple('QueuedOp', 'id op_id kind member_id isbns days queued_on state result')
+
+
+def prune_changes(db, keep_days=RETENTION_DAYS):
+    return db.run(lambda conn: library_db.fetch_one(
+        conn, 'prune_replica_changes', (keep_days,))[0])
+
+
+class LocalReplica:
+    """SQLite copy of books, authors, members and clubs for one desk.
+
+    sync() pulls whatever changed since the last sync (migrations/010) and
+    first replays borrow/return carts queued while the server was
+    unreachable. Reads go through thread-local connections (WAL mode), so
+    the GUI workers read while a sync is writing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        with self.write_lock:
+            self.writer = self.open()
+            self.writer.execute("PRAGMA journal_mode = WAL")
+            self.writer.executescript(SCHEMA)
+
+    def open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def reader(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self.open()
+        return conn
+
+    def state(self):
+        return dict(self.reader().execute("SELECT key, value FROM sync_state"))
+
+    @property
+    def ready(self):
+        # Usable once the first full copy has landed
+        return 'xmin' in self.state()
+
+    # -- reads ---------------------------------------------------------------
+
+    def fetch_all(self, name, params=()):
+        return self.reader().execute(LOCAL_STATEMENTS[name], params).fetchall()
+
+    def fetch_one(self, name, params=()):
+        return self.reader().execute(LOCAL_STATEMENTS[name], params).fetchone()
+
+    def books_page(self, direction, key, limit):
+        # Same keyset contract as library_db.books_page
+        conditions, params = [], []
+        order = "b.title, b.id"
+        if key is not None:
+            if direction == 'after':
+                conditions.append("(b.title, b.id) > (?, ?)")
+            else:
+                conditions.append("(b.title, b.id) < (?, ?)")
+                order = "b.title DESC, b.id DESC"
+            params += list(key)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.reader().execute(LOCAL_BOOKS_SQL.format(where=where, order=order),
+                                     params + [limit]).fetchall()
+        if direction == 'before':
+            rows.reverse()
+        return rows
+
+    def search_books(self, term, limit=SEARCH_LIMIT):
+        # Every word must prefix a word of the title or author name
+        term = term.strip()
+        conn = self.reader()
+        if ISBN_PATTERN.match(term):
+            rows = conn.execute(LOCAL_BOOKS_SQL.format(where="WHERE b.isbn = ?", order="b.title"),
+                                (term.replace('-', '').upper(), limit)).fetchall()
+            if rows:
+                return rows
+        if ISBN_PREFIX_PATTERN.match(term):
+            rows = conn.execute(LOCAL_BOOKS_SQL.format(where="WHERE b.isbn LIKE ?", order="b.isbn"),
+                                (term.replace('-', '').upper() + '%', limit)).fetchall()
+            if rows:
+                return rows
+
+        words = re.findall(r'\w+', term.lower())
+        if not words:
+            return []
+        conditions, params = [], []
+        for word in words:
+            conditions.append("(' ' || b.title LIKE ? OR ' ' || a.name LIKE ?)")
+            params += [f'% {word}%'] * 2
+        where = f"WHERE {' AND '.join(conditions)}"
+        return conn.execute(LOCAL_BOOKS_SQL.format(where=where, order="b.title, b.id"),
+                            params + [limit]).fetchall()
+
+    # -- offline carts -------------------------------------------------------
+
+    def queue(self, kind, isbns, member_id=None, days=circulation.LOAN_DAYS):
+        """Queue a borrow or return cart for replay; returns 'queued' cart lines.
+
+        The local copy is updated straight away so the desk sees the
+        books as lent or back; the next sync overwrites that with what
+        the server actually did.
+        """
+        isbns = circulation.normalize_isbns(isbns)
+        if not isbns:
+            return []
+        marks = ','.join('?' * len(isbns))
+        with self.write_lock, self.writer:
+            self.writer.execute(
+                "INSERT INTO op_queue (op_id, kind, member_id, isbns, days, queued_on) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (uuid.uuid4().hex, kind, member_id, json.dumps(isbns), days,
+                 date.today().isoformat()))
+            self.writer.execute(f"UPDATE books SET available = ? WHERE isbn IN ({marks})",
+                                [kind == 'return'] + isbns)
+            if kind == 'borrow':
+                self.writer.execute("UPDATE members SET active_loan_count = active_loan_count + ? "
+                                    "WHERE id = ?", (len(isbns), member_id))
+        return [circulation.CartLine(isbn, None, 'queued') for isbn in isbns]
+
+    def checkout(self, db, member_id, isbns, days=circulation.LOAN_DAYS):
+        # circulation.checkout, or queued when the server cannot be reached.
+        # A commit whose answer was lost gets queued too; its replay then
+        # reports the books as already on loan, i.e. as a conflict.
+        try:
+            return circulation.checkout(db, member_id, isbns, days)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return self.queue('borrow', isbns, member_id, days)
+
+    def checkin(self, db, isbns):
+        try:
+            return circulation.checkin(db, isbns)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return self.queue('return', isbns)
+
+    def ops(self, states=('pending', 'conflict', 'failed')):
+        marks = ','.join('?' * len(states))
+        rows = self.reader().execute(
+            f"SELECT id, op_id, kind, member_id, isbns, days, queued_on, state, result "
+            f"FROM op_queue WHERE state IN ({marks}) ORDER BY id", states).fetchall()
+        return [QueuedOp(*row[:4], json.loads(row[4]), *row[5:]) for row in rows]
+
+    def pending_count(self):
+        return self.reader().execute(
+            "SELECT COUNT(*) FROM op_queue WHERE state = 'pending'").fetchone()[0]
+
+    def replay(self, db):
+        """Replay pending carts in order; returns (replayed, conflicts).
+
+        A cart conflicts when any line did not go through (the book was
+        lent elsewhere meanwhile, the member hit the limit, ...); it is
+        kept with the server's answer for a librarian to sort out.
+        Connection errors propagate and leave the rest of the queue as is.
+        """
+        replayed = conflicts = 0
+        for op in self.ops(('pending',)):
+            try:
+                lines = circulation.apply_queued(db, op.op_id, op.kind, op.member_id, op.isbns,
+                                                 op.days, op.queued_on)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                raise
+            except psycopg2.Error as e:
+                state, result = 'failed', str(e).strip()
+            else:
+                ok = ('borrowed',) if op.kind == 'borrow' else circulation.RETURNED
+                state = 'done' if all(line.status in ok for line in lines) else 'conflict'
+                result = [list(line) for line in lines]
+            conflicts += state != 'done'
+            replayed += 1
+            with self.write_lock, self.writer:
+                self.writer.execute("UPDATE op_queue SET state = ?, result = ? WHERE id = ?",
+                                    (state, json.dumps(result), op.id))
+        return replayed, conflicts
+
+    # -- sync ----------------------------------------------------------------
+
+    def sync(self, db):
+        started = time.monotonic()
+        replayed, conflicts = self.replay(db)
+        state = self.state()
+        full = ('xmin' not in state
+                or time.time() - float(state['synced_at']) > (RETENTION_DAYS - 1) * 86400)
+        changed, deleted = db.run(lambda conn: self.pull(conn, state.get('xmin'), full),
+                                  retry=True)
+        return SyncResult(full, changed, deleted, replayed, conflicts,
+                          time.monotonic() - started)
+
+    def pull(self, conn, xmin, full):
+        # One snapshot for the change list and the rows; its xmin is the
+        # next watermark (anything still in flight is read again next time)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::TEXT, "
+                           "EXTRACT(EPOCH FROM now())")
+            next_xmin, now = cursor.fetchone()
+            changes = {}
+            if not full:
+                cursor.execute(CHANGES_SQL, (xmin,))
+                changes = dict(cursor.fetchall())
+        finally:
+            cursor.close()
+
+        changed = deleted = 0
+        with self.write_lock, self.writer:
+            for table, (sql, id_column) in SOURCES.items():
+                insert = (f"INSERT OR REPLACE INTO {table} ({', '.join(COLUMNS[table])}) "
+                          f"VALUES ({', '.join('?' * len(COLUMNS[table]))})")
+                if full:
+                    self.writer.execute(f"DELETE FROM {table}")
+                    source = conn.cursor(name=f'replica_{table}')
+                    source.itersize = COPY_BATCH
+                    try:
+                        source.execute(sql)
+                        while True:
+                            rows = source.fetchmany(COPY_BATCH)
+                            if not rows:
+                                break
+                            self.writer.executemany(insert, rows)
+                            changed += len(rows)
+                    finally:
+                        source.close()
+                    continue
+
+                ids = changes.get(table)
+                if not ids:
+                    continue
+                source = conn.cursor()
+                try:
+                    source.execute(f"{sql} WHERE {id_column} = ANY(%s)", (ids,))
+                    rows = source.fetchall()
+                finally:
+                    source.close()
+                self.writer.executemany(insert, rows)
+                gone = set(ids) - {row[0] for row in rows}
+                self.writer.executemany(f"DELETE FROM {table} WHERE id = ?",
+                                        [(row_id,) for row_id in gone])
+                changed += len(rows)
+                deleted += len(gone)
+
+            self.writer.executemany("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+                                    [('xmin', next_xmin), ('synced_at', str(now))])
+        return changed, deleted
+
+    def close(self):
+        with self.write_lock:
+            self.writer.close()
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
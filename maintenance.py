@@ -0,0 +1,120 @@
+import logging
+import time
+
+from overdue_sweeper import DEFAULT_BATCH_SIZE, sweep_overdue
+
+log = logging.getLogger('smartlibrary.maintenance')
+
+DEFAULT_INTERVAL = 300  # seconds
+
+
+class Maintenance:
+    """The periodic jobs run by librarian desks and the sweeper daemon.
+
+    Each job is its own step with its own error handling, so a step that
+    fails (say, partition creation under a role without CREATE rights)
+    is logged and the rest still run. The overdue sweep goes first; the
+    other steps import their modules when they run. Folding queued loans
+    into the recommendations is numpy work on a dedicated connection, so
+    only the daemon does it (recommendations=True), not every desk.
+    """
+
+    def __init__(self, db, batch_size=DEFAULT_BATCH_SIZE, recommendations=False):
+        self.db = db
+        self.batch_size = batch_size
+        self.notifier = None
+        self.warned_numpy = False
+        self.steps = [
+            ('overdue sweep', self.sweep_overdue),
+            ('loans partitions', self.ensure_partitions),
+            ('replica change pruning', self.prune_replica),
+            ('loan rollups', self.refresh_rollups),
+            ('hold expiry', self.expire_holds),
+            ('hold notices', self.deliver_notices),
+        ]
+        if recommendations:
+            self.steps.append(('recommendation update', self.update_recommendations))
+
+    def run(self):
+        """Run every step once; returns {step name: result} for those that worked."""
+        results = {}
+        for name, step in self.steps:
+            try:
+                results[name] = step()
+            except Exception:
+                log.exception("Maintenance step '%s' failed", name)
+        return results
+
+    def sweep_overdue(self):
+        result = sweep_overdue(self.db, self.batch_size)
+        log.info("Sweep: %s", result)
+        return result
+
+    def ensure_partitions(self):
+        import loan_partitions
+
+        created = loan_partitions.ensure_partitions(self.db)
+        if created:
+            log.info("Created %s loans partition(s)", created)
+        return created
+
+    def prune_replica(self):
+        import local_replica
+
+        return local_replica.prune_changes(self.db)
+
+    def refresh_rollups(self):
+        # After the sweep, so the days it marked overdue are recounted too
+        import analytics
+
+        days = analytics.refresh_rollups(self.db)
+        log.info("Recounted loan rollups for %s day(s)", days)
+        return days
+
+    def expire_holds(self):
+        # Uncollected holds pass their book on to the next in line
+        import hold_queue
+
+        expired = hold_queue.expire(self.db)
+        log.info("Expired %s hold(s)", expired)
+        return expired
+
+    def deliver_notices(self):
+        import hold_queue
+
+        if self.notifier is None:
+            self.notifier = hold_queue.make_notifier(self.db.config['hold_notifier'])
+        sent = hold_queue.deliver_notices(self.db, self.notifier)
+        log.info("Sent %s hold notice(s)", sent)
+        return sent
+
+    def update_recommendations(self):
+        # Drains recommender_pending, which every new loan appends to
+        import recommender
+
+        if recommender.np is None:
+            if not self.warned_numpy:
+                log.warning("numpy/scipy missing: queued loans are not folded into the "
+                            "recommendations here (pip install numpy scipy)")
+                self.warned_numpy = True
+            return None
+        conn = self.db.connect()
+        try:
+            # A nightly build or a second daemon has the queue: next tick
+            result = recommender.update(conn, wait=False)
+        finally:
+            conn.close()
+        if result is None:
+            log.info("Recommendations: another update is running, skipped")
+        else:
+            log.info("Recommendations: %s", result)
+        return result
+
+
+def run_daemon(db, interval=DEFAULT_INTERVAL, batch_size=DEFAULT_BATCH_SIZE):
+    log.info("Maintenance daemon started (every %ss, sweep batches of %s)", interval, batch_size)
+    maintenance = Maintenance(db, batch_size, recommendations=True)
+    while True:
+        started = time.monotonic()
+        maintenance.run()
+        time.sleep(max(interval - (time.monotonic() - started), 1))
@@ -0,0 +1,11 @@
+-- ============================================
+-- MIGRATION 001: KEYSET PAGINATION FOR BOOKS
+-- ============================================
+-- The Books screen pages through the catalog with
+-- WHERE (title, id) > (...) ORDER BY title, id LIMIT n,
+-- which needs a composite index to stay an index range scan.
+
+CREATE INDEX IF NOT EXISTS idx_books_title_id ON books(title, id);
+
+-- Superseded by idx_books_title_id
+DROP INDEX IF EXISTS idx_books_title;
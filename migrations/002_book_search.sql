@@ -0,0 +1,25 @@
+-- ============================================
+-- MIGRATION 002: FULL-TEXT AND TRIGRAM BOOK SEARCH
+-- ============================================
+-- Replaces the leading-wildcard ILIKE search with indexed lookups:
+--   * tsvector columns + GIN for word / prefix matches
+--   * pg_trgm GIN indexes for fuzzy title and author matches
+--   * exact ISBN lookups use the UNIQUE index on books(isbn)
+--   * partial ISBNs ("978074") match as prefixes via text_pattern_ops
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(genre, '')), 'C')
+    ) STORED;
+
+ALTER TABLE authors ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(name, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_books_search ON books USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_authors_search ON authors USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_books_title_trgm ON books USING GIN (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_authors_name_trgm ON authors USING GIN (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_books_isbn_prefix ON books (isbn text_pattern_ops);
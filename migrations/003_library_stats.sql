@@ -0,0 +1,160 @@
+-- ============================================
+-- MIGRATION 003: TRIGGER-MAINTAINED DASHBOARD COUNTERS
+-- ============================================
+-- The dashboard reads its five counters from library_stats_totals
+-- instead of running five COUNT(*) scans. Counters are spread over
+-- 16 slot rows (picked by backend pid) so concurrent writers do not
+-- all queue on one hot row; the view sums the slots.
+
+CREATE TABLE IF NOT EXISTS library_stats (
+    slot SMALLINT PRIMARY KEY,
+    total_books BIGINT NOT NULL DEFAULT 0,
+    available_books BIGINT NOT NULL DEFAULT 0,
+    members BIGINT NOT NULL DEFAULT 0,
+    active_loans BIGINT NOT NULL DEFAULT 0,
+    overdue_loans BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE VIEW library_stats_totals AS
+SELECT SUM(total_books)::BIGINT AS total_books,
+       SUM(available_books)::BIGINT AS available_books,
+       SUM(members)::BIGINT AS members,
+       SUM(active_loans)::BIGINT AS active_loans,
+       SUM(overdue_loans)::BIGINT AS overdue_loans
+FROM library_stats;
+
+-- Recount everything into slot 0 (initial load / repair)
+CREATE OR REPLACE FUNCTION refresh_library_stats()
+RETURNS void AS $$
+BEGIN
+    LOCK TABLE library_stats IN EXCLUSIVE MODE;
+    DELETE FROM library_stats;
+    INSERT INTO library_stats (slot) SELECT generate_series(0, 15);
+    UPDATE library_stats SET
+        total_books = (SELECT COUNT(*) FROM books),
+        available_books = (SELECT COUNT(*) FROM books WHERE available = TRUE),
+        members = (SELECT COUNT(*) FROM members),
+        active_loans = (SELECT COUNT(*) FROM loans WHERE status = 'Active'),
+        overdue_loans = (SELECT COUNT(*) FROM loans WHERE status = 'Overdue')
+    WHERE slot = 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level triggers: one counter UPDATE per statement, however
+-- many rows it touched (transition tables hold the changed rows)
+CREATE OR REPLACE FUNCTION library_stats_books()
+RETURNS TRIGGER AS $$
+DECLARE
+    added_total BIGINT := 0;
+    added_available BIGINT := 0;
+    removed_total BIGINT := 0;
+    removed_available BIGINT := 0;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE available)
+        INTO added_total, added_available FROM new_rows;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE available)
+        INTO removed_total, removed_available FROM old_rows;
+    END IF;
+
+    IF added_total <> removed_total OR added_available <> removed_available THEN
+        UPDATE library_stats SET
+            total_books = total_books + added_total - removed_total,
+            available_books = available_books + added_available - removed_available
+        WHERE slot = pg_backend_pid() % 16;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION library_stats_members()
+RETURNS TRIGGER AS $$
+DECLARE
+    delta BIGINT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT COUNT(*) INTO delta FROM new_rows;
+    ELSE
+        SELECT -COUNT(*) INTO delta FROM old_rows;
+    END IF;
+
+    IF delta <> 0 THEN
+        UPDATE library_stats SET members = members + delta
+        WHERE slot = pg_backend_pid() % 16;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION library_stats_loans()
+RETURNS TRIGGER AS $$
+DECLARE
+    added_active BIGINT := 0;
+    added_overdue BIGINT := 0;
+    removed_active BIGINT := 0;
+    removed_overdue BIGINT := 0;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT COUNT(*) FILTER (WHERE status = 'Active'),
+               COUNT(*) FILTER (WHERE status = 'Overdue')
+        INTO added_active, added_overdue FROM new_rows;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT COUNT(*) FILTER (WHERE status = 'Active'),
+               COUNT(*) FILTER (WHERE status = 'Overdue')
+        INTO removed_active, removed_overdue FROM old_rows;
+    END IF;
+
+    IF added_active <> removed_active OR added_overdue <> removed_overdue THEN
+        UPDATE library_stats SET
+            active_loans = active_loans + added_active - removed_active,
+            overdue_loans = overdue_loans + added_overdue - removed_overdue
+        WHERE slot = pg_backend_pid() % 16;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_stats_books_insert ON books;
+DROP TRIGGER IF EXISTS trigger_stats_books_update ON books;
+DROP TRIGGER IF EXISTS trigger_stats_books_delete ON books;
+DROP TRIGGER IF EXISTS trigger_stats_members_insert ON members;
+DROP TRIGGER IF EXISTS trigger_stats_members_delete ON members;
+DROP TRIGGER IF EXISTS trigger_stats_loans_insert ON loans;
+DROP TRIGGER IF EXISTS trigger_stats_loans_update ON loans;
+DROP TRIGGER IF EXISTS trigger_stats_loans_delete ON loans;
+
+CREATE TRIGGER trigger_stats_books_insert
+    AFTER INSERT ON books REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stats_books();
+CREATE TRIGGER trigger_stats_books_update
+    AFTER UPDATE ON books REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stats_books();
+CREATE TRIGGER trigger_stats_books_delete
+    AFTER DELETE ON books REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stats_books();
+
+CREATE TRIGGER trigger_stats_members_insert
+    AFTER INSERT ON members REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stats_members();
+CREATE TRIGGER trigger_stats_members_delete
+    AFTER DELETE ON members REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stats_members();
+
+CREATE TRIGGER trigger_stats_loans_insert
+    AFTER INSERT ON loans REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stats_loans();
+CREATE TRIGGER trigger_stats_loans_update
+    AFTER UPDATE ON loans REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stats_loans();
+CREATE TRIGGER trigger_stats_loans_delete
+    AFTER DELETE ON loans REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stats_loans();
+
+SELECT refresh_library_stats();
+
+-- Recent Loans panel: open loans ordered by due date
+CREATE INDEX IF NOT EXISTS idx_loans_open_due ON loans(due_date)
+    WHERE status IN ('Active', 'Overdue');
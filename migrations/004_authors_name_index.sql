@@ -0,0 +1,6 @@
+-- ============================================
+-- MIGRATION 004: AUTHOR LOOKUPS BY NAME
+-- ============================================
+-- The catalog importer matches and de-duplicates authors by name.
+
+CREATE INDEX IF NOT EXISTS idx_authors_name ON authors(name);
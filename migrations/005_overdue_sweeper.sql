@@ -0,0 +1,43 @@
+-- ============================================
+-- MIGRATION 005: BATCHED OVERDUE SWEEPER
+-- ============================================
+-- Loans are marked overdue in bounded batches (one short transaction
+-- each) by overdue_sweeper.py, instead of one UPDATE over the whole table.
+
+-- Only open loans are candidates, so the index stays small
+CREATE INDEX IF NOT EXISTS idx_loans_active_due ON loans(due_date)
+    WHERE status = 'Active';
+
+-- Mark up to batch_size overdue loans; rows locked by a borrow/return in
+-- progress are skipped and picked up by the next batch or run
+CREATE OR REPLACE FUNCTION mark_overdue_batch(batch_size INTEGER DEFAULT 1000)
+RETURNS INTEGER AS $$
+DECLARE
+    marked INTEGER;
+BEGIN
+    WITH due AS (
+        SELECT id FROM loans
+        WHERE status = 'Active' AND due_date < CURRENT_DATE
+        ORDER BY due_date
+        LIMIT batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE loans l
+    SET status = 'Overdue'
+    FROM due
+    WHERE l.id = due.id;
+
+    GET DIAGNOSTICS marked = ROW_COUNT;
+    RETURN marked;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Kept for existing callers; still one transaction, but each statement
+-- is bounded. Prefer the sweeper, which commits between batches.
+CREATE OR REPLACE FUNCTION update_overdue_loans()
+RETURNS void AS $$
+BEGIN
+    WHILE mark_overdue_batch(1000) > 0 LOOP
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
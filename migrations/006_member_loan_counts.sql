@@ -0,0 +1,98 @@
+-- ============================================
+-- MIGRATION 006: DENORMALIZED ACTIVE LOAN COUNTS
+-- ============================================
+-- members.active_loan_count is kept exact by row triggers on loans, so
+-- the borrow limit check and the Members screen read one row instead of
+-- counting loans.
+
+ALTER TABLE members ADD COLUMN IF NOT EXISTS active_loan_count INTEGER NOT NULL DEFAULT 0;
+
+-- Members whose stored count disagrees with the loans table
+CREATE OR REPLACE VIEW active_loan_count_drift AS
+SELECT m.id AS member_id,
+       m.active_loan_count AS stored,
+       COALESCE(c.actual, 0) AS actual
+FROM members m
+LEFT JOIN (
+    SELECT member_id, COUNT(*)::INTEGER AS actual
+    FROM loans
+    WHERE status = 'Active'
+    GROUP BY member_id
+) c ON c.member_id = m.id
+WHERE m.active_loan_count <> COALESCE(c.actual, 0);
+
+-- Fix every drifted member and report what was changed
+CREATE OR REPLACE FUNCTION repair_active_loan_counts()
+RETURNS TABLE (member_id INTEGER, stored INTEGER, actual INTEGER) AS $$
+#variable_conflict use_column
+BEGIN
+    -- Keep loan writes out while recounting
+    LOCK TABLE loans IN SHARE MODE;
+    RETURN QUERY
+    UPDATE members m
+    SET active_loan_count = d.actual
+    FROM active_loan_count_drift d
+    WHERE m.id = d.member_id
+    RETURNING m.id, d.stored, d.actual;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Borrow limit: one locked row read. The lock also serializes concurrent
+-- borrows by the same member, which the old COUNT(*) check did not.
+CREATE OR REPLACE FUNCTION check_max_loans()
+RETURNS TRIGGER AS $$
+DECLARE
+    current_count INTEGER;
+BEGIN
+    IF NEW.status IS DISTINCT FROM 'Active' THEN
+        RETURN NEW;
+    END IF;
+
+    SELECT active_loan_count INTO current_count
+    FROM members WHERE id = NEW.member_id
+    FOR UPDATE;
+
+    IF current_count >= 3 THEN
+        RAISE EXCEPTION 'Member has reached maximum loan limit (3 books)';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION maintain_active_loan_count()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'Active' THEN
+        UPDATE members SET active_loan_count = active_loan_count - 1
+        WHERE id = OLD.member_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'Active' THEN
+        UPDATE members SET active_loan_count = active_loan_count + 1
+        WHERE id = NEW.member_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_active_loan_count_insert ON loans;
+DROP TRIGGER IF EXISTS trigger_active_loan_count_update ON loans;
+DROP TRIGGER IF EXISTS trigger_active_loan_count_delete ON loans;
+
+CREATE TRIGGER trigger_active_loan_count_insert
+    AFTER INSERT ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_active_loan_count();
+
+CREATE TRIGGER trigger_active_loan_count_update
+    AFTER UPDATE OF status, member_id ON loans
+    FOR EACH ROW
+    WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.member_id IS DISTINCT FROM NEW.member_id)
+    EXECUTE FUNCTION maintain_active_loan_count();
+
+CREATE TRIGGER trigger_active_loan_count_delete
+    AFTER DELETE ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_active_loan_count();
+
+-- Backfill
+SELECT COUNT(*) AS members_backfilled FROM repair_active_loan_counts();
@@ -0,0 +1,96 @@
+-- ============================================
+-- MIGRATION 007: BORROW / RETURN
+-- ============================================
+-- Both functions handle a whole cart in one round trip and report one
+-- row per ISBN, so a clerk sees exactly which items went through.
+
+-- Statuses: borrowed, not_found, busy (another desk holds the book row),
+-- unavailable, limit_reached
+CREATE OR REPLACE FUNCTION borrow_books(p_member_id INTEGER, p_isbns TEXT[],
+                                        p_loan_days INTEGER DEFAULT 7)
+RETURNS TABLE (isbn TEXT, loan_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    active_count INTEGER;
+    wanted TEXT;
+    book RECORD;
+BEGIN
+    -- Serializes carts for the same member; check_max_loans takes the same lock
+    SELECT active_loan_count INTO active_count
+    FROM members WHERE id = p_member_id
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Member % does not exist', p_member_id;
+    END IF;
+
+    FOREACH wanted IN ARRAY p_isbns LOOP
+        isbn := wanted;
+        loan_id := NULL;
+
+        -- Never wait on a book another desk is lending or returning
+        SELECT b.id, b.available INTO book
+        FROM books b WHERE b.isbn = wanted
+        FOR UPDATE SKIP LOCKED;
+
+        IF NOT FOUND THEN
+            status := CASE WHEN EXISTS (SELECT 1 FROM books b WHERE b.isbn = wanted)
+                           THEN 'busy' ELSE 'not_found' END;
+        ELSIF NOT book.available THEN
+            status := 'unavailable';
+        ELSIF active_count >= 3 THEN
+            status := 'limit_reached';
+        ELSE
+            INSERT INTO loans (book_id, member_id, due_date)
+            VALUES (book.id, p_member_id, CURRENT_DATE + p_loan_days)
+            RETURNING id INTO loan_id;
+            UPDATE books SET available = FALSE WHERE id = book.id;
+            active_count := active_count + 1;
+            status := 'borrowed';
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statuses: returned, not_found, not_borrowed
+CREATE OR REPLACE FUNCTION return_books(p_isbns TEXT[])
+RETURNS TABLE (isbn TEXT, loan_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    wanted TEXT;
+    target INTEGER;
+BEGIN
+    -- Lock every book up front in id order so concurrent batches queue
+    -- instead of deadlocking
+    PERFORM 1 FROM books b WHERE b.isbn = ANY(p_isbns) ORDER BY b.id FOR UPDATE;
+
+    FOREACH wanted IN ARRAY p_isbns LOOP
+        isbn := wanted;
+        loan_id := NULL;
+
+        SELECT b.id INTO target FROM books b WHERE b.isbn = wanted;
+        IF NOT FOUND THEN
+            status := 'not_found';
+        ELSE
+            UPDATE loans l SET status = 'Returned', return_date = CURRENT_DATE
+            WHERE l.id = (SELECT o.id FROM loans o
+                          WHERE o.book_id = target AND o.status IN ('Active', 'Overdue')
+                          ORDER BY o.borrow_date, o.id
+                          LIMIT 1)
+            RETURNING l.id INTO loan_id;
+
+            IF loan_id IS NULL THEN
+                status := 'not_borrowed';
+            ELSE
+                UPDATE books b
+                SET available = NOT EXISTS (SELECT 1 FROM loans o
+                                            WHERE o.book_id = target
+                                              AND o.status IN ('Active', 'Overdue'))
+                WHERE b.id = target;
+                status := 'returned';
+            END IF;
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
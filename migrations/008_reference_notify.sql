@@ -0,0 +1,43 @@
+-- ============================================
+-- MIGRATION 008: CHANGE NOTIFICATIONS FOR REFERENCE DATA
+-- ============================================
+-- Desks cache authors, clubs and roles in memory. Any write to those
+-- tables sends the table name on the smartlibrary_reference channel
+-- (once per statement; Postgres folds repeats within a transaction) so
+-- every desk drops its cached copy right away.
+
+CREATE OR REPLACE FUNCTION notify_reference_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- TG_ARGV[0] names the cached table when it differs from the one written
+    PERFORM pg_notify('smartlibrary_reference', COALESCE(TG_ARGV[0], TG_TABLE_NAME));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_notify_authors ON authors;
+DROP TRIGGER IF EXISTS trigger_notify_book_clubs ON book_clubs;
+DROP TRIGGER IF EXISTS trigger_notify_book_club_members ON book_club_members;
+DROP TRIGGER IF EXISTS trigger_notify_roles ON roles;
+
+CREATE TRIGGER trigger_notify_authors
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON authors
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_reference_change();
+
+CREATE TRIGGER trigger_notify_book_clubs
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON book_clubs
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_reference_change();
+
+-- The clubs list shows member counts
+CREATE TRIGGER trigger_notify_book_club_members
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON book_club_members
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_reference_change('book_clubs');
+
+-- Desks resolve the role name at login from the cached roles
+CREATE TRIGGER trigger_notify_roles
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON roles
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_reference_change();
@@ -0,0 +1,291 @@
+-- ============================================
+-- MIGRATION 009: RANGE-PARTITIONED LOANS
+-- ============================================
+-- loans is partitioned by month of borrow_date. Date-filtered queries
+-- only touch the months they ask for, and closed history can be detached
+-- into the loans_archive schema without a bulk DELETE. The primary key
+-- becomes (id, borrow_date); ids still come from loans_id_seq and stay unique.
+-- loans_default takes loans for months that have no partition yet
+-- (back-dated replays, imports, a new month before the sweeper has run)
+-- until ensure_loan_partitions creates the month and moves them there.
+
+CREATE SCHEMA IF NOT EXISTS loans_archive;
+
+-- Create any missing monthly partitions covering p_from .. p_to, and one
+-- for every month with loans waiting in loans_default.
+-- Called by the migration, the sweeper daemon and 'library_cli.py partitions'.
+CREATE OR REPLACE FUNCTION ensure_loan_partitions(p_from DATE, p_to DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE;
+    month_end DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    FOR month_start IN
+        SELECT generate_series(date_trunc('month', p_from), p_to, INTERVAL '1 month')::DATE
+        UNION
+        SELECT date_trunc('month', borrow_date)::DATE FROM loans_default
+        ORDER BY 1
+    LOOP
+        month_end := (month_start + INTERVAL '1 month')::DATE;
+        partition_name := 'loans_' || to_char(month_start, 'YYYY_MM');
+        CONTINUE WHEN to_regclass('public.' || partition_name) IS NOT NULL
+                   OR to_regclass('loans_archive.' || partition_name) IS NOT NULL;
+        BEGIN
+            IF EXISTS (SELECT 1 FROM loans_default
+                       WHERE borrow_date >= month_start AND borrow_date < month_end) THEN
+                -- A month cannot be added while the default holds rows for it.
+                -- Detached tables carry none of the loans triggers, so moving
+                -- the rows leaves the counters alone; attaching brings the
+                -- triggers, indexes and foreign keys back.
+                ALTER TABLE loans DETACH PARTITION loans_default;
+                EXECUTE format('CREATE TABLE public.%I (LIKE loans INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                               partition_name);
+                EXECUTE format('WITH moved AS (DELETE FROM loans_default '
+                               'WHERE borrow_date >= %L AND borrow_date < %L RETURNING *) '
+                               'INSERT INTO public.%I SELECT * FROM moved',
+                               month_start, month_end, partition_name);
+                EXECUTE format('ALTER TABLE loans ATTACH PARTITION public.%I FOR VALUES FROM (%L) TO (%L)',
+                               partition_name, month_start, month_end);
+                ALTER TABLE loans ATTACH PARTITION loans_default DEFAULT;
+            ELSE
+                EXECUTE format('CREATE TABLE public.%I PARTITION OF loans FOR VALUES FROM (%L) TO (%L)',
+                               partition_name, month_start, month_end);
+            END IF;
+            created := created + 1;
+        EXCEPTION WHEN duplicate_table THEN
+            -- Another session created it first
+            NULL;
+        END;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detach every partition that ends on or before p_before and holds no
+-- open loans, move it to loans_archive and return its name (loans_default
+-- has no upper bound and always stays)
+CREATE OR REPLACE FUNCTION archive_loan_partitions(p_before DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    part RECORD;
+    has_open BOOLEAN;
+    fk RECORD;
+BEGIN
+    FOR part IN
+        SELECT c.relname,
+               (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \(''([^'']+)''\)'))[1]::DATE
+                   AS upper_bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'loans'::regclass
+        ORDER BY 2
+    LOOP
+        CONTINUE WHEN part.upper_bound IS NULL OR part.upper_bound > p_before;
+
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM public.%I WHERE status IN (''Active'', ''Overdue''))',
+                       part.relname)
+        INTO has_open;
+        CONTINUE WHEN has_open;
+
+        EXECUTE format('ALTER TABLE loans DETACH PARTITION public.%I', part.relname);
+        -- Archived history must not block deleting books or members
+        FOR fk IN
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = format('public.%I', part.relname)::regclass AND contype = 'f'
+        LOOP
+            EXECUTE format('ALTER TABLE public.%I DROP CONSTRAINT %I', part.relname, fk.conname);
+        END LOOP;
+        EXECUTE format('ALTER TABLE public.%I SET SCHEMA loans_archive', part.relname);
+        RETURN NEXT part.relname;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    first_day DATE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'loans'::regclass) THEN
+        RETURN;
+    END IF;
+
+    -- Bound to the old table; recreated below
+    DROP VIEW IF EXISTS active_loan_count_drift;
+
+    ALTER TABLE loans RENAME TO loans_unpartitioned;
+    ALTER SEQUENCE loans_id_seq OWNED BY NONE;
+
+    CREATE TABLE loans (
+        id INTEGER NOT NULL DEFAULT nextval('loans_id_seq'),
+        book_id INTEGER REFERENCES books(id) ON DELETE CASCADE,
+        member_id INTEGER REFERENCES members(id) ON DELETE CASCADE,
+        borrow_date DATE NOT NULL DEFAULT CURRENT_DATE,
+        due_date DATE DEFAULT (CURRENT_DATE + INTERVAL '7 days'),
+        return_date DATE,
+        status VARCHAR(20) DEFAULT 'Active' CHECK (status IN ('Active', 'Returned', 'Overdue')),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, borrow_date)
+    ) PARTITION BY RANGE (borrow_date);
+    ALTER SEQUENCE loans_id_seq OWNED BY loans.id;
+    CREATE TABLE loans_default PARTITION OF loans DEFAULT;
+
+    SELECT LEAST(MIN(COALESCE(borrow_date, created_at::DATE)), CURRENT_DATE)
+    INTO first_day FROM loans_unpartitioned;
+    PERFORM ensure_loan_partitions(COALESCE(first_day, CURRENT_DATE),
+                                   (CURRENT_DATE + INTERVAL '12 months')::DATE);
+
+    -- Triggers are attached afterwards, so counters are not counted twice
+    INSERT INTO loans (id, book_id, member_id, borrow_date, due_date, return_date, status, created_at)
+    SELECT id, book_id, member_id, COALESCE(borrow_date, created_at::DATE, CURRENT_DATE),
+           due_date, return_date, status, created_at
+    FROM loans_unpartitioned;
+
+    DROP TABLE loans_unpartitioned;
+END $$;
+
+CREATE TABLE IF NOT EXISTS loans_default PARTITION OF loans DEFAULT;
+
+-- Keep a year of empty partitions ready
+SELECT ensure_loan_partitions(CURRENT_DATE, (CURRENT_DATE + INTERVAL '12 months')::DATE)
+    AS partitions_created;
+
+-- Indexes: each keyset order the Loans screen pages by, plus the partial
+-- indexes for open loans. idx_loans_status is gone: three distinct values
+-- make it a poor filter on its own.
+CREATE INDEX IF NOT EXISTS idx_loans_borrowed ON loans (borrow_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_loans_status_borrowed ON loans (status, borrow_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_loans_member_borrowed ON loans (member_id, borrow_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_loans_book ON loans (book_id);
+CREATE INDEX IF NOT EXISTS idx_loans_open_book ON loans (book_id)
+    WHERE status IN ('Active', 'Overdue');
+CREATE INDEX IF NOT EXISTS idx_loans_open_due ON loans (due_date)
+    WHERE status IN ('Active', 'Overdue');
+CREATE INDEX IF NOT EXISTS idx_loans_active_due ON loans (due_date)
+    WHERE status = 'Active';
+
+-- Triggers from the base schema, 003 and 006, on the partitioned table
+DROP TRIGGER IF EXISTS trigger_check_max_loans ON loans;
+DROP TRIGGER IF EXISTS trigger_stats_loans_insert ON loans;
+DROP TRIGGER IF EXISTS trigger_stats_loans_update ON loans;
+DROP TRIGGER IF EXISTS trigger_stats_loans_delete ON loans;
+DROP TRIGGER IF EXISTS trigger_active_loan_count_insert ON loans;
+DROP TRIGGER IF EXISTS trigger_active_loan_count_update ON loans;
+DROP TRIGGER IF EXISTS trigger_active_loan_count_delete ON loans;
+
+CREATE TRIGGER trigger_check_max_loans
+    BEFORE INSERT ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION check_max_loans();
+
+CREATE TRIGGER trigger_stats_loans_insert
+    AFTER INSERT ON loans REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stats_loans();
+CREATE TRIGGER trigger_stats_loans_update
+    AFTER UPDATE ON loans REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stats_loans();
+CREATE TRIGGER trigger_stats_loans_delete
+    AFTER DELETE ON loans REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stats_loans();
+
+CREATE TRIGGER trigger_active_loan_count_insert
+    AFTER INSERT ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_active_loan_count();
+
+CREATE TRIGGER trigger_active_loan_count_update
+    AFTER UPDATE OF status, member_id ON loans
+    FOR EACH ROW
+    WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.member_id IS DISTINCT FROM NEW.member_id)
+    EXECUTE FUNCTION maintain_active_loan_count();
+
+CREATE TRIGGER trigger_active_loan_count_delete
+    AFTER DELETE ON loans
+    FOR EACH ROW
+    EXECUTE FUNCTION maintain_active_loan_count();
+
+CREATE OR REPLACE VIEW active_loan_count_drift AS
+SELECT m.id AS member_id,
+       m.active_loan_count AS stored,
+       COALESCE(c.actual, 0) AS actual
+FROM members m
+LEFT JOIN (
+    SELECT member_id, COUNT(*)::INTEGER AS actual
+    FROM loans
+    WHERE status = 'Active'
+    GROUP BY member_id
+) c ON c.member_id = m.id
+WHERE m.active_loan_count <> COALESCE(c.actual, 0);
+
+-- id alone is no longer a key; match on (id, borrow_date) so each row is
+-- found in its own partition
+CREATE OR REPLACE FUNCTION mark_overdue_batch(batch_size INTEGER DEFAULT 1000)
+RETURNS INTEGER AS $$
+DECLARE
+    marked INTEGER;
+BEGIN
+    WITH due AS (
+        SELECT id, borrow_date FROM loans
+        WHERE status = 'Active' AND due_date < CURRENT_DATE
+        ORDER BY due_date
+        LIMIT batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE loans l
+    SET status = 'Overdue'
+    FROM due
+    WHERE l.id = due.id AND l.borrow_date = due.borrow_date;
+
+    GET DIAGNOSTICS marked = ROW_COUNT;
+    RETURN marked;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION return_books(p_isbns TEXT[])
+RETURNS TABLE (isbn TEXT, loan_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    wanted TEXT;
+    target INTEGER;
+    open_loan RECORD;
+BEGIN
+    -- Lock every book up front in id order so concurrent batches queue
+    -- instead of deadlocking
+    PERFORM 1 FROM books b WHERE b.isbn = ANY(p_isbns) ORDER BY b.id FOR UPDATE;
+
+    FOREACH wanted IN ARRAY p_isbns LOOP
+        isbn := wanted;
+        loan_id := NULL;
+
+        SELECT b.id INTO target FROM books b WHERE b.isbn = wanted;
+        IF NOT FOUND THEN
+            status := 'not_found';
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        SELECT o.id, o.borrow_date INTO open_loan
+        FROM loans o
+        WHERE o.book_id = target AND o.status IN ('Active', 'Overdue')
+        ORDER BY o.borrow_date, o.id
+        LIMIT 1;
+
+        IF NOT FOUND THEN
+            status := 'not_borrowed';
+        ELSE
+            UPDATE loans l SET status = 'Returned', return_date = CURRENT_DATE
+            WHERE l.id = open_loan.id AND l.borrow_date = open_loan.borrow_date;
+            loan_id := open_loan.id;
+
+            UPDATE books b
+            SET available = NOT EXISTS (SELECT 1 FROM loans o
+                                        WHERE o.book_id = target
+                                          AND o.status IN ('Active', 'Overdue'))
+            WHERE b.id = target;
+            status := 'returned';
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
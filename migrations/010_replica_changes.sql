@@ -0,0 +1,203 @@
+-- ============================================
+-- MIGRATION 010: CHANGE LOG FOR DESK REPLICAS
+-- ============================================
+-- Desks can keep a local SQLite copy of books, authors, members and
+-- clubs (local_replica.py). Every write to those tables logs the ids it
+-- touched, stamped with the writing transaction id. A replica pulls the
+-- rows logged by transactions at or after the xmin of its last sync
+-- snapshot, so a transaction that commits late is never missed.
+
+CREATE TABLE IF NOT EXISTS replica_changes (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    xid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_replica_changes_xid ON replica_changes (xid);
+CREATE INDEX IF NOT EXISTS idx_replica_changes_changed_at ON replica_changes (changed_at);
+
+-- Borrow/return carts queued by an offline desk; the id makes a replay
+-- idempotent when the desk loses the answer to a commit
+CREATE TABLE IF NOT EXISTS replica_applied_ops (
+    op_id TEXT PRIMARY KEY,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    result JSONB
+);
+
+-- Statement-level, like the counters in migration 003: one INSERT per
+-- statement however many rows it touched. Users and club memberships
+-- are logged as the member / club row they show up in.
+CREATE OR REPLACE FUNCTION log_replica_changes()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'users' THEN
+        IF TG_OP = 'UPDATE' THEN
+            INSERT INTO replica_changes (table_name, row_id)
+            SELECT DISTINCT 'members', m.id FROM members m JOIN new_rows n ON m.user_id = n.id;
+        END IF;
+    ELSIF TG_TABLE_NAME = 'book_club_members' THEN
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO replica_changes (table_name, row_id)
+            SELECT DISTINCT 'book_clubs', club_id FROM new_rows;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO replica_changes (table_name, row_id)
+            SELECT DISTINCT 'book_clubs', club_id FROM old_rows;
+        END IF;
+    ELSE
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO replica_changes (table_name, row_id)
+            SELECT TG_TABLE_NAME, id FROM new_rows;
+        END IF;
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO replica_changes (table_name, row_id)
+            SELECT TG_TABLE_NAME, id FROM old_rows;
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    replicated TEXT;
+BEGIN
+    FOREACH replicated IN ARRAY ARRAY['books', 'authors', 'members', 'users', 'book_clubs',
+                                      'book_club_members'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trigger_replica_%1$s_insert ON %1$I', replicated);
+        EXECUTE format('DROP TRIGGER IF EXISTS trigger_replica_%1$s_update ON %1$I', replicated);
+        EXECUTE format('DROP TRIGGER IF EXISTS trigger_replica_%1$s_delete ON %1$I', replicated);
+
+        EXECUTE format('CREATE TRIGGER trigger_replica_%1$s_insert AFTER INSERT ON %1$I '
+                       'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT '
+                       'EXECUTE FUNCTION log_replica_changes()', replicated);
+        EXECUTE format('CREATE TRIGGER trigger_replica_%1$s_update AFTER UPDATE ON %1$I '
+                       'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION log_replica_changes()', replicated);
+        EXECUTE format('CREATE TRIGGER trigger_replica_%1$s_delete AFTER DELETE ON %1$I '
+                       'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT '
+                       'EXECUTE FUNCTION log_replica_changes()', replicated);
+    END LOOP;
+END;
+$$;
+
+-- Replicas that have not synced within the retention period start over
+-- with a full copy
+CREATE OR REPLACE FUNCTION prune_replica_changes(p_keep INTERVAL)
+RETURNS BIGINT AS $$
+DECLARE
+    removed BIGINT;
+BEGIN
+    DELETE FROM replica_changes WHERE changed_at < now() - p_keep;
+    GET DIAGNOSTICS removed = ROW_COUNT;
+    DELETE FROM replica_applied_ops WHERE applied_at < now() - p_keep;
+    RETURN removed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replayed carts keep the day they were scanned at the desk. Adding the
+-- date parameters changes the signatures, so the old ones go first.
+DROP FUNCTION IF EXISTS borrow_books(INTEGER, TEXT[], INTEGER);
+DROP FUNCTION IF EXISTS return_books(TEXT[]);
+
+CREATE OR REPLACE FUNCTION borrow_books(p_member_id INTEGER, p_isbns TEXT[],
+                                        p_loan_days INTEGER DEFAULT 7,
+                                        p_borrowed_on DATE DEFAULT CURRENT_DATE)
+RETURNS TABLE (isbn TEXT, loan_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    active_count INTEGER;
+    wanted TEXT;
+    book RECORD;
+BEGIN
+    -- Serializes carts for the same member; check_max_loans takes the same lock
+    SELECT active_loan_count INTO active_count
+    FROM members WHERE id = p_member_id
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Member % does not exist', p_member_id;
+    END IF;
+
+    FOREACH wanted IN ARRAY p_isbns LOOP
+        isbn := wanted;
+        loan_id := NULL;
+
+        -- Never wait on a book another desk is lending or returning
+        SELECT b.id, b.available INTO book
+        FROM books b WHERE b.isbn = wanted
+        FOR UPDATE SKIP LOCKED;
+
+        IF NOT FOUND THEN
+            status := CASE WHEN EXISTS (SELECT 1 FROM books b WHERE b.isbn = wanted)
+                           THEN 'busy' ELSE 'not_found' END;
+        ELSIF NOT book.available THEN
+            status := 'unavailable';
+        ELSIF active_count >= 3 THEN
+            status := 'limit_reached';
+        ELSE
+            INSERT INTO loans (book_id, member_id, borrow_date, due_date, status)
+            VALUES (book.id, p_member_id, p_borrowed_on, p_borrowed_on + p_loan_days,
+                    CASE WHEN p_borrowed_on + p_loan_days < CURRENT_DATE
+                         THEN 'Overdue' ELSE 'Active' END)
+            RETURNING id INTO loan_id;
+            UPDATE books SET available = FALSE WHERE id = book.id;
+            active_count := active_count + 1;
+            status := 'borrowed';
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statuses: returned, not_found, not_borrowed
+CREATE OR REPLACE FUNCTION return_books(p_isbns TEXT[],
+                                        p_returned_on DATE DEFAULT CURRENT_DATE)
+RETURNS TABLE (isbn TEXT, loan_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    wanted TEXT;
+    target INTEGER;
+    open_loan RECORD;
+BEGIN
+    -- Lock every book up front in id order so concurrent batches queue
+    -- instead of deadlocking
+    PERFORM 1 FROM books b WHERE b.isbn = ANY(p_isbns) ORDER BY b.id FOR UPDATE;
+
+    FOREACH wanted IN ARRAY p_isbns LOOP
+        isbn := wanted;
+        loan_id := NULL;
+
+        SELECT b.id INTO target FROM books b WHERE b.isbn = wanted;
+        IF NOT FOUND THEN
+            status := 'not_found';
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        SELECT o.id, o.borrow_date INTO open_loan
+        FROM loans o
+        WHERE o.book_id = target AND o.status IN ('Active', 'Overdue')
+        ORDER BY o.borrow_date, o.id
+        LIMIT 1;
+
+        IF NOT FOUND THEN
+            status := 'not_borrowed';
+        ELSE
+            UPDATE loans l
+            SET status = 'Returned', return_date = GREATEST(p_returned_on, l.borrow_date)
+            WHERE l.id = open_loan.id AND l.borrow_date = open_loan.borrow_date;
+            loan_id := open_loan.id;
+
+            UPDATE books b
+            SET available = NOT EXISTS (SELECT 1 FROM loans o
+                                        WHERE o.book_id = target
+                                          AND o.status IN ('Active', 'Overdue'))
+            WHERE b.id = target;
+            status := 'returned';
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,54 @@
+-- ============================================
+-- MIGRATION 011: ROW CHANGE NOTIFICATIONS FOR BOOKS AND LOANS
+-- ============================================
+-- Every write to books or loans sends the ids it touched on the
+-- smartlibrary_rows channel as {"table": ..., "ids": [...]}, so desks can
+-- patch just those rows on screen instead of reloading. A statement
+-- touching more than 500 rows (an import, a sweep batch) sends
+-- "ids": null instead, which means "reload", keeping every payload well
+-- under the 8000 byte NOTIFY limit.
+
+CREATE OR REPLACE FUNCTION notify_row_changes()
+RETURNS TRIGGER AS $$
+DECLARE
+    changed INTEGER[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        SELECT array_agg(id) INTO changed FROM (SELECT id FROM old_rows LIMIT 501) o;
+    ELSE
+        SELECT array_agg(id) INTO changed FROM (SELECT id FROM new_rows LIMIT 501) n;
+    END IF;
+    IF changed IS NULL THEN
+        RETURN NULL;
+    END IF;
+    IF array_length(changed, 1) > 500 THEN
+        changed := NULL;
+    END IF;
+    PERFORM pg_notify('smartlibrary_rows',
+                      json_build_object('table', TG_TABLE_NAME, 'ids', changed)::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables on the partitioned loans table cover every partition
+DO $$
+DECLARE
+    watched TEXT;
+BEGIN
+    FOREACH watched IN ARRAY ARRAY['books', 'loans'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trigger_rows_%1$s_insert ON %1$I', watched);
+        EXECUTE format('DROP TRIGGER IF EXISTS trigger_rows_%1$s_update ON %1$I', watched);
+        EXECUTE format('DROP TRIGGER IF EXISTS trigger_rows_%1$s_delete ON %1$I', watched);
+
+        EXECUTE format('CREATE TRIGGER trigger_rows_%1$s_insert AFTER INSERT ON %1$I '
+                       'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT '
+                       'EXECUTE FUNCTION notify_row_changes()', watched);
+        EXECUTE format('CREATE TRIGGER trigger_rows_%1$s_update AFTER UPDATE ON %1$I '
+                       'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT '
+                       'EXECUTE FUNCTION notify_row_changes()', watched);
+        EXECUTE format('CREATE TRIGGER trigger_rows_%1$s_delete AFTER DELETE ON %1$I '
+                       'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT '
+                       'EXECUTE FUNCTION notify_row_changes()', watched);
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,145 @@
+-- ============================================
+-- MIGRATION 012: DAILY LOAN ROLLUPS FOR ANALYTICS
+-- ============================================
+-- Loans per borrow day by book, member, genre and author, with how many
+-- of them ran late (marked Overdue or returned after the due date).
+-- Top-N and time-series queries read these instead of the loans history.
+--
+-- Writers only note which borrow days changed (loan_rollup_dirty);
+-- refresh_loan_rollups() recomputes those days, from the sweeper or the
+-- CLI. Upserting counters from the loans triggers would make desks
+-- lending books of the same genre queue on (and deadlock over) the
+-- same rollup rows.
+
+CREATE TABLE IF NOT EXISTS loan_rollup_books (
+    day DATE NOT NULL,
+    book_id INTEGER NOT NULL,
+    loans INTEGER NOT NULL,
+    late INTEGER NOT NULL,
+    PRIMARY KEY (day, book_id)
+);
+
+CREATE TABLE IF NOT EXISTS loan_rollup_members (
+    day DATE NOT NULL,
+    member_id INTEGER NOT NULL,
+    loans INTEGER NOT NULL,
+    late INTEGER NOT NULL,
+    PRIMARY KEY (day, member_id)
+);
+
+CREATE TABLE IF NOT EXISTS loan_rollup_genres (
+    day DATE NOT NULL,
+    genre TEXT NOT NULL,
+    loans INTEGER NOT NULL,
+    late INTEGER NOT NULL,
+    PRIMARY KEY (day, genre)
+);
+
+CREATE TABLE IF NOT EXISTS loan_rollup_authors (
+    day DATE NOT NULL,
+    author_id INTEGER NOT NULL,
+    loans INTEGER NOT NULL,
+    late INTEGER NOT NULL,
+    PRIMARY KEY (day, author_id)
+);
+
+CREATE TABLE IF NOT EXISTS loan_rollup_dirty (
+    day DATE PRIMARY KEY
+);
+
+-- DO NOTHING on an existing row takes no lock, so marking today dirty
+-- costs concurrent desks nothing
+CREATE OR REPLACE FUNCTION mark_loan_rollups_dirty()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO loan_rollup_dirty (day)
+        SELECT DISTINCT borrow_date FROM new_rows ORDER BY 1
+        ON CONFLICT DO NOTHING;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO loan_rollup_dirty (day)
+        SELECT DISTINCT borrow_date FROM old_rows ORDER BY 1
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_loan_rollups_insert ON loans;
+DROP TRIGGER IF EXISTS trigger_loan_rollups_update ON loans;
+DROP TRIGGER IF EXISTS trigger_loan_rollups_delete ON loans;
+
+CREATE TRIGGER trigger_loan_rollups_insert
+    AFTER INSERT ON loans
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION mark_loan_rollups_dirty();
+
+CREATE TRIGGER trigger_loan_rollups_update
+    AFTER UPDATE ON loans
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION mark_loan_rollups_dirty();
+
+CREATE TRIGGER trigger_loan_rollups_delete
+    AFTER DELETE ON loans
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION mark_loan_rollups_dirty();
+
+-- Genre and author are taken from the book as it is when its day is
+-- rolled up. The lock waits for every transaction that has marked a day
+-- to commit, so the recount below sees their loans; days marked after it
+-- are left for the next refresh.
+CREATE OR REPLACE FUNCTION refresh_loan_rollups()
+RETURNS INTEGER AS $$
+DECLARE
+    days DATE[];
+BEGIN
+    LOCK TABLE loan_rollup_dirty IN SHARE ROW EXCLUSIVE MODE;
+    SELECT array_agg(day) INTO days FROM loan_rollup_dirty;
+    IF days IS NULL THEN
+        RETURN 0;
+    END IF;
+    DELETE FROM loan_rollup_dirty;
+
+    DELETE FROM loan_rollup_books WHERE day = ANY(days);
+    DELETE FROM loan_rollup_members WHERE day = ANY(days);
+    DELETE FROM loan_rollup_genres WHERE day = ANY(days);
+    DELETE FROM loan_rollup_authors WHERE day = ANY(days);
+
+    WITH day_loans AS MATERIALIZED (
+        SELECT l.borrow_date AS day, l.book_id, l.member_id, b.genre, b.author_id,
+               COALESCE(l.status = 'Overdue' OR l.return_date > l.due_date,
+                        FALSE)::INTEGER AS late
+        FROM loans l LEFT JOIN books b ON b.id = l.book_id
+        WHERE l.borrow_date = ANY(days)
+    ), by_book AS (
+        INSERT INTO loan_rollup_books (day, book_id, loans, late)
+        SELECT day, book_id, COUNT(*), SUM(late) FROM day_loans
+        WHERE book_id IS NOT NULL GROUP BY day, book_id
+    ), by_member AS (
+        INSERT INTO loan_rollup_members (day, member_id, loans, late)
+        SELECT day, member_id, COUNT(*), SUM(late) FROM day_loans
+        WHERE member_id IS NOT NULL GROUP BY day, member_id
+    ), by_author AS (
+        INSERT INTO loan_rollup_authors (day, author_id, loans, late)
+        SELECT day, author_id, COUNT(*), SUM(late) FROM day_loans
+        WHERE author_id IS NOT NULL GROUP BY day, author_id
+    )
+    INSERT INTO loan_rollup_genres (day, genre, loans, late)
+    SELECT day, COALESCE(NULLIF(genre, ''), 'Unknown'), COUNT(*), SUM(late) FROM day_loans
+    GROUP BY 1, 2;
+
+    RETURN array_length(days, 1);
+END;
+$$ LANGUAGE plpgsql;
+
+-- First install: roll up the existing history once
+INSERT INTO loan_rollup_dirty (day)
+SELECT DISTINCT borrow_date FROM loans
+WHERE NOT EXISTS (SELECT 1 FROM loan_rollup_genres)
+ON CONFLICT DO NOTHING;
+
+SELECT refresh_loan_rollups();
@@ -0,0 +1,68 @@
+-- ============================================
+-- MIGRATION 013: PRECOMPUTED BOOK RECOMMENDATIONS
+-- ============================================
+-- recommender.py builds these tables in batch from the loans history and
+-- club memberships; the app only reads them by primary key. New loans
+-- are queued in recommender_pending and folded in by an incremental
+-- update without a full rebuild.
+
+-- "Members who borrowed this also borrowed": top-K per book by cosine
+-- similarity of co-borrowing
+CREATE TABLE IF NOT EXISTS book_neighbours (
+    book_id INTEGER NOT NULL,
+    rank SMALLINT NOT NULL,
+    neighbour_id INTEGER NOT NULL,
+    co_borrows INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (book_id, rank)
+);
+
+-- Distinct borrowers per book, the norms of the similarity
+CREATE TABLE IF NOT EXISTS book_borrowers (
+    book_id INTEGER PRIMARY KEY,
+    borrowers INTEGER NOT NULL
+);
+
+-- Most borrowed books among each club's members
+CREATE TABLE IF NOT EXISTS club_top_books (
+    club_id INTEGER NOT NULL,
+    rank SMALLINT NOT NULL,
+    book_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (club_id, rank)
+);
+
+CREATE TABLE IF NOT EXISTS member_suggestions (
+    member_id INTEGER NOT NULL,
+    rank SMALLINT NOT NULL,
+    book_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (member_id, rank)
+);
+
+-- Stamped with the writing transaction: a build or update deletes just
+-- the rows its snapshot saw, without locking out new loans
+CREATE TABLE IF NOT EXISTS recommender_pending (
+    member_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    xid XID8 NOT NULL DEFAULT pg_current_xact_id()
+);
+
+-- Plain appends: no shared rows for concurrent desks to wait on
+CREATE OR REPLACE FUNCTION queue_recommender_loans()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO recommender_pending (member_id, book_id)
+    SELECT member_id, book_id FROM new_rows
+    WHERE member_id IS NOT NULL AND book_id IS NOT NULL;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_recommender_loans ON loans;
+
+CREATE TRIGGER trigger_recommender_loans
+    AFTER INSERT ON loans
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION queue_recommender_loans();
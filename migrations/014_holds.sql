@@ -0,0 +1,347 @@
+-- ============================================
+-- MIGRATION 014: HOLD QUEUE
+-- ============================================
+-- Members queue for books that are out. A return hands the book to the
+-- next hold in the same transaction, under the book row lock every
+-- borrow and return already takes, so no desk can lend it in between.
+-- The book then waits on the hold shelf for that member until it is
+-- collected (an ordinary borrow) or the hold expires.
+
+CREATE TABLE IF NOT EXISTS holds (
+    id SERIAL PRIMARY KEY,
+    book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+    member_id INTEGER NOT NULL REFERENCES members(id) ON DELETE CASCADE,
+    -- Higher goes first (course reserves, accessibility); FIFO within a level
+    priority SMALLINT NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'Waiting'
+        CHECK (status IN ('Waiting', 'Ready', 'Collected', 'Expired', 'Cancelled')),
+    -- Wall clock, not transaction start: rows are written under the book
+    -- lock, so the timestamps order holds the way the queue saw them
+    placed_at TIMESTAMP NOT NULL DEFAULT clock_timestamp(),
+    ready_at TIMESTAMP,
+    expires_at TIMESTAMP,
+    closed_at TIMESTAMP
+);
+
+-- A book's queue in allocation order
+CREATE INDEX IF NOT EXISTS idx_holds_queue ON holds(book_id, priority DESC, id)
+    WHERE status = 'Waiting';
+-- One open hold per member and book, and one book on the shelf per title
+CREATE UNIQUE INDEX IF NOT EXISTS idx_holds_open ON holds(book_id, member_id)
+    WHERE status IN ('Waiting', 'Ready');
+CREATE UNIQUE INDEX IF NOT EXISTS idx_holds_ready ON holds(book_id)
+    WHERE status = 'Ready';
+CREATE INDEX IF NOT EXISTS idx_holds_expiry ON holds(expires_at)
+    WHERE status = 'Ready';
+CREATE INDEX IF NOT EXISTS idx_holds_member ON holds(member_id)
+    WHERE status IN ('Waiting', 'Ready');
+
+-- Outbox read by hold_queue.py. Written in the allocating transaction and
+-- sent after it commits, so a rolled back return never notifies anyone.
+-- A sender claims a batch (claimed_at) and commits before sending it.
+CREATE TABLE IF NOT EXISTS hold_notices (
+    id BIGSERIAL PRIMARY KEY,
+    hold_id INTEGER NOT NULL REFERENCES holds(id) ON DELETE CASCADE,
+    kind VARCHAR(20) NOT NULL CHECK (kind IN ('ready', 'expired')),
+    created_at TIMESTAMP NOT NULL DEFAULT clock_timestamp(),
+    claimed_at TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+ALTER TABLE hold_notices ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_hold_notices_unsent ON hold_notices(id)
+    WHERE sent_at IS NULL;
+
+-- Put each available book in p_book_ids on the shelf for the first
+-- Waiting hold. The caller must hold the books' row locks. Members at the
+-- loan limit could not collect, so they keep their place but are passed
+-- over. Returns the number of holds made ready.
+CREATE OR REPLACE FUNCTION allocate_holds(p_book_ids INTEGER[], p_pickup_days INTEGER DEFAULT 3)
+RETURNS INTEGER AS $$
+DECLARE
+    target INTEGER;
+    next_hold INTEGER;
+    allocated INTEGER := 0;
+BEGIN
+    FOR target IN
+        SELECT b.id FROM books b WHERE b.id = ANY(p_book_ids) AND b.available ORDER BY b.id
+    LOOP
+        SELECT h.id INTO next_hold
+        FROM holds h JOIN members m ON m.id = h.member_id
+        WHERE h.book_id = target AND h.status = 'Waiting' AND m.active_loan_count < 3
+        ORDER BY h.priority DESC, h.id
+        LIMIT 1;
+        CONTINUE WHEN NOT FOUND;
+
+        UPDATE holds h
+        SET status = 'Ready', ready_at = clock_timestamp(),
+            expires_at = clock_timestamp() + p_pickup_days * INTERVAL '1 day'
+        WHERE h.id = next_hold;
+        UPDATE books b SET available = FALSE WHERE b.id = target;
+        INSERT INTO hold_notices (hold_id, kind) VALUES (next_hold, 'ready');
+        allocated := allocated + 1;
+    END LOOP;
+    RETURN allocated;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statuses: placed, not_found, busy, available (borrow it instead),
+-- already_held, has_it (the member has it on loan), hold_limit
+CREATE OR REPLACE FUNCTION place_holds(p_member_id INTEGER, p_isbns TEXT[],
+                                       p_priority INTEGER DEFAULT 0)
+RETURNS TABLE (isbn TEXT, hold_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    open_holds INTEGER;
+    wanted TEXT;
+    book RECORD;
+BEGIN
+    -- Serializes requests of one member, as in borrow_books
+    PERFORM 1 FROM members m WHERE m.id = p_member_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Member % does not exist', p_member_id;
+    END IF;
+    SELECT COUNT(*) INTO open_holds
+    FROM holds h WHERE h.member_id = p_member_id AND h.status IN ('Waiting', 'Ready');
+
+    FOREACH wanted IN ARRAY p_isbns LOOP
+        isbn := wanted;
+        hold_id := NULL;
+
+        -- The lock a return takes: the book cannot come back while the
+        -- hold is queued, so it is either seen as available or allocated
+        SELECT b.id, b.available INTO book
+        FROM books b WHERE b.isbn = wanted
+        FOR UPDATE SKIP LOCKED;
+
+        IF NOT FOUND THEN
+            status := CASE WHEN EXISTS (SELECT 1 FROM books b WHERE b.isbn = wanted)
+                           THEN 'busy' ELSE 'not_found' END;
+        ELSIF book.available THEN
+            status := 'available';
+        ELSIF EXISTS (SELECT 1 FROM holds h
+                      WHERE h.book_id = book.id AND h.member_id = p_member_id
+                        AND h.status IN ('Waiting', 'Ready')) THEN
+            status := 'already_held';
+        ELSIF EXISTS (SELECT 1 FROM loans l
+                      WHERE l.book_id = book.id AND l.member_id = p_member_id
+                        AND l.status IN ('Active', 'Overdue')) THEN
+            status := 'has_it';
+        ELSIF open_holds >= 5 THEN
+            status := 'hold_limit';
+        ELSE
+            INSERT INTO holds (book_id, member_id, priority)
+            VALUES (book.id, p_member_id, p_priority)
+            RETURNING id INTO hold_id;
+            open_holds := open_holds + 1;
+            status := 'placed';
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statuses: cancelled, not_found, not_held
+CREATE OR REPLACE FUNCTION cancel_holds(p_member_id INTEGER, p_isbns TEXT[])
+RETURNS TABLE (isbn TEXT, hold_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    wanted TEXT;
+    target INTEGER;
+    was TEXT;
+BEGIN
+    -- Same lock order as return_books
+    PERFORM 1 FROM books b WHERE b.isbn = ANY(p_isbns) ORDER BY b.id FOR UPDATE;
+
+    FOREACH wanted IN ARRAY p_isbns LOOP
+        isbn := wanted;
+        hold_id := NULL;
+
+        SELECT b.id INTO target FROM books b WHERE b.isbn = wanted;
+        IF NOT FOUND THEN
+            status := 'not_found';
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        SELECT h.id, h.status INTO hold_id, was
+        FROM holds h
+        WHERE h.book_id = target AND h.member_id = p_member_id
+          AND h.status IN ('Waiting', 'Ready');
+        IF NOT FOUND THEN
+            status := 'not_held';
+        ELSE
+            UPDATE holds h SET status = 'Cancelled', closed_at = clock_timestamp()
+            WHERE h.id = hold_id;
+            IF was = 'Ready' THEN
+                -- Off the shelf and on to the next in line
+                UPDATE books b SET available = TRUE WHERE b.id = target;
+                PERFORM allocate_holds(ARRAY[target]);
+            END IF;
+            status := 'cancelled';
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Expire up to batch_size uncollected holds and pass their books on.
+-- Books a desk is busy with are skipped and picked up by the next batch.
+CREATE OR REPLACE FUNCTION expire_holds_batch(batch_size INTEGER DEFAULT 1000)
+RETURNS INTEGER AS $$
+DECLARE
+    shelf INTEGER[];
+    expired INTEGER;
+BEGIN
+    -- Book rows first, in id order, as returns take them
+    SELECT array_agg(locked.id) INTO shelf
+    FROM (SELECT b.id FROM books b
+          WHERE b.id IN (SELECT h.book_id FROM holds h
+                         WHERE h.status = 'Ready' AND h.expires_at < clock_timestamp()
+                         ORDER BY h.expires_at
+                         LIMIT batch_size)
+          ORDER BY b.id
+          FOR UPDATE SKIP LOCKED) locked;
+    IF shelf IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- Re-checked under the lock: the member may have collected meanwhile
+    WITH gone AS (
+        UPDATE holds h SET status = 'Expired', closed_at = clock_timestamp()
+        WHERE h.book_id = ANY(shelf) AND h.status = 'Ready'
+          AND h.expires_at < clock_timestamp()
+        RETURNING h.id, h.book_id
+    ), noticed AS (
+        INSERT INTO hold_notices (hold_id, kind) SELECT id, 'expired' FROM gone
+    )
+    UPDATE books b SET available = TRUE FROM gone WHERE b.id = gone.book_id;
+    GET DIAGNOSTICS expired = ROW_COUNT;
+
+    PERFORM allocate_holds(shelf);
+    RETURN expired;
+END;
+$$ LANGUAGE plpgsql;
+
+-- borrow_books and return_books from migration 010, with holds: a book on
+-- the shelf only goes to the member it is held for (collecting it closes
+-- the hold), and a return allocates the book to the queue.
+-- Borrow statuses add on_hold (held for someone else); return statuses
+-- add held (returned, put it on the hold shelf).
+CREATE OR REPLACE FUNCTION borrow_books(p_member_id INTEGER, p_isbns TEXT[],
+                                        p_loan_days INTEGER DEFAULT 7,
+                                        p_borrowed_on DATE DEFAULT CURRENT_DATE)
+RETURNS TABLE (isbn TEXT, loan_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    active_count INTEGER;
+    wanted TEXT;
+    book RECORD;
+    shelved_id INTEGER;
+    shelved_for INTEGER;
+BEGIN
+    -- Serializes carts for the same member; check_max_loans takes the same lock
+    SELECT active_loan_count INTO active_count
+    FROM members WHERE id = p_member_id
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Member % does not exist', p_member_id;
+    END IF;
+
+    FOREACH wanted IN ARRAY p_isbns LOOP
+        isbn := wanted;
+        loan_id := NULL;
+
+        -- Never wait on a book another desk is lending or returning
+        SELECT b.id, b.available INTO book
+        FROM books b WHERE b.isbn = wanted
+        FOR UPDATE SKIP LOCKED;
+
+        IF NOT FOUND THEN
+            status := CASE WHEN EXISTS (SELECT 1 FROM books b WHERE b.isbn = wanted)
+                           THEN 'busy' ELSE 'not_found' END;
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        shelved_id := NULL;
+        shelved_for := NULL;
+        IF NOT book.available THEN
+            SELECT h.id, h.member_id INTO shelved_id, shelved_for
+            FROM holds h WHERE h.book_id = book.id AND h.status = 'Ready';
+        END IF;
+
+        IF NOT book.available AND shelved_for IS DISTINCT FROM p_member_id THEN
+            status := CASE WHEN shelved_id IS NULL THEN 'unavailable' ELSE 'on_hold' END;
+        ELSIF active_count >= 3 THEN
+            status := 'limit_reached';
+        ELSE
+            INSERT INTO loans (book_id, member_id, borrow_date, due_date, status)
+            VALUES (book.id, p_member_id, p_borrowed_on, p_borrowed_on + p_loan_days,
+                    CASE WHEN p_borrowed_on + p_loan_days < CURRENT_DATE
+                         THEN 'Overdue' ELSE 'Active' END)
+            RETURNING id INTO loan_id;
+            UPDATE books SET available = FALSE WHERE id = book.id;
+            IF shelved_id IS NOT NULL THEN
+                UPDATE holds h SET status = 'Collected', closed_at = clock_timestamp()
+                WHERE h.id = shelved_id;
+            END IF;
+            active_count := active_count + 1;
+            status := 'borrowed';
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION return_books(p_isbns TEXT[],
+                                        p_returned_on DATE DEFAULT CURRENT_DATE)
+RETURNS TABLE (isbn TEXT, loan_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    wanted TEXT;
+    target INTEGER;
+    open_loan RECORD;
+BEGIN
+    -- Lock every book up front in id order so concurrent batches queue
+    -- instead of deadlocking
+    PERFORM 1 FROM books b WHERE b.isbn = ANY(p_isbns) ORDER BY b.id FOR UPDATE;
+
+    FOREACH wanted IN ARRAY p_isbns LOOP
+        isbn := wanted;
+        loan_id := NULL;
+
+        SELECT b.id INTO target FROM books b WHERE b.isbn = wanted;
+        IF NOT FOUND THEN
+            status := 'not_found';
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        SELECT o.id, o.borrow_date INTO open_loan
+        FROM loans o
+        WHERE o.book_id = target AND o.status IN ('Active', 'Overdue')
+        ORDER BY o.borrow_date, o.id
+        LIMIT 1;
+
+        IF NOT FOUND THEN
+            status := 'not_borrowed';
+        ELSE
+            UPDATE loans l
+            SET status = 'Returned', return_date = GREATEST(p_returned_on, l.borrow_date)
+            WHERE l.id = open_loan.id AND l.borrow_date = open_loan.borrow_date;
+            loan_id := open_loan.id;
+
+            UPDATE books b
+            SET available = NOT EXISTS (SELECT 1 FROM loans o
+                                        WHERE o.book_id = target
+                                          AND o.status IN ('Active', 'Overdue'))
+            WHERE b.id = target;
+            status := CASE WHEN allocate_holds(ARRAY[target]) > 0
+                           THEN 'held' ELSE 'returned' END;
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
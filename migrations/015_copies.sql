@@ -0,0 +1,565 @@
+-- ============================================
+-- MIGRATION 015: COPIES
+-- ============================================
+-- A books row is a title; copies are the physical items on the shelves
+-- of each branch, and loans and ready holds point at the copy they took.
+-- copy_counts keeps each title's available and total copies, maintained
+-- by statement triggers on copies, so availability is one index-only
+-- lookup however many copies a title has across branches.
+-- books.available stays as "at least one copy on the shelf" for the
+-- screens, search and the dashboard, and is only written when a title's
+-- count goes to or from zero.
+
+CREATE SEQUENCE IF NOT EXISTS copy_barcode_seq;
+
+CREATE TABLE IF NOT EXISTS copies (
+    id SERIAL PRIMARY KEY,
+    book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+    barcode VARCHAR(32) UNIQUE NOT NULL
+        DEFAULT 'SL' || lpad(nextval('copy_barcode_seq')::TEXT, 10, '0'),
+    branch VARCHAR(100) NOT NULL DEFAULT 'Main',
+    condition VARCHAR(20) NOT NULL DEFAULT 'Good'
+        CHECK (condition IN ('New', 'Good', 'Fair', 'Poor', 'Damaged')),
+    -- OnLoan and OnHold are set by circulation only; librarians move
+    -- copies between the others
+    status VARCHAR(20) NOT NULL DEFAULT 'Available'
+        CHECK (status IN ('Available', 'OnLoan', 'OnHold', 'Repair', 'Lost', 'Withdrawn')),
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- A checkout takes the first copy on the shelf: one probe of a partial
+-- index that only holds shelved copies
+CREATE INDEX IF NOT EXISTS idx_copies_shelf ON copies(book_id, id)
+    WHERE status = 'Available';
+CREATE INDEX IF NOT EXISTS idx_copies_book ON copies(book_id, branch);
+
+-- Copies that are Lost or Withdrawn no longer count towards total
+CREATE TABLE IF NOT EXISTS copy_counts (
+    book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+    available INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (book_id) INCLUDE (available, total)
+);
+
+-- Frequent vacuums keep the visibility map current, so lookups through the
+-- covering key stay index-only on busy titles
+ALTER TABLE copy_counts SET (autovacuum_vacuum_scale_factor = 0.01,
+                             autovacuum_vacuum_insert_scale_factor = 0.01);
+
+ALTER TABLE loans ADD COLUMN IF NOT EXISTS copy_id INTEGER REFERENCES copies(id);
+ALTER TABLE holds ADD COLUMN IF NOT EXISTS copy_id INTEGER REFERENCES copies(id);
+
+CREATE INDEX IF NOT EXISTS idx_loans_copy ON loans (copy_id);
+
+-- Several copies of a title can now wait on the hold shelf, one hold each
+DROP INDEX IF EXISTS idx_holds_ready;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_holds_shelf ON holds(copy_id)
+    WHERE status = 'Ready';
+
+-- Statement-level triggers, as for library_stats: one upsert per changed
+-- title, in book id order so concurrent statements queue on the count rows
+-- instead of deadlocking. Desks get a books NOTIFY for the new counts.
+CREATE OR REPLACE FUNCTION maintain_copy_counts()
+RETURNS TRIGGER AS $$
+DECLARE
+    new_books INTEGER[];
+    new_statuses TEXT[];
+    old_books INTEGER[];
+    old_statuses TEXT[];
+    changed INTEGER[];
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT array_agg(book_id), array_agg(status) INTO new_books, new_statuses FROM new_rows;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT array_agg(book_id), array_agg(status) INTO old_books, old_statuses FROM old_rows;
+    END IF;
+
+    WITH moved AS (
+        SELECT book_id, status, 1 AS sign FROM unnest(new_books, new_statuses) AS n(book_id, status)
+        UNION ALL
+        SELECT book_id, status, -1 FROM unnest(old_books, old_statuses) AS o(book_id, status)
+    ), deltas AS (
+        SELECT book_id,
+               COALESCE(SUM(sign) FILTER (WHERE status NOT IN ('Lost', 'Withdrawn')), 0) AS total,
+               COALESCE(SUM(sign) FILTER (WHERE status = 'Available'), 0) AS available
+        FROM moved
+        GROUP BY book_id
+    ), bumped AS (
+        INSERT INTO copy_counts AS c (book_id, available, total)
+        SELECT d.book_id, d.available, d.total
+        FROM deltas d
+        -- A deleted title takes its count row with it
+        WHERE (d.available <> 0 OR d.total <> 0)
+          AND EXISTS (SELECT 1 FROM books b WHERE b.id = d.book_id)
+        ORDER BY d.book_id
+        ON CONFLICT (book_id) DO UPDATE
+        SET available = c.available + EXCLUDED.available,
+            total = c.total + EXCLUDED.total
+        RETURNING c.book_id, c.available
+    ), flagged AS (
+        UPDATE books b SET available = bumped.available > 0
+        FROM bumped
+        WHERE b.id = bumped.book_id AND b.available IS DISTINCT FROM (bumped.available > 0)
+    )
+    SELECT array_agg(book_id) INTO changed FROM (SELECT book_id FROM bumped LIMIT 501) s;
+
+    IF changed IS NOT NULL THEN
+        PERFORM pg_notify('smartlibrary_rows', json_build_object(
+            'table', 'books',
+            'ids', CASE WHEN array_length(changed, 1) > 500 THEN NULL ELSE changed END)::TEXT);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_copy_counts_insert ON copies;
+DROP TRIGGER IF EXISTS trigger_copy_counts_update ON copies;
+DROP TRIGGER IF EXISTS trigger_copy_counts_delete ON copies;
+
+CREATE TRIGGER trigger_copy_counts_insert
+    AFTER INSERT ON copies REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_copy_counts();
+CREATE TRIGGER trigger_copy_counts_update
+    AFTER UPDATE ON copies REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_copy_counts();
+CREATE TRIGGER trigger_copy_counts_delete
+    AFTER DELETE ON copies REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_copy_counts();
+
+-- Every new title arrives with one copy at the main branch (the Add Book
+-- dialog, imports, the generator); more are added per title afterwards
+CREATE OR REPLACE FUNCTION add_first_copies()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO copies (book_id, status)
+    SELECT id, CASE WHEN available IS FALSE THEN 'Withdrawn' ELSE 'Available' END
+    FROM new_rows
+    ORDER BY id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_copies_books_insert ON books;
+CREATE TRIGGER trigger_copies_books_insert
+    AFTER INSERT ON books REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION add_first_copies();
+
+-- Give titles without copies one copy each (more if they have several open
+-- loans or ready holds), then point open loans and ready holds that have
+-- no copy at one: a withdrawn copy first (the old "not available"), else
+-- one from the shelf. Run below and by the data generator after its COPY
+-- load; returns the number of copies added.
+CREATE OR REPLACE FUNCTION backfill_copies()
+RETURNS INTEGER AS $$
+DECLARE
+    added INTEGER;
+BEGIN
+    INSERT INTO copies (book_id, status)
+    SELECT b.id, CASE WHEN b.available IS FALSE THEN 'Withdrawn' ELSE 'Available' END
+    FROM books b
+    CROSS JOIN LATERAL generate_series(1, GREATEST(1,
+        (SELECT COUNT(*) FROM loans l
+         WHERE l.book_id = b.id AND l.status IN ('Active', 'Overdue'))
+        + (SELECT COUNT(*) FROM holds h WHERE h.book_id = b.id AND h.status = 'Ready')))
+    WHERE NOT EXISTS (SELECT 1 FROM copies c WHERE c.book_id = b.id)
+    ORDER BY b.id;
+    GET DIAGNOSTICS added = ROW_COUNT;
+
+    WITH unlinked AS (
+        SELECT l.id, l.borrow_date, l.book_id,
+               row_number() OVER (PARTITION BY l.book_id ORDER BY l.borrow_date, l.id) AS n
+        FROM loans l
+        WHERE l.copy_id IS NULL AND l.status IN ('Active', 'Overdue')
+    ), spare AS (
+        SELECT c.id, c.book_id,
+               row_number() OVER (PARTITION BY c.book_id
+                                  ORDER BY c.status = 'Available', c.id) AS n
+        FROM copies c
+        WHERE c.status IN ('Available', 'Withdrawn')
+          AND c.book_id IN (SELECT book_id FROM unlinked)
+    ), paired AS (
+        SELECT u.id, u.borrow_date, s.id AS copy_id
+        FROM unlinked u JOIN spare s ON s.book_id = u.book_id AND s.n = u.n
+    ), taken AS (
+        UPDATE copies c SET status = 'OnLoan' FROM paired p WHERE c.id = p.copy_id
+    )
+    UPDATE loans l SET copy_id = p.copy_id
+    FROM paired p
+    WHERE l.id = p.id AND l.borrow_date = p.borrow_date;
+
+    WITH unlinked AS (
+        SELECT h.id, h.book_id,
+               row_number() OVER (PARTITION BY h.book_id ORDER BY h.id) AS n
+        FROM holds h
+        WHERE h.copy_id IS NULL AND h.status = 'Ready'
+    ), spare AS (
+        SELECT c.id, c.book_id,
+               row_number() OVER (PARTITION BY c.book_id
+                                  ORDER BY c.status = 'Available', c.id) AS n
+        FROM copies c
+        WHERE c.status IN ('Available', 'Withdrawn')
+          AND c.book_id IN (SELECT book_id FROM unlinked)
+    ), paired AS (
+        SELECT u.id, s.id AS copy_id
+        FROM unlinked u JOIN spare s ON s.book_id = u.book_id AND s.n = u.n
+    ), taken AS (
+        UPDATE copies c SET status = 'OnHold' FROM paired p WHERE c.id = p.copy_id
+    )
+    UPDATE holds h SET copy_id = p.copy_id FROM paired p WHERE h.id = p.id;
+
+    RETURN added;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Titles whose stored counts or available flag disagree with their copies
+CREATE OR REPLACE VIEW copy_count_drift AS
+SELECT b.id AS book_id, b.isbn,
+       COALESCE(s.available, 0) AS stored_available,
+       COALESCE(s.total, 0) AS stored_total,
+       a.available, a.total, b.available AS flagged
+FROM books b
+LEFT JOIN copy_counts s ON s.book_id = b.id
+CROSS JOIN LATERAL (
+    SELECT (COUNT(*) FILTER (WHERE c.status = 'Available'))::INTEGER AS available,
+           (COUNT(*) FILTER (WHERE c.status NOT IN ('Lost', 'Withdrawn')))::INTEGER AS total
+    FROM copies c WHERE c.book_id = b.id
+) a
+WHERE COALESCE(s.available, 0) <> a.available
+   OR COALESCE(s.total, 0) <> a.total
+   OR b.available IS DISTINCT FROM (a.available > 0);
+
+-- Fix every drifted title and report what was changed
+CREATE OR REPLACE FUNCTION repair_copy_counts()
+RETURNS TABLE (book_id INTEGER, isbn TEXT, stored_available INTEGER, stored_total INTEGER,
+               available INTEGER, total INTEGER) AS $$
+#variable_conflict use_column
+BEGIN
+    -- Keep copy writes out while recounting
+    LOCK TABLE copies IN SHARE MODE;
+    RETURN QUERY
+    WITH drift AS (
+        SELECT * FROM copy_count_drift
+    ), counted AS (
+        INSERT INTO copy_counts AS c (book_id, available, total)
+        SELECT d.book_id, d.available, d.total FROM drift d
+        ORDER BY d.book_id
+        ON CONFLICT (book_id) DO UPDATE
+        SET available = EXCLUDED.available, total = EXCLUDED.total
+    ), flagged AS (
+        UPDATE books b SET available = d.available > 0
+        FROM drift d
+        WHERE b.id = d.book_id AND b.available IS DISTINCT FROM (d.available > 0)
+    )
+    SELECT d.book_id, d.isbn::TEXT, d.stored_available, d.stored_total, d.available, d.total
+    FROM drift d;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A code scanned at the desk is a copy's barcode or a title's ISBN. Rows
+-- come back in cart order; book_id is NULL for unknown codes and copy_id
+-- for ISBNs.
+CREATE OR REPLACE FUNCTION scanned_copies(p_codes TEXT[])
+RETURNS TABLE (pos BIGINT, code TEXT, book_id INTEGER, copy_id INTEGER) AS $$
+    SELECT s.pos, s.code, COALESCE(c.book_id, b.id), c.id
+    FROM unnest(p_codes) WITH ORDINALITY AS s(code, pos)
+    LEFT JOIN copies c ON c.barcode = s.code
+    LEFT JOIN books b ON c.id IS NULL AND b.isbn = s.code
+    ORDER BY s.pos
+$$ LANGUAGE sql STABLE;
+
+-- allocate_holds from migration 014, per copy: each copy on the shelf goes
+-- to the next Waiting hold until one or the other runs out. The caller must
+-- hold the books' row locks.
+CREATE OR REPLACE FUNCTION allocate_holds(p_book_ids INTEGER[], p_pickup_days INTEGER DEFAULT 3)
+RETURNS INTEGER AS $$
+DECLARE
+    target INTEGER;
+    spare INTEGER;
+    next_hold INTEGER;
+    allocated INTEGER := 0;
+BEGIN
+    FOR target IN
+        SELECT b.id FROM books b WHERE b.id = ANY(p_book_ids) AND b.available ORDER BY b.id
+    LOOP
+        LOOP
+            SELECT c.id INTO spare
+            FROM copies c WHERE c.book_id = target AND c.status = 'Available'
+            ORDER BY c.id
+            LIMIT 1;
+            EXIT WHEN NOT FOUND;
+
+            SELECT h.id INTO next_hold
+            FROM holds h JOIN members m ON m.id = h.member_id
+            WHERE h.book_id = target AND h.status = 'Waiting' AND m.active_loan_count < 3
+            ORDER BY h.priority DESC, h.id
+            LIMIT 1;
+            EXIT WHEN NOT FOUND;
+
+            UPDATE holds h
+            SET status = 'Ready', copy_id = spare, ready_at = clock_timestamp(),
+                expires_at = clock_timestamp() + p_pickup_days * INTERVAL '1 day'
+            WHERE h.id = next_hold;
+            UPDATE copies c SET status = 'OnHold' WHERE c.id = spare;
+            INSERT INTO hold_notices (hold_id, kind) VALUES (next_hold, 'ready');
+            allocated := allocated + 1;
+        END LOOP;
+    END LOOP;
+    RETURN allocated;
+END;
+$$ LANGUAGE plpgsql;
+
+-- cancel_holds from migration 014: a cancelled ready hold puts its copy
+-- back on the shelf for the next in line
+CREATE OR REPLACE FUNCTION cancel_holds(p_member_id INTEGER, p_isbns TEXT[])
+RETURNS TABLE (isbn TEXT, hold_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    wanted TEXT;
+    target INTEGER;
+    was TEXT;
+    shelved INTEGER;
+BEGIN
+    -- Same lock order as return_books
+    PERFORM 1 FROM books b WHERE b.isbn = ANY(p_isbns) ORDER BY b.id FOR UPDATE;
+
+    FOREACH wanted IN ARRAY p_isbns LOOP
+        isbn := wanted;
+        hold_id := NULL;
+
+        SELECT b.id INTO target FROM books b WHERE b.isbn = wanted;
+        IF NOT FOUND THEN
+            status := 'not_found';
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        SELECT h.id, h.status, h.copy_id INTO hold_id, was, shelved
+        FROM holds h
+        WHERE h.book_id = target AND h.member_id = p_member_id
+          AND h.status IN ('Waiting', 'Ready');
+        IF NOT FOUND THEN
+            status := 'not_held';
+        ELSE
+            UPDATE holds h SET status = 'Cancelled', closed_at = clock_timestamp()
+            WHERE h.id = hold_id;
+            IF was = 'Ready' THEN
+                UPDATE copies c SET status = 'Available' WHERE c.id = shelved;
+                PERFORM allocate_holds(ARRAY[target]);
+            END IF;
+            status := 'cancelled';
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- expire_holds_batch from migration 014, returning the expired copies to
+-- the shelf
+CREATE OR REPLACE FUNCTION expire_holds_batch(batch_size INTEGER DEFAULT 1000)
+RETURNS INTEGER AS $$
+DECLARE
+    shelf INTEGER[];
+    expired INTEGER;
+BEGIN
+    -- Book rows first, in id order, as returns take them
+    SELECT array_agg(locked.id) INTO shelf
+    FROM (SELECT b.id FROM books b
+          WHERE b.id IN (SELECT h.book_id FROM holds h
+                         WHERE h.status = 'Ready' AND h.expires_at < clock_timestamp()
+                         ORDER BY h.expires_at
+                         LIMIT batch_size)
+          ORDER BY b.id
+          FOR UPDATE SKIP LOCKED) locked;
+    IF shelf IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- Re-checked under the lock: the member may have collected meanwhile
+    WITH gone AS (
+        UPDATE holds h SET status = 'Expired', closed_at = clock_timestamp()
+        WHERE h.book_id = ANY(shelf) AND h.status = 'Ready'
+          AND h.expires_at < clock_timestamp()
+        RETURNING h.id, h.copy_id
+    ), noticed AS (
+        INSERT INTO hold_notices (hold_id, kind) SELECT id, 'expired' FROM gone
+    )
+    UPDATE copies c SET status = 'Available' FROM gone WHERE c.id = gone.copy_id;
+    GET DIAGNOSTICS expired = ROW_COUNT;
+
+    PERFORM allocate_holds(shelf);
+    RETURN expired;
+END;
+$$ LANGUAGE plpgsql;
+
+-- borrow_books and return_books from migration 014, per copy. Carts take
+-- ISBNs or copy barcodes: a barcode lends or returns that copy, an ISBN
+-- the member's copy on the hold shelf, else the first one on the shelf
+-- (or returns the title's oldest open loan).
+-- A checkout only locks the copies it lends, with SKIP LOCKED as in
+-- migration 007: desks lending one title take different copies, and a copy
+-- another desk is handling comes back as 'busy' instead of blocking. The
+-- copies are marked OnLoan in one statement at the end, so the count rows
+-- are taken in book id order like every other copies write, and desks
+-- lending one title only wait on them for the commit that follows. Titles
+-- are locked after their count rows here, the other way round from
+-- returns; that only happens when a cart takes a title's last copy (or a
+-- member swaps their held copy), and circulation retries the rare
+-- deadlock.
+CREATE OR REPLACE FUNCTION borrow_books(p_member_id INTEGER, p_isbns TEXT[],
+                                        p_loan_days INTEGER DEFAULT 7,
+                                        p_borrowed_on DATE DEFAULT CURRENT_DATE)
+RETURNS TABLE (isbn TEXT, loan_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    active_count INTEGER;
+    scan RECORD;
+    held RECORD;
+    taken INTEGER;
+    lent INTEGER[] := '{}';
+    swapped INTEGER[] := '{}';
+BEGIN
+    -- Serializes carts for the same member; check_max_loans takes the same lock
+    SELECT m.active_loan_count INTO active_count
+    FROM members m WHERE m.id = p_member_id
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Member % does not exist', p_member_id;
+    END IF;
+
+    FOR scan IN SELECT * FROM scanned_copies(p_isbns) LOOP
+        isbn := scan.code;
+        loan_id := NULL;
+        IF scan.book_id IS NULL THEN
+            status := 'not_found';
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        -- Expiry and cancelling take the hold before its copy, as done here
+        SELECT h.id, h.copy_id INTO held
+        FROM holds h
+        WHERE h.book_id = scan.book_id AND h.member_id = p_member_id AND h.status = 'Ready'
+        FOR UPDATE SKIP LOCKED;
+        IF NOT FOUND AND EXISTS (SELECT 1 FROM holds h
+                                 WHERE h.book_id = scan.book_id AND h.member_id = p_member_id
+                                   AND h.status = 'Ready') THEN
+            status := 'busy';
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        IF held.id IS NOT NULL AND (scan.copy_id IS NULL OR scan.copy_id = held.copy_id) THEN
+            taken := held.copy_id;
+        ELSE
+            SELECT c.id INTO taken
+            FROM copies c
+            WHERE c.book_id = scan.book_id AND c.status = 'Available'
+              AND (scan.copy_id IS NULL OR c.id = scan.copy_id)
+              AND c.id <> ALL(lent)
+            ORDER BY c.id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED;
+        END IF;
+
+        IF taken IS NULL THEN
+            status := CASE
+                WHEN EXISTS (SELECT 1 FROM copies c
+                             WHERE c.book_id = scan.book_id AND c.status = 'Available'
+                               AND (scan.copy_id IS NULL OR c.id = scan.copy_id)
+                               AND c.id <> ALL(lent))
+                    THEN 'busy'
+                WHEN EXISTS (SELECT 1 FROM holds h
+                             WHERE h.book_id = scan.book_id AND h.status = 'Ready'
+                               AND (scan.copy_id IS NULL OR h.copy_id = scan.copy_id))
+                    THEN 'on_hold'
+                ELSE 'unavailable' END;
+        ELSIF active_count >= 3 THEN
+            status := 'limit_reached';
+        ELSE
+            INSERT INTO loans (book_id, copy_id, member_id, borrow_date, due_date, status)
+            VALUES (scan.book_id, taken, p_member_id, p_borrowed_on, p_borrowed_on + p_loan_days,
+                    CASE WHEN p_borrowed_on + p_loan_days < CURRENT_DATE
+                         THEN 'Overdue' ELSE 'Active' END)
+            RETURNING id INTO loan_id;
+            lent := lent || taken;
+            IF held.id IS NOT NULL THEN
+                UPDATE holds h SET status = 'Collected', closed_at = clock_timestamp()
+                WHERE h.id = held.id;
+                -- They took another copy: theirs goes to the next in line
+                IF held.copy_id <> taken THEN
+                    swapped := swapped || held.copy_id;
+                END IF;
+            END IF;
+            active_count := active_count + 1;
+            status := 'borrowed';
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+
+    UPDATE copies c SET status = 'OnLoan' WHERE c.id = ANY(lent);
+
+    IF cardinality(swapped) > 0 THEN
+        -- allocate_holds needs the titles locked
+        PERFORM 1 FROM books b
+        WHERE b.id IN (SELECT c.book_id FROM copies c WHERE c.id = ANY(swapped))
+        ORDER BY b.id
+        FOR UPDATE;
+        UPDATE copies c SET status = 'Available' WHERE c.id = ANY(swapped);
+        PERFORM allocate_holds(ARRAY(SELECT c.book_id FROM copies c WHERE c.id = ANY(swapped)));
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION return_books(p_isbns TEXT[],
+                                        p_returned_on DATE DEFAULT CURRENT_DATE)
+RETURNS TABLE (isbn TEXT, loan_id INTEGER, status TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+    scan RECORD;
+    open_loan RECORD;
+BEGIN
+    PERFORM 1 FROM books b
+    WHERE b.id IN (SELECT r.book_id FROM scanned_copies(p_isbns) r)
+    ORDER BY b.id
+    FOR UPDATE;
+
+    FOR scan IN SELECT * FROM scanned_copies(p_isbns) LOOP
+        isbn := scan.code;
+        loan_id := NULL;
+        IF scan.book_id IS NULL THEN
+            status := 'not_found';
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        SELECT o.id, o.borrow_date, o.copy_id INTO open_loan
+        FROM loans o
+        WHERE o.book_id = scan.book_id AND o.status IN ('Active', 'Overdue')
+          AND (scan.copy_id IS NULL OR o.copy_id = scan.copy_id)
+        ORDER BY o.borrow_date, o.id
+        LIMIT 1;
+
+        IF NOT FOUND THEN
+            status := 'not_borrowed';
+        ELSE
+            UPDATE loans l
+            SET status = 'Returned', return_date = GREATEST(p_returned_on, l.borrow_date)
+            WHERE l.id = open_loan.id AND l.borrow_date = open_loan.borrow_date;
+            loan_id := open_loan.id;
+
+            UPDATE copies c SET status = 'Available'
+            WHERE c.id = open_loan.copy_id AND c.status = 'OnLoan';
+            PERFORM allocate_holds(ARRAY[scan.book_id]);
+            status := CASE WHEN EXISTS (SELECT 1 FROM copies c
+                                        WHERE c.id = open_loan.copy_id AND c.status = 'OnHold')
+                           THEN 'held' ELSE 'returned' END;
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill
+SELECT backfill_copies() AS copies_backfilled;
+SELECT COUNT(*) AS copy_counts_repaired FROM repair_copy_counts();
@@ -0,0 +1,30 @@
+import time
+from collections import namedtuple
+
+import library_db
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class SweepResult(namedtuple('SweepResult', 'marked batches seconds')):
+    @property
+    def rate(self):
+        return self.marked / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"marked {self.marked:,} loans overdue in {self.batches} batch(es), "
+                f"{self.seconds:.2f}s ({self.rate:,.0f} rows/s)")
+
+
+def sweep_overdue(db, batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    # Each batch is its own short transaction, so row locks are held briefly
+    started = time.monotonic()
+    marked = batches = 0
+    while True:
+        count = db.run(lambda conn: library_db.fetch_one(
+            conn, 'mark_overdue_batch', (batch_size,))[0])
+        marked += count
+        batches += 1
+        if count < batch_size or (max_batches and batches >= max_batches):
+            break
+    return SweepResult(marked, batches, time.monotonic() - started)
@@ -0,0 +1,290 @@
+class TreeRows:
+    """The rows a Treeview shows, keyed by row id (used as the item iid).
+
+    put() and sync() compare against what was last drawn, so unchanged
+    rows are not redrawn and nothing is deleted just to be inserted again;
+    selection and scroll position survive a refresh.
+    """
+
+    def __init__(self, tree, render_row=None, row_id=lambda row: row[0]):
+        self.tree = tree
+        self.render_row = render_row or (lambda row: (row, ()))
+        self.row_id = row_id
+        self.drawn = {}
+
+    def put(self, row, index='end'):
+        # Insert the row, or redraw it in place if it is shown and changed
+        values, tags = self.render_row(row)
+        iid = str(self.row_id(row))
+        drawn = (tuple(values), tuple(tags))
+        if iid not in self.drawn:
+            self.tree.insert('', index, iid=iid, values=values, tags=tags)
+        elif self.drawn[iid] != drawn:
+            self.tree.item(iid, values=values, tags=tags)
+        self.drawn[iid] = drawn
+        return iid
+
+    def remove(self, *iids):
+        iids = [iid for iid in map(str, iids) if iid in self.drawn]
+        for iid in iids:
+            del self.drawn[iid]
+        if iids:
+            self.tree.delete(*iids)
+
+    def clear(self):
+        self.tree.delete(*self.tree.get_children())
+        self.drawn.clear()
+
+    def sync(self, rows, start=0):
+        """Show exactly `rows` in order from position `start` on.
+
+        Items above `start` are left alone. Returns the iids now shown.
+        """
+        wanted = [str(self.row_id(row)) for row in rows]
+        current = list(self.tree.get_children())[start:]
+        self.remove(*(set(current) - set(wanted)))
+        current = [iid for iid in current if iid in self.drawn]
+
+        for offset, (iid, row) in enumerate(zip(wanted, rows)):
+            if offset < len(current) and current[offset] == iid:
+                self.put(row)
+                continue
+            if iid in self.drawn:
+                current.remove(iid)
+                self.tree.move(iid, '', start + offset)
+                self.put(row)
+            else:
+                self.put(row, start + offset)
+            current.insert(offset, iid)
+        return wanted
+
+
+class PagedTreeview:
+    """Keeps only a window of rows in a Treeview and pages the rest in on scroll.
+
+    fetch_page(direction, key, limit, done) loads a page in the background
+    and calls done(rows) on the Tk thread with rows in display order, or
+    fail_load() if the query failed. direction is 'after' or 'before' and
+    key is the keyset of the edge row (None for the first page). The last
+    element of a key is the row id; descending=True when pages are ordered
+    newest (largest key) first.
+    """
+
+    def __init__(self, tree, scrollbar, fetch_page, row_key, render_row,
+                 page_size=200, max_pages=3, descending=False):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.fetch_page = fetch_page
+        self.row_key = row_key
+        self.render_row = render_row
+        self.page_size = page_size
+        self.max_rows = page_size * max_pages
+        self.descending = descending
+
+        self.rows = TreeRows(tree, render_row, row_id=lambda row: row_key(row)[-1])
+        self.keys = {}
+        self.at_start = True
+        self.at_end = True
+        self.fixed = False
+        self.loading = False
+        self.token = 0
+
+        self.tree.configure(yscrollcommand=self.on_scroll)
+
+    def clear(self):
+        # Pages still in flight for the old contents are ignored
+        self.token += 1
+        self.loading = False
+        self.fixed = False
+        self.rows.clear()
+        self.keys.clear()
+
+    def reset(self):
+        self.clear()
+        self.at_start = True
+        self.at_end = False
+        self.load_next()
+
+    def show_rows(self, rows, to_top=True):
+        # Fixed result set (e.g. ranked search hits): no paging in either direction
+        self.token += 1
+        self.loading = False
+        self.at_start = True
+        self.at_end = True
+        self.fixed = True
+        self.rows.sync(rows)
+        self.keys = {str(self.row_key(row)[-1]): self.row_key(row) for row in rows}
+        if to_top:
+            self.tree.yview_moveto(0)
+
+    def refresh(self):
+        """Re-read the rows on display and apply only what changed.
+
+        The window is re-fetched from its first row on (from the start of
+        the list when it is shown), as many rows as are loaded now.
+        """
+        items = self.tree.get_children()
+        if not items:
+            self.reset()
+            return
+        anchor = [] if self.at_start else [items[0]]
+        limit = len(items) - len(anchor)
+        key = self.keys[anchor[0]] if anchor else None
+        if limit <= 0:
+            return
+        # Supersedes any page still in flight (it may have been cancelled
+        # along with its screen and would otherwise never finish)
+        self.token += 1
+        self.loading = True
+        token = self.token
+        self.fetch_page('after', key, limit,
+                        lambda rows: self.replace_window(token, anchor, limit, rows))
+
+    def replace_window(self, token, anchor, limit, rows):
+        if token != self.token or not self.tree.winfo_exists():
+            return
+        self.loading = False
+        top = self.top_item()
+        self.at_end = len(rows) < limit
+        self.rows.sync(rows, start=len(anchor))
+        keys = {iid: self.keys[iid] for iid in anchor}
+        keys.update((str(self.row_key(row)[-1]), self.row_key(row)) for row in rows)
+        self.keys = keys
+        self.restore_top(top)
+
+    def patch(self, ids, rows):
+        """Apply fresh copies of the rows with these ids in place.
+
+        Ids missing from `rows` were deleted (or no longer match) and are
+        removed. A new row is inserted in key order when it falls inside
+        the loaded window; outside it, paging picks it up as usual. A fixed
+        result set only updates and removes the rows it shows.
+        """
+        found = {str(self.row_key(row)[-1]): row for row in rows}
+        top = self.top_item()
+        gone = [iid for iid in map(str, ids) if iid in self.keys and iid not in found]
+        for iid in gone:
+            del self.keys[iid]
+        self.rows.remove(*gone)
+
+        for iid, row in found.items():
+            key = self.row_key(row)
+            if iid in self.keys and (self.fixed or self.keys[iid] == key):
+                self.rows.put(row)
+                self.keys[iid] = key
+                continue
+            if self.fixed:
+                continue
+            if iid in self.keys:
+                # Its sort key changed: take it out and place it again
+                del self.keys[iid]
+                self.rows.remove(iid)
+            index = self.position(key)
+            if index is not None:
+                self.insert_row(index, row)
+        self.restore_top(top)
+
+    def position(self, key):
+        # Where a row with this key goes, or None when it is outside the window
+        items = self.tree.get_children()
+        if self.descending:
+            before = lambda a, b: a > b
+        else:
+            before = lambda a, b: a < b
+        if not items:
+            return 0 if self.at_start and self.at_end else None
+        if before(key, self.keys[items[0]]):
+            return 0 if self.at_start else None
+        if not before(key, self.keys[items[-1]]):
+            return len(items) if self.at_end else None
+        for index, iid in enumerate(items):
+            if before(key, self.keys[iid]):
+                return index
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self.loading:
+            return
+        if float(last) > 0.95 and not self.at_end:
+            self.tree.after_idle(self.load_next)
+        elif float(first) < 0.05 and not self.at_start:
+            self.tree.after_idle(self.load_prev)
+
+    def load_next(self):
+        if self.loading or self.at_end:
+            return
+        items = self.tree.get_children()
+        key = self.keys[items[-1]] if items else None
+        self.loading = True
+        token = self.token
+        self.fetch_page('after', key, self.page_size,
+                        lambda rows: self.append_page(token, rows))
+
+    def append_page(self, token, rows):
+        if token != self.token or not self.tree.winfo_exists():
+            return
+        self.loading = False
+        if len(rows) < self.page_size:
+            self.at_end = True
+        first_page = not self.tree.get_children()
+        for row in rows:
+            self.insert_row('end', row)
+        if first_page:
+            self.tree.yview_moveto(0)
+        self.trim('start')
+
+    def load_prev(self):
+        if self.loading or self.at_start:
+            return
+        items = self.tree.get_children()
+        if not items:
+            return
+        self.loading = True
+        token = self.token
+        self.fetch_page('before', self.keys[items[0]], self.page_size,
+                        lambda rows: self.prepend_page(token, rows))
+
+    def prepend_page(self, token, rows):
+        if token != self.token or not self.tree.winfo_exists():
+            return
+        self.loading = False
+        top = self.top_item()
+        if len(rows) < self.page_size:
+            self.at_start = True
+        for row in reversed(rows):
+            self.insert_row(0, row)
+        self.trim('end')
+        self.restore_top(top)
+
+    def fail_load(self):
+        self.loading = False
+
+    def insert_row(self, index, row):
+        iid = self.rows.put(row, index)
+        self.keys[iid] = self.row_key(row)
+
+    def trim(self, side):
+        items = self.tree.get_children()
+        extra = len(items) - self.max_rows
+        if extra <= 0:
+            return
+        top = self.top_item()
+        drop = items[:extra] if side == 'start' else items[-extra:]
+        for iid in drop:
+            self.keys.pop(iid, None)
+        self.rows.remove(*drop)
+        if side == 'start':
+            self.at_start = False
+        else:
+            self.at_end = False
+        self.restore_top(top)
+
+    def top_item(self):
+        return self.tree.identify_row(1) or None
+
+    def restore_top(self, iid):
+        # Keep the row the user was looking at in place after the window shifts
+        if not iid or not self.tree.exists(iid):
+            return
+        items = self.tree.get_children()
+        self.tree.yview_moveto(items.index(iid) / max(len(items), 1))
@@ -0,0 +1,263 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+import psycopg2
+import psycopg2.extensions
+
+log = logging.getLogger('smartlibrary.slow')
+
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+RECENT_SAMPLES = 500  # per statement, for percentiles
+SLOW_LOG_SIZE = 50
+EXPLAIN_EVERY = 60  # seconds between EXPLAINs of the same slow statement
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'EXECUTE', 'VALUES')
+
+# Frames from these files are plumbing; the call site is the first frame outside them
+_PLUMBING = (os.path.abspath(__file__), os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                      'library_db.py'),
+             os.path.dirname(os.path.abspath(psycopg2.__file__)))
+
+
+def statement_key(sql):
+    # Prepared statements are reported by name, ad-hoc SQL by its normalized text
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    text = ' '.join(sql.split())
+    match = re.match(r'EXECUTE (\w+)', text, re.IGNORECASE)
+    if match:
+        return match.group(1)
+    return text[:200]
+
+
+def call_site():
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if not filename.startswith(_PLUMBING):
+            return f"{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return '?'
+
+
+class StatementStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(BUCKETS_MS)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+        self.sites = Counter()
+        self.last_explain = 0.0
+
+    def percentile(self, p):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_ms': self.total_ms,
+            'mean_ms': self.total_ms / self.calls if self.calls else 0.0,
+            'p95_ms': self.percentile(95),
+            'max_ms': self.max_ms,
+            'site': self.sites.most_common(1)[0][0] if self.sites else '',
+        }
+
+
+class QueryMetrics:
+    """Per-statement latency histograms, row counts and call sites.
+
+    Fed by InstrumentedCursor (every LibraryConnection uses it). Statements
+    slower than slow_ms are logged with their plan and kept in `slow`.
+    """
+
+    def __init__(self, slow_ms=200.0):
+        self.slow_ms = slow_ms
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.slow = deque(maxlen=SLOW_LOG_SIZE)
+
+    def record(self, key, ms, rows, site, error=False):
+        """Returns True when the statement is slow and due for an EXPLAIN."""
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = StatementStats()
+            stats.calls += 1
+            stats.errors += error
+            stats.rows += rows
+            stats.total_ms += ms
+            stats.max_ms = max(stats.max_ms, ms)
+            stats.recent.append(ms)
+            stats.sites[site] += 1
+            for i, bound in enumerate(BUCKETS_MS):
+                if ms <= bound:
+                    stats.buckets[i] += 1
+                    break
+            if error or ms < self.slow_ms:
+                return False
+            now = time.monotonic()
+            if now - stats.last_explain < EXPLAIN_EVERY:
+                self.slow.append((time.time(), key, ms, site, None))
+                return False
+            stats.last_explain = now
+            return True
+
+    def log_slow(self, key, ms, site, plan):
+        with self.lock:
+            self.slow.append((time.time(), key, ms, site, plan))
+        log.warning("Slow query (%.1f ms) at %s: %s\n%s", ms, site, key, plan or '')
+
+    def top(self, by, n=10):
+        with self.lock:
+            rows = [(key, stats.summary()) for key, stats in self.stats.items()]
+        return sorted(rows, key=lambda row: row[1][by], reverse=True)[:n]
+
+    def slow_queries(self):
+        with self.lock:
+            return list(self.slow)
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.slow.clear()
+
+    def render_prometheus(self):
+        def label(key):
+            return key.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+        with self.lock:
+            items = [(label(key), stats.calls, stats.total_ms, list(stats.buckets), stats.rows,
+                      stats.errors) for key, stats in sorted(self.stats.items())]
+
+        lines = ['# HELP smartlibrary_query_duration_seconds Query latency by statement',
+                 '# TYPE smartlibrary_query_duration_seconds histogram']
+        for key, calls, total_ms, buckets, _, _ in items:
+            cumulative = 0
+            for bound, count in zip(BUCKETS_MS, buckets):
+                cumulative += count
+                lines.append(f'smartlibrary_query_duration_seconds_bucket'
+                             f'{{statement="{key}",le="{bound / 1000:g}"}} {cumulative}')
+            lines.append(f'smartlibrary_query_duration_seconds_bucket'
+                         f'{{statement="{key}",le="+Inf"}} {calls}')
+            lines.append(f'smartlibrary_query_duration_seconds_sum{{statement="{key}"}} '
+                         f'{total_ms / 1000:.6f}')
+            lines.append(f'smartlibrary_query_duration_seconds_count{{statement="{key}"}} {calls}')
+
+        lines += ['# HELP smartlibrary_query_rows_total Rows returned or affected by statement',
+                  '# TYPE smartlibrary_query_rows_total counter']
+        lines += [f'smartlibrary_query_rows_total{{statement="{key}"}} {rows}'
+                  for key, _, _, _, rows, _ in items]
+        lines += ['# HELP smartlibrary_query_errors_total Failed executions by statement',
+                  '# TYPE smartlibrary_query_errors_total counter']
+        lines += [f'smartlibrary_query_errors_total{{statement="{key}"}} {errors}'
+                  for key, _, _, _, _, errors in items]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # Atomic replace, as the node_exporter textfile collector expects
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp, path)
+
+
+metrics = QueryMetrics()
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor that times every statement into `metrics`.
+
+    Named (server-side) cursors are timed from execute until their first
+    fetch, since that is when the rows actually arrive.
+    """
+
+    pending = None
+
+    def execute(self, query, vars=None):
+        if statement_key(query)[:7].upper() == 'PREPARE':
+            return super().execute(query, vars)
+        site = call_site()
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            metrics.record(statement_key(query), (time.perf_counter() - started) * 1000, 0,
+                           site, error=True)
+            raise
+        if self.name is not None:
+            self.pending = (query, vars, site, started)
+        else:
+            self.finish(query, vars, site, started, max(self.rowcount, 0))
+        return result
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        self.finish_pending(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self.finish_pending(len(rows))
+        return rows
+
+    def copy_expert(self, sql, file, size=8192):
+        site = call_site()
+        started = time.perf_counter()
+        try:
+            result = super().copy_expert(sql, file, size)
+        except Exception:
+            metrics.record(statement_key(sql), (time.perf_counter() - started) * 1000, 0,
+                           site, error=True)
+            raise
+        self.finish(sql, None, site, started, max(self.rowcount, 0))
+        return result
+
+    def finish_pending(self, rows):
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            self.finish(*pending, rows)
+
+    def finish(self, query, vars, site, started, rows):
+        ms = (time.perf_counter() - started) * 1000
+        key = statement_key(query)
+        if metrics.record(key, ms, rows, site):
+            metrics.log_slow(key, ms, site, self.explain(query, vars))
+
+    def explain(self, query, vars):
+        # Plan only (no ANALYZE: writes must not run twice), inside a
+        # savepoint so a failing EXPLAIN cannot abort the caller's transaction
+        if isinstance(query, bytes):
+            query = query.decode('utf-8', 'replace')
+        if query.lstrip().split(None, 1)[0].upper() not in EXPLAINABLE:
+            return None
+        conn = self.connection
+        if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            return None
+        savepoint = not conn.autocommit
+        cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+        try:
+            if savepoint:
+                cursor.execute("SAVEPOINT query_metrics_explain")
+            cursor.execute("EXPLAIN " + query, vars)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT query_metrics_explain")
+            return plan
+        except psycopg2.Error as e:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT query_metrics_explain")
+            return f"(EXPLAIN failed: {e})"
+        finally:
+            cursor.close()
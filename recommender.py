@@ -0,0 +1,433 @@
+import heapq
+import math
+import random
+import statistics
+import time
+from collections import Counter, defaultdict, namedtuple
+
+try:
+    import numpy as np
+    import scipy.sparse as sp
+except ImportError:
+    # Only building needs them; the stored tables are plain SQL lookups
+    np = sp = None
+
+import psycopg2.errors
+
+import library_db
+from catalog_import import CopyStream
+
+TOP_K = 10
+HISTORY_CAP = 50  # most recent distinct books per member that count
+MIN_CO_BORROWS = 2  # a single shared borrower is noise, not similarity
+CLUB_TOP = 50
+CLUB_WEIGHT = 0.3
+FETCH_ROWS = 100_000
+PAIR_BUDGET = 20_000_000  # co-borrow entries per chunk of books
+MEMBER_CHUNK = 20_000
+
+
+class BuildResult(namedtuple('BuildResult', 'members books pairs neighbours suggestions seconds')):
+    def __str__(self):
+        return (f"Built from {self.pairs:,} member/book pairs ({self.members:,} members, "
+                f"{self.books:,} books): {self.neighbours:,} neighbours, "
+                f"{self.suggestions:,} suggestions in {self.seconds:.1f}s")
+
+
+class UpdateResult(namedtuple('UpdateResult', 'loans new_pairs books members seconds')):
+    def __str__(self):
+        return (f"Folded in {self.loans:,} queued loan(s), {self.new_pairs:,} new: "
+                f"{self.books:,} book list(s) and {self.members:,} member(s) updated "
+                f"in {self.seconds:.2f}s")
+
+
+class LookupTiming(namedtuple('LookupTiming', 'name median_ms p95_ms max_ms')):
+    def __str__(self):
+        return (f"{self.name}: median {self.median_ms:.2f} ms, p95 {self.p95_ms:.2f} ms, "
+                f"max {self.max_ms:.2f} ms")
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("Building recommendations needs numpy and scipy "
+                           "(pip install numpy scipy)")
+
+
+# Each member's most recently borrowed distinct books
+HISTORY_SQL = """
+    SELECT member_id, book_id FROM (
+        SELECT member_id, book_id,
+               row_number() OVER (PARTITION BY member_id
+                                  ORDER BY MAX(borrow_date) DESC, book_id) AS recent
+        FROM loans
+        {where}
+        GROUP BY member_id, book_id
+    ) h
+    WHERE recent <= %s
+"""
+
+LOCK_SQL = "LOCK TABLE recommender_pending IN SHARE UPDATE EXCLUSIVE MODE"
+DRAIN_SQL = """
+    DELETE FROM recommender_pending WHERE pg_visible_in_snapshot(xid, pg_current_snapshot())
+"""
+
+# Suggestions for a few members straight from the stored tables (incremental path)
+SUGGEST_SQL = """
+    WITH history AS ({history}),
+    scored AS (
+        SELECT h.member_id, n.neighbour_id AS book_id, n.score
+        FROM history h JOIN book_neighbours n ON n.book_id = h.book_id
+        UNION ALL
+        SELECT cm.member_id, c.book_id, %s * c.score
+        FROM book_club_members cm JOIN club_top_books c ON c.club_id = cm.club_id
+        WHERE cm.member_id = ANY(%s)
+    ),
+    totals AS (
+        SELECT member_id, book_id, SUM(score) AS score
+        FROM scored s
+        WHERE NOT EXISTS (SELECT 1 FROM history h
+                          WHERE h.member_id = s.member_id AND h.book_id = s.book_id)
+        GROUP BY member_id, book_id
+    )
+    INSERT INTO member_suggestions (member_id, rank, book_id, score)
+    SELECT member_id, rank, book_id, score FROM (
+        SELECT member_id, book_id, score,
+               row_number() OVER (PARTITION BY member_id ORDER BY score DESC, book_id) AS rank
+        FROM totals
+    ) ranked
+    WHERE rank <= %s
+"""
+
+
+def read_pairs(conn, sql, params):
+    # Two int64 arrays, streamed from a server-side cursor
+    cursor = conn.cursor(name='recommender_pairs')
+    cursor.itersize = FETCH_ROWS
+    left, right = [], []
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            block = np.array(rows, dtype=np.int64)
+            left.append(block[:, 0])
+            right.append(block[:, 1])
+    finally:
+        cursor.close()
+    if not left:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    return np.concatenate(left), np.concatenate(right)
+
+
+def top_k(rows, cols, scores, k):
+    """Indices of the k best scores per row, and their 1-based ranks."""
+    if not len(rows):
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    order = np.lexsort((cols, -scores, rows))
+    grouped = rows[order]
+    firsts = np.r_[0, np.flatnonzero(np.diff(grouped)) + 1]
+    starts = np.repeat(firsts, np.diff(np.r_[firsts, len(grouped)]))
+    rank = np.arange(len(grouped)) - starts
+    keep = rank < k
+    return order[keep], rank[keep] + 1
+
+
+def chunks(weights, budget):
+    # Contiguous [start, stop) ranges whose weights sum to about budget
+    start, total = 0, 0.0
+    for i, weight in enumerate(weights):
+        if total and total + weight > budget:
+            yield start, i
+            start, total = i, 0.0
+        total += weight
+    if start < len(weights):
+        yield start, len(weights)
+
+
+def neighbours(history, borrowers, k=TOP_K):
+    """Top-k co-borrow neighbours per book by cosine similarity.
+
+    history is the binary members x books matrix. Returns (book, rank,
+    neighbour, co_borrows, score) arrays in column index space; the
+    books x books product is formed a chunk of rows at a time.
+    """
+    by_book = history.T.tocsr()
+    parts = []
+    for start, stop in chunks(borrowers * HISTORY_CAP, PAIR_BUDGET):
+        co = (by_book[start:stop] @ history).tocoo()
+        rows = co.row.astype(np.int64) + start
+        cols = co.col.astype(np.int64)
+        keep = (rows != cols) & (co.data >= MIN_CO_BORROWS)
+        rows, cols, counts = rows[keep], cols[keep], co.data[keep]
+        scores = counts / np.sqrt(borrowers[rows] * borrowers[cols])
+        picked, rank = top_k(rows, cols, scores, k)
+        parts.append((rows[picked], rank, cols[picked], counts[picked], scores[picked]))
+    if not parts:
+        empty = np.empty(0, np.int64)
+        return empty, empty, empty, empty, np.empty(0)
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def suggestions(history, similar, clubs, club_books, k=TOP_K):
+    """Top-k unborrowed books per member: neighbours of the books in their
+    history, plus CLUB_WEIGHT times what their clubs borrow most."""
+    parts = []
+    for start in range(0, history.shape[0], MEMBER_CHUNK):
+        stop = min(start + MEMBER_CHUNK, history.shape[0])
+        borrowed = history[start:stop]
+        scores = borrowed @ similar + CLUB_WEIGHT * (clubs[start:stop] @ club_books)
+        scores = (scores - scores.multiply(borrowed)).tocoo()
+        keep = scores.data > 0
+        rows = scores.row[keep].astype(np.int64)
+        cols = scores.col[keep].astype(np.int64)
+        values = scores.data[keep]
+        picked, rank = top_k(rows, cols, values, k)
+        parts.append((rows[picked] + start, rank, cols[picked], values[picked]))
+    if not parts:
+        empty = np.empty(0, np.int64)
+        return empty, empty, empty, np.empty(0)
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def _copy(cursor, table, columns, rows):
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                       CopyStream(rows))
+
+
+def build(conn, k=TOP_K):
+    """Recompute every table of migrations/013 from the loans history.
+
+    Runs in one REPEATABLE READ transaction on a dedicated connection and
+    drops exactly the queued loans its snapshot already includes.
+    """
+    require_numpy()
+    started = time.monotonic()
+    conn.set_session(isolation_level='REPEATABLE READ')
+    cursor = conn.cursor()
+    try:
+        # Before the first query, so one build or update runs at a time
+        cursor.execute(LOCK_SQL)
+        loan_members, loan_books = read_pairs(conn, HISTORY_SQL.format(where=''), (HISTORY_CAP,))
+        club_ids, club_members = read_pairs(
+            conn, "SELECT club_id, member_id FROM book_club_members", ())
+
+        member_ids, member_index = np.unique(np.concatenate([loan_members, club_members]),
+                                             return_inverse=True)
+        book_ids, book_index = np.unique(loan_books, return_inverse=True)
+        clubs, club_index = np.unique(club_ids, return_inverse=True)
+        history = sp.csr_matrix(
+            (np.ones(len(loan_books), np.float32),
+             (member_index[:len(loan_members)], book_index)),
+            shape=(len(member_ids), len(book_ids)))
+        membership = sp.csr_matrix(
+            (np.ones(len(club_ids), np.float32), (member_index[len(loan_members):], club_index)),
+            shape=(len(member_ids), len(clubs)))
+        borrowers = np.asarray(history.sum(axis=0)).ravel()
+
+        book, rank, neighbour, co_borrows, score = neighbours(history, borrowers, k)
+        similar = sp.csr_matrix((score, (book, neighbour)), shape=(len(book_ids),) * 2)
+
+        # Club x book loan counts, scaled to each club's most borrowed book
+        per_club = (membership.T @ history).tocoo()
+        club_max = np.zeros(len(clubs), np.float32)
+        np.maximum.at(club_max, per_club.row, per_club.data)
+        club_score = per_club.data / np.maximum(club_max[per_club.row], 1)
+        picked, club_rank = top_k(per_club.row.astype(np.int64), per_club.col.astype(np.int64),
+                                  club_score, CLUB_TOP)
+        club_books = sp.csr_matrix(
+            (club_score[picked], (per_club.row[picked], per_club.col[picked])),
+            shape=(len(clubs), len(book_ids)))
+
+        member, member_rank, suggested, suggested_score = suggestions(
+            history, similar, membership, club_books, k)
+
+        for table in ('book_neighbours', 'book_borrowers', 'club_top_books',
+                      'member_suggestions'):
+            cursor.execute(f"DELETE FROM {table}")
+        _copy(cursor, 'book_neighbours', ('book_id', 'rank', 'neighbour_id', 'co_borrows', 'score'),
+              zip(book_ids[book].tolist(), rank.tolist(), book_ids[neighbour].tolist(),
+                  co_borrows.astype(np.int64).tolist(), score.tolist()))
+        _copy(cursor, 'book_borrowers', ('book_id', 'borrowers'),
+              zip(book_ids.tolist(), borrowers.astype(np.int64).tolist()))
+        _copy(cursor, 'club_top_books', ('club_id', 'rank', 'book_id', 'score'),
+              zip(clubs[per_club.row[picked]].tolist(), club_rank.tolist(),
+                  book_ids[per_club.col[picked]].tolist(), club_score[picked].tolist()))
+        _copy(cursor, 'member_suggestions', ('member_id', 'rank', 'book_id', 'score'),
+              zip(member_ids[member].tolist(), member_rank.tolist(),
+                  book_ids[suggested].tolist(), suggested_score.tolist()))
+        cursor.execute(DRAIN_SQL)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.set_session(isolation_level='DEFAULT')
+    return BuildResult(len(member_ids), len(book_ids), len(loan_books), len(book),
+                       len(member), time.monotonic() - started)
+
+
+def fold_pending(conn, cursor, k=TOP_K, wait=True):
+    """Fold the queued loans into the stored tables without a rebuild.
+
+    A loan only counts when it is the member's first of that book. Its
+    co-borrow counts with the member's other recent books are added to
+    the stored neighbour lists of both books, which are then re-ranked
+    (pairs outside a stored list start from their new count alone, so a
+    periodic build() keeps the lists exact). The suggestions of the
+    borrowing members are recomputed. Runs inside the caller's
+    transaction; with wait=False, raises LockNotAvailable at once if a
+    build or another update holds the queue.
+    """
+    started = time.monotonic()
+    cursor.execute(LOCK_SQL if wait else LOCK_SQL + " NOWAIT")
+    cursor.execute("SELECT member_id, book_id, COUNT(*) FROM recommender_pending "
+                   "GROUP BY member_id, book_id")
+    pending = cursor.fetchall()
+    if not pending:
+        return UpdateResult(0, 0, 0, 0, time.monotonic() - started)
+    members = sorted({member for member, _, _ in pending})
+
+    cursor.execute("SELECT member_id, book_id, COUNT(*) FROM loans "
+                   "WHERE member_id = ANY(%s) GROUP BY member_id, book_id", (members,))
+    totals = {(member, book): count for member, book, count in cursor.fetchall()}
+    new = defaultdict(set)
+    for member, book, count in pending:
+        if totals.get((member, book)) == count:
+            new[member].add(book)
+
+    loan_members, loan_books = read_pairs(
+        conn, HISTORY_SQL.format(where="WHERE member_id = ANY(%s)"), (members, HISTORY_CAP))
+    history = defaultdict(set)
+    for member, book in zip(loan_members.tolist(), loan_books.tolist()):
+        history[member].add(book)
+
+    added_borrowers = Counter()
+    added_co = Counter()
+    for member, books in new.items():
+        for book in books:
+            added_borrowers[book] += 1
+            for other in history[member] - {book}:
+                # A pair of two new books is counted once
+                if other in books and other < book:
+                    continue
+                added_co[book, other] += 1
+                added_co[other, book] += 1
+
+    affected = sorted({book for book, _ in added_co} | set(added_borrowers))
+    if added_borrowers:
+        cursor.execute("""
+            INSERT INTO book_borrowers (book_id, borrowers)
+            SELECT * FROM unnest(%s::INTEGER[], %s::INTEGER[])
+            ON CONFLICT (book_id) DO UPDATE
+            SET borrowers = book_borrowers.borrowers + EXCLUDED.borrowers
+        """, (list(added_borrowers), list(added_borrowers.values())))
+
+    co = Counter(added_co)
+    cursor.execute("SELECT book_id, neighbour_id, co_borrows FROM book_neighbours "
+                   "WHERE book_id = ANY(%s)", (affected,))
+    for book, neighbour, count in cursor.fetchall():
+        co[book, neighbour] += count
+    involved = sorted({book for pair in co for book in pair})
+    cursor.execute("SELECT book_id, borrowers FROM book_borrowers WHERE book_id = ANY(%s)",
+                   (involved,))
+    borrowers = dict(cursor.fetchall())
+
+    candidates = defaultdict(list)
+    for (book, neighbour), count in co.items():
+        if count >= MIN_CO_BORROWS:
+            norm = math.sqrt(borrowers.get(book, 1) * borrowers.get(neighbour, 1))
+            candidates[book].append((count / norm, -neighbour, count))
+    columns = ([], [], [], [], [])
+    for book in affected:
+        best = heapq.nlargest(k, candidates.get(book, ()))
+        for rank, (score, neighbour, count) in enumerate(best, 1):
+            for column, value in zip(columns, (book, rank, -neighbour, count, score)):
+                column.append(value)
+    cursor.execute("DELETE FROM book_neighbours WHERE book_id = ANY(%s)", (affected,))
+    cursor.execute("""
+        INSERT INTO book_neighbours (book_id, rank, neighbour_id, co_borrows, score)
+        SELECT * FROM unnest(%s::INTEGER[], %s::SMALLINT[], %s::INTEGER[], %s::INTEGER[],
+                             %s::REAL[])
+    """, columns)
+
+    changed = sorted(new)
+    cursor.execute("DELETE FROM member_suggestions WHERE member_id = ANY(%s)", (changed,))
+    cursor.execute(SUGGEST_SQL.format(history=HISTORY_SQL.format(
+        where="WHERE member_id = ANY(%s)")), (changed, HISTORY_CAP, CLUB_WEIGHT, changed, k))
+    cursor.execute(DRAIN_SQL)
+    return UpdateResult(sum(count for _, _, count in pending),
+                        sum(len(books) for books in new.values()), len(affected),
+                        len(changed), time.monotonic() - started)
+
+
+def update(conn, k=TOP_K, wait=True):
+    # None when wait is False and another build or update is running
+    require_numpy()
+    # Same isolation as build(): the drain must match what was read
+    conn.set_session(isolation_level='REPEATABLE READ')
+    cursor = conn.cursor()
+    try:
+        result = fold_pending(conn, cursor, k, wait)
+        conn.commit()
+        return result
+    except psycopg2.errors.LockNotAvailable:
+        conn.rollback()
+        return None
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.set_session(isolation_level='DEFAULT')
+
+
+def time_lookups(conn, name, ids, limit=TOP_K):
+    samples = []
+    for key in ids:
+        started = time.perf_counter()
+        library_db.fetch_all(conn, name, (key, limit))
+        samples.append((time.perf_counter() - started) * 1000)
+    conn.rollback()
+    samples.sort()
+    return LookupTiming(name, statistics.median(samples),
+                        samples[min(len(samples) - 1, int(len(samples) * 0.95))], samples[-1])
+
+
+def benchmark(conn, lookups=1000, requeue=10_000, seed=42):
+    """Time a full build, an incremental update and the serving lookups.
+
+    Meant for a generated dataset (library_cli.py generate). The update
+    re-queues the latest `requeue` loans and is rolled back, so the
+    tables are left as the build wrote them.
+    """
+    built = build(conn)
+    conn.set_session(isolation_level='REPEATABLE READ')
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO recommender_pending (member_id, book_id) "
+                       "SELECT member_id, book_id FROM loans ORDER BY id DESC LIMIT %s",
+                       (requeue,))
+        # Own rows are not visible to the own snapshot, so a drain
+        # would keep them; the rollback drops them either way
+        updated = fold_pending(conn, cursor)
+
+        rng = random.Random(seed)
+        cursor.execute("SELECT book_id FROM book_borrowers")
+        books = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT DISTINCT member_id FROM member_suggestions")
+        members = [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.rollback()
+        conn.set_session(isolation_level='DEFAULT')
+
+    timings = []
+    if books:
+        timings.append(time_lookups(conn, 'also_borrowed',
+                                    [rng.choice(books) for _ in range(lookups)]))
+    if members:
+        timings.append(time_lookups(conn, 'member_suggestions',
+                                    [rng.choice(members) for _ in range(lookups)]))
+    return built, updated, timings
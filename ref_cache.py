@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+REFERENCE_CHANNEL = 'smartlibrary_reference'
+
+# Cacheable statements (library_db.STATEMENTS) and the tables they read
+CACHED_STATEMENTS = {
+    'author_names': ('authors',),
+    'authors_list': ('authors',),
+    'clubs_list': ('book_clubs',),
+    'role_names': ('roles',),
+}
+
+DEFAULT_MAX_ENTRIES = 64
+DEFAULT_TTL = 300  # seconds; a backstop, NOTIFY normally invalidates first
+
+
+class ReferenceCache:
+    """Size-bounded LRU of query results for rarely changing tables.
+
+    Entries expire after ttl seconds and are dropped as soon as a NOTIFY
+    reports a write to a table they were read from. While the change feed
+    is disconnected nothing is served, since invalidations may be missed.
+
+    A miss is filled in two steps so a change that lands while the query
+    runs is not overwritten by the stale result:
+
+        token = cache.begin(tables)
+        rows = <run the query>
+        cache.put(key, rows, tables, token)
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (stored_at, tables, value)
+        self.generations = Counter()  # table -> invalidation count
+        self.epoch = 0
+        self.listening = False
+        self.counts = Counter()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or not self.listening:
+                self.counts['misses'] += 1
+                return None
+            stored_at, _, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                self.counts['expirations'] += 1
+                self.counts['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counts['hits'] += 1
+            return value
+
+    def begin(self, tables):
+        with self.lock:
+            return self.epoch, tuple(self.generations[table] for table in tables)
+
+    def put(self, key, value, tables, token):
+        with self.lock:
+            if token != (self.epoch, tuple(self.generations[table] for table in tables)):
+                # Invalidated while the query was running
+                return
+            self.entries[key] = (time.monotonic(), tables, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counts['evictions'] += 1
+
+    def invalidate(self, table):
+        with self.lock:
+            self.generations[table] += 1
+            stale = [key for key, (_, tables, _) in self.entries.items() if table in tables]
+            for key in stale:
+                del self.entries[key]
+            self.counts['invalidations'] += len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            self.counts['invalidations'] += len(self.entries)
+            self.entries.clear()
+
+    def set_listening(self, listening):
+        # Changes may have been missed while the feed was down
+        self.clear()
+        with self.lock:
+            self.listening = listening
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts['hits'] + self.counts['misses']
+            return {
+                'entries': len(self.entries),
+                'hits': self.counts['hits'],
+                'misses': self.counts['misses'],
+                'hit_rate': self.counts['hits'] / lookups if lookups else 0.0,
+                'evictions': self.counts['evictions'],
+                'expirations': self.counts['expirations'],
+                'invalidations': self.counts['invalidations'],
+                'listening': self.listening,
+            }
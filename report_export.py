@@ -0,0 +1,241 @@
+import gzip
+import json
+import os
+import time
+from collections import namedtuple
+
+import psycopg2
+
+import library_db
+
+BATCH_ROWS = 10_000  # rows per fetch from the server-side cursor (and per Parquet row group)
+COPY_BUFFER = 1 << 16
+
+# name -> (SELECT with a {where} slot, [(column, type)]); types pick the Parquet schema
+REPORTS = {
+    'loans': ("""
+        SELECT l.id, b.isbn, b.title, m.student_id, u.name, l.borrow_date, l.due_date,
+               l.return_date, l.status
+        FROM loans l
+        JOIN books b ON l.book_id = b.id
+        JOIN members m ON l.member_id = m.id
+        JOIN users u ON m.user_id = u.id
+        {where}
+        ORDER BY l.borrow_date, l.id
+    """, [('loan_id', 'int'), ('isbn', 'text'), ('title', 'text'), ('student_id', 'text'),
+          ('member', 'text'), ('borrow_date', 'date'), ('due_date', 'date'),
+          ('return_date', 'date'), ('status', 'text')]),
+    'members': ("""
+        SELECT m.id, m.student_id, u.name, u.email, m.contact, m.active_loan_count
+        FROM members m JOIN users u ON m.user_id = u.id
+        {where}
+        ORDER BY m.student_id
+    """, [('member_id', 'int'), ('student_id', 'text'), ('name', 'text'), ('email', 'text'),
+          ('contact', 'text'), ('active_loans', 'int')]),
+    'catalog': ("""
+        SELECT b.id, b.isbn, b.title, a.name, b.genre, b.available
+        FROM books b LEFT JOIN authors a ON b.author_id = a.id
+        {where}
+        ORDER BY b.title, b.id
+    """, [('book_id', 'int'), ('isbn', 'text'), ('title', 'text'), ('author', 'text'),
+          ('genre', 'text'), ('available', 'bool')]),
+}
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+
+ExportResult = namedtuple('ExportResult', 'path rows bytes seconds')
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def guess_format(path):
+    """(format, compression) from a name like loans.csv.gz or members.parquet."""
+    stem, suffix = os.path.splitext(path.lower())
+    compression = SUFFIXES.get(suffix, 'none')
+    if compression != 'none':
+        stem, suffix = os.path.splitext(stem)
+    fmt = suffix.lstrip('.')
+    if fmt == 'ndjson':
+        fmt = 'jsonl'
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {suffix or path!r}: use .csv, .jsonl or .parquet "
+                         f"(optionally .gz / .zst)")
+    return fmt, compression
+
+
+def report_query(report, filters=None):
+    sql, columns = REPORTS[report]
+    conditions, params = [], []
+    if report == 'loans':
+        conditions, params = library_db.loan_filters(**(filters or {}))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return sql.format(where=where), params, columns
+
+
+def estimate_rows(cursor, sql, params):
+    # The planner's estimate: a COUNT(*) would read everything twice
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return max(int(plan[0]['Plan']['Plan Rows']), 1)
+
+
+def open_output(path, compression):
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=6)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression needs the zstandard package "
+                               "(pip install zstandard)") from None
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'),
+                                                               closefd=True)
+    return open(path, 'wb')
+
+
+class _CountingWriter:
+    # File-like target for COPY TO STDOUT: counts rows, reports progress
+    # and stops the COPY (by raising) when cancelled
+    def __init__(self, out, tick):
+        self.out = out
+        self.tick = tick
+        self.rows = -1  # the header line
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.out.write(data)
+        self.rows += data.count(b'\n')
+        self.tick(self.rows)
+        return len(data)
+
+
+def _write_csv(conn, out, sql, params, columns, tick):
+    cursor = conn.cursor()
+    try:
+        copy = cursor.mogrify(sql, params).decode('utf-8')
+        writer = _CountingWriter(out, tick)
+        cursor.copy_expert(f"COPY ({copy}) TO STDOUT WITH (FORMAT csv, HEADER)", writer,
+                           COPY_BUFFER)
+        return max(writer.rows, 0)
+    finally:
+        cursor.close()
+
+
+def _batches(conn, sql, params):
+    cursor = conn.cursor(name='report_export')
+    cursor.itersize = BATCH_ROWS
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(BATCH_ROWS)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+
+def _write_jsonl(conn, out, sql, params, columns, tick):
+    names = [name for name, _ in columns]
+    rows = 0
+    for batch in _batches(conn, sql, params):
+        lines = ''.join(json.dumps(dict(zip(names, row)), default=str) + '\n' for row in batch)
+        out.write(lines.encode('utf-8'))
+        rows += len(batch)
+        tick(rows)
+    return rows
+
+
+def _write_parquet(conn, path, sql, params, columns, tick, compression):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from None
+
+    types = {'int': pa.int64(), 'text': pa.string(), 'date': pa.date32(), 'bool': pa.bool_()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    rows = 0
+    writer = pq.ParquetWriter(path, schema,
+                              compression='none' if compression == 'none' else compression)
+    try:
+        for batch in _batches(conn, sql, params):
+            arrays = [pa.array(values, type=field.type)
+                      for values, field in zip(zip(*batch), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows += len(batch)
+            tick(rows)
+    finally:
+        writer.close()
+    return rows
+
+
+def export_report(conn, report, path, fmt=None, compression=None, filters=None,
+                  progress=None, cancel=None):
+    """Stream a report to path in bounded memory.
+
+    CSV goes through COPY TO STDOUT, JSON Lines and Parquet through a
+    server-side cursor, all from one REPEATABLE READ snapshot. Format and
+    compression default to what the file name says (guess_format);
+    Parquet compresses its pages itself. progress(fraction, rows) is
+    called as rows arrive, against the planner's row estimate. Setting the
+    `cancel` event stops the export with ExportCancelled. The file is
+    written under a temporary name and only renamed into place when
+    complete. conn should be a dedicated connection (Database.connect).
+    """
+    if fmt is None or compression is None:
+        try:
+            guessed_fmt, guessed_compression = guess_format(path)
+        except ValueError:
+            if fmt is None:
+                raise
+            guessed_fmt, guessed_compression = fmt, 'none'
+        fmt = fmt or guessed_fmt
+        compression = compression or guessed_compression
+    if fmt not in FORMATS or compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported export {fmt} / {compression}")
+
+    started = time.monotonic()
+    sql, params, columns = report_query(report, filters)
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cursor = conn.cursor()
+    try:
+        estimate = estimate_rows(cursor, sql, params)
+    finally:
+        cursor.close()
+
+    def tick(rows):
+        if cancel is not None and cancel.is_set():
+            raise ExportCancelled(f"Export cancelled after {rows:,} rows")
+        if progress:
+            progress(min(rows / estimate, 0.99), rows)
+
+    partial = f'{path}.part'
+    try:
+        if fmt == 'parquet':
+            rows = _write_parquet(conn, partial, sql, params, columns, tick, compression)
+        else:
+            write = _write_csv if fmt == 'csv' else _write_jsonl
+            with open_output(partial, compression) as out:
+                rows = write(conn, out, sql, params, columns, tick)
+        conn.commit()
+        os.replace(partial, path)
+    except BaseException:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            # A COPY stopped half way leaves the connection unusable
+            conn.close()
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    if progress:
+        progress(1.0, rows)
+    return ExportResult(path, rows, os.path.getsize(path), time.monotonic() - started)
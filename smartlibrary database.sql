@@ -293,6 +293,27 @@ INSERT INTO book_club_members (club_id, member_id) VALUES
     ((SELECT id FROM book_clubs WHERE name = 'Sci-Fi Enthusiasts'),
      (SELECT id FROM members WHERE student_id = 'LKW2023005'));
 
+-- ============================================
+-- MIGRATIONS
+-- ============================================
+-- Each file can also be run on its own against an existing database.
+
+\ir migrations/001_books_keyset_index.sql
+\ir migrations/002_book_search.sql
+\ir migrations/003_library_stats.sql
+\ir migrations/004_authors_name_index.sql
+\ir migrations/005_overdue_sweeper.sql
+\ir migrations/006_member_loan_counts.sql
+\ir migrations/007_circulation.sql
+\ir migrations/008_reference_notify.sql
+\ir migrations/009_partition_loans.sql
+\ir migrations/010_replica_changes.sql
+\ir migrations/011_row_notify.sql
+\ir migrations/012_loan_rollups.sql
+\ir migrations/013_recommendations.sql
+\ir migrations/014_holds.sql
+\ir migrations/015_copies.sql
+
 -- ============================================
 -- VERIFICATION QUERIES
 -- ============================================
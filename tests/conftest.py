@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+TEST_DBNAME = 'SMARTLIBRARY_TEST_DBNAME'
+
+
+class FakeTree:
+    """The ttk.Treeview calls TreeRows and PagedTreeview make, without Tk."""
+
+    def __init__(self):
+        self.items = []
+        self.data = {}
+        self.calls = []
+        self.top = 0
+
+    def insert(self, parent, index, iid, values, tags):
+        assert iid not in self.data
+        self.items.insert(len(self.items) if index == 'end' else index, iid)
+        self.data[iid] = (tuple(values), tuple(tags))
+        self.calls.append(('insert', iid))
+        return iid
+
+    def item(self, iid, values, tags):
+        self.data[iid] = (tuple(values), tuple(tags))
+        self.calls.append(('item', iid))
+
+    def delete(self, *iids):
+        for iid in iids:
+            self.items.remove(iid)
+            del self.data[iid]
+            self.calls.append(('delete', iid))
+
+    def move(self, iid, parent, index):
+        self.items.remove(iid)
+        self.items.insert(index, iid)
+        self.calls.append(('move', iid))
+
+    def get_children(self, parent=''):
+        return tuple(self.items)
+
+    def exists(self, iid):
+        return iid in self.data
+
+    def values(self):
+        return [self.data[iid][0] for iid in self.items]
+
+    def configure(self, **options):
+        pass
+
+    def yview_moveto(self, fraction):
+        self.top = int(fraction * len(self.items))
+
+    def identify_row(self, y):
+        return self.items[self.top] if self.top < len(self.items) else ''
+
+    def winfo_exists(self):
+        return True
+
+    def after_idle(self, callback):
+        callback()
+
+
+@pytest.fixture
+def tree():
+    return FakeTree()
+
+
+@pytest.fixture(scope='session')
+def db():
+    """Pool on the throwaway database named by SMARTLIBRARY_TEST_DBNAME.
+
+    Other connection settings come from smartlibrary.ini and the
+    SMARTLIBRARY_DB_* variables as usual. A small synthetic library is
+    generated first if the database has none yet.
+    """
+    dbname = os.environ.get(TEST_DBNAME)
+    if not dbname:
+        pytest.skip(f"set {TEST_DBNAME} to a throwaway database to run the db tests")
+    library_db = pytest.importorskip('library_db')
+    from datagen import generate
+
+    config = library_db.load_config()
+    if dbname == config['dbname']:
+        pytest.fail(f"{TEST_DBNAME} must not be the configured library database")
+    config['dbname'] = dbname
+    database = library_db.Database(config)
+    generated = database.run(lambda conn: library_db.fetch_one(
+        conn, 'member_by_student', ('GEN0000000',)))
+    if generated is None:
+        conn = database.connect()
+        try:
+            generate(conn, books=2000, members=500, loans=5000, years=1)
+        finally:
+            conn.close()
+    yield database
+    database.close()
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from bench import Timing, regressions
+
+BASELINE = {'search_title': {'median_ms': 10.0}, 'login': {'median_ms': 0.2}}
+
+
+def timing(name, median_ms):
+    return Timing(name, median_ms, median_ms, median_ms, 1)
+
+
+def test_slower_than_tolerance_regresses():
+    slow = timing('search_title', 13.0)
+    assert regressions([slow], BASELINE) == [(slow, 10.0)]
+
+
+def test_within_tolerance_passes():
+    assert regressions([timing('search_title', 12.4)], BASELINE) == []
+
+
+def test_sub_millisecond_noise_is_ignored():
+    # Three times slower, but less than MIN_REGRESSION_MS in absolute terms
+    assert regressions([timing('login', 0.6)], BASELINE) == []
+
+
+def test_queries_without_a_baseline_are_skipped():
+    assert regressions([timing('new_query', 500.0)], BASELINE) == []
+
+
+def test_tolerance_is_configurable():
+    assert regressions([timing('search_title', 12.4)], BASELINE, tolerance=0.1)
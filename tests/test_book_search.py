@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import book_search
+from book_search import ISBN_PATTERN, ISBN_PREFIX_PATTERN, prefix_tsquery
+
+
+def test_prefix_tsquery_ands_word_prefixes():
+    assert prefix_tsquery('Harry Pot') == 'harry:* & pot:*'
+
+
+def test_prefix_tsquery_drops_punctuation():
+    assert prefix_tsquery("  o'brien: the-end! ") == 'o:* & brien:* & the:* & end:*'
+    assert prefix_tsquery('---') == ''
+
+
+def test_isbn_patterns():
+    assert ISBN_PATTERN.match('978-0-7475-3269-9')
+    assert ISBN_PATTERN.match('043942089X')
+    assert not ISBN_PATTERN.match('978074')
+    assert ISBN_PREFIX_PATTERN.match('978074')
+    assert ISBN_PREFIX_PATTERN.match('978-0-74')
+    assert not ISBN_PREFIX_PATTERN.match('97')
+    assert not ISBN_PREFIX_PATTERN.match('x978')
+    assert not ISBN_PREFIX_PATTERN.match('potter')
+
+
+@pytest.mark.db
+def test_search_finds_partial_isbn(db):
+    rows = db.run(lambda conn: book_search.search_books(conn, '978-0-7475'))
+    assert '9780747532699' in [row[2] for row in rows]
+
+
+@pytest.mark.db
+def test_search_finds_title_words(db):
+    rows = db.run(lambda conn: book_search.search_books(conn, 'harry pot'))
+    assert "Harry Potter and the Philosopher's Stone" in [row[1] for row in rows]
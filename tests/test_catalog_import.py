@@ -0,0 +1,82 @@
+import csv
+import io
+
+import pytest
+
+import catalog_import
+from catalog_import import CatalogReader, CopyStream, resolve_columns
+
+
+def write(tmp_path, text, name='catalog.csv'):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    return path
+
+
+def read_all(path, delimiter=None):
+    reader = CatalogReader(str(path), delimiter)
+    try:
+        return list(reader), reader
+    finally:
+        reader.close()
+
+
+def test_reads_csv_with_aliased_columns(tmp_path):
+    path = write(tmp_path, 'ISBN13,Title,Creator,Subject\n'
+                           '978-0-553-29335-7,Foundation,Isaac Asimov,Science Fiction\n')
+    rows, reader = read_all(path)
+    assert rows == [('Foundation', '9780553293357', 'Science Fiction', 'Isaac Asimov')]
+    assert reader.progress() == 1.0
+
+
+def test_sniffs_tab_separated_marc_headers(tmp_path):
+    path = write(tmp_path, '245$a\t020$a\t100$a\n'
+                           'Emma\t0141439580\tJane Austen\n', 'catalog.tsv')
+    rows, _ = read_all(path)
+    assert rows == [('Emma', '0141439580', None, 'Jane Austen')]
+
+
+def test_skips_rows_without_title_or_isbn(tmp_path):
+    path = write(tmp_path, 'title,isbn\n'
+                           ',9780553293357\n'
+                           'No ISBN,\n'
+                           'Too long,' + '1' * 21 + '\n'
+                           'Short row\n'
+                           'Emma,0141439580\n')
+    rows, reader = read_all(path)
+    assert rows == [('Emma', '0141439580', None, None)]
+    assert (reader.rows, reader.skipped) == (5, 4)
+
+
+def test_explicit_delimiter(tmp_path):
+    path = write(tmp_path, 'title;isbn\nEmma;0141439580\n')
+    rows, _ = read_all(path, ';')
+    assert rows == [('Emma', '0141439580', None, None)]
+
+
+def test_missing_required_columns():
+    with pytest.raises(ValueError, match='no isbn column'):
+        resolve_columns(['Title', 'Author'])
+
+
+def test_copy_stream_yields_csv_in_any_read_size(monkeypatch):
+    monkeypatch.setattr(catalog_import, 'COPY_BATCH_ROWS', 3)
+    rows = [(f'Title, {i}', str(i), None, 'Author "A"') for i in range(10)]
+    batches = []
+    stream = CopyStream(rows, on_batch=lambda: batches.append(1))
+
+    data = b''
+    while True:
+        chunk = stream.read(7)
+        if not chunk:
+            break
+        data += chunk
+    parsed = list(csv.reader(io.StringIO(data.decode('utf-8'))))
+    assert parsed == [[title, isbn, '', author] for title, isbn, _, author in rows]
+    assert len(batches) == 4
+
+
+def test_copy_stream_read_everything():
+    stream = CopyStream([('Emma', '0141439580')])
+    assert stream.read() == b'Emma,0141439580\n'
+    assert stream.read() == b''
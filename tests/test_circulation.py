@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import circulation
+import library_db
+
+LONE_COPY_SQL = """
+    SELECT b.id, b.isbn FROM books b JOIN copy_counts c ON c.book_id = b.id
+    WHERE c.available = 1
+      AND NOT EXISTS (SELECT 1 FROM holds h WHERE h.book_id = b.id AND h.status = 'Ready')
+    LIMIT 1
+"""
+
+MEMBERS_SQL = "SELECT id FROM members WHERE active_loan_count = 0 LIMIT 1"
+
+LEND_FIRST_COPY_SQL = """
+    SELECT id FROM copies WHERE book_id = %s AND status = 'Available'
+    ORDER BY id LIMIT 1 FOR UPDATE
+"""
+
+
+def test_normalize_isbns_strips_scanner_noise():
+    assert circulation.normalize_isbns(['978-0-7475-3269-9', ' 0553293354 ']) == \
+        ['9780747532699', '0553293354']
+
+
+def test_normalize_isbns_keeps_cart_order_and_drops_repeats():
+    cart = ['9780553293357', '978-0-7475-3269-9', '9780553293357', '9780747532699']
+    assert circulation.normalize_isbns(cart) == ['9780553293357', '9780747532699']
+
+
+def test_normalize_isbns_uppercases_check_digit_and_barcodes():
+    assert circulation.normalize_isbns(['043942089x', 'sl0000000002']) == \
+        ['043942089X', 'SL0000000002']
+
+
+def test_normalize_isbns_drops_blank_entries():
+    assert circulation.normalize_isbns(['', ' - ', '9780553293357']) == ['9780553293357']
+
+
+@pytest.mark.db
+def test_parallel_checkouts_never_lend_a_copy_twice(db):
+    result = circulation.stress_test(db, workers=8, rounds=5, pool_size=6, cart_size=3)
+    assert result.passed, result.problems
+    assert result.borrowed
+
+
+@pytest.mark.db
+@pytest.mark.parametrize('shelved, answer', [(1, 'busy'), (2, 'borrowed')])
+def test_second_desk_takes_another_copy_or_hears_busy(db, shelved, answer):
+    first, second = db.connect(), db.connect()
+    try:
+        cursor = first.cursor()
+        cursor.execute(LONE_COPY_SQL)
+        book_id, isbn = cursor.fetchone()
+        cursor.execute(MEMBERS_SQL)
+        member, = cursor.fetchone()
+        if shelved > 1:
+            cursor.execute("INSERT INTO copies (book_id) VALUES (%s)", (book_id,))
+            first.commit()
+        # The first desk is in the middle of lending the first copy
+        cursor.execute(LEND_FIRST_COPY_SQL, (book_id,))
+        cursor.close()
+        second.cursor().execute("SET lock_timeout = '5s'")
+        assert library_db.fetch_all(second, 'borrow_books', (member, [isbn], 7))[0][2] == answer
+    finally:
+        first.rollback()
+        second.rollback()
+        first.close()
+        second.close()
@@ -0,0 +1,118 @@
+import json
+import logging
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import circulation
+import hold_queue
+from hold_queue import Notice
+
+# A title with its only copy on the shelf and two members free to take it
+SINGLE_COPY_SQL = """
+    SELECT b.isbn,
+           ARRAY(SELECT m.id FROM members m
+                 WHERE m.active_loan_count = 0
+                   AND NOT EXISTS (SELECT 1 FROM holds h
+                                   WHERE h.member_id = m.id AND h.status IN ('Waiting', 'Ready'))
+                 ORDER BY m.id LIMIT 2)
+    FROM books b JOIN copy_counts c ON c.book_id = b.id
+    WHERE c.available = 1 AND c.total = 1
+    LIMIT 1
+"""
+
+
+def notice(kind='ready'):
+    return Notice(7, kind, 3, 'LKW2023001', 'John Doe', 'john@example.edu', 'Foundation',
+                  '9780553293357', datetime(2026, 10, 21, 9, 30))
+
+
+def test_notice_text_ready_names_book_and_deadline():
+    assert hold_queue.notice_text(notice()) == (
+        "Foundation is waiting for you at the front desk until 2026-10-21 09:30.")
+
+
+def test_notice_text_expired():
+    assert hold_queue.notice_text(notice('expired')) == (
+        "Your hold on Foundation was not collected in time and has expired.")
+
+
+def test_make_notifier_log(caplog):
+    notifier = hold_queue.make_notifier('log')
+    assert isinstance(notifier, hold_queue.LogNotifier)
+    with caplog.at_level(logging.INFO, logger='smartlibrary.holds'):
+        notifier(notice())
+    assert 'john@example.edu' in caplog.text
+
+
+def test_make_notifier_file_appends_json_lines(tmp_path):
+    path = tmp_path / 'notices.jsonl'
+    notifier = hold_queue.make_notifier(f'file:{path}')
+    notifier(notice())
+    notifier(notice('expired'))
+    records = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [record['kind'] for record in records] == ['ready', 'expired']
+    assert records[0]['text'] == hold_queue.notice_text(notice())
+    assert records[0]['expires_at'] == '2026-10-21 09:30:00'
+
+
+def test_make_notifier_command_splits_arguments():
+    notifier = hold_queue.make_notifier("command:/usr/bin/send-notice --from 'Front Desk'")
+    assert notifier.args == ['/usr/bin/send-notice', '--from', 'Front Desk']
+
+
+def test_make_notifier_unknown_channel():
+    with pytest.raises(ValueError, match='Unknown hold notifier'):
+        hold_queue.make_notifier('pager:123')
+
+
+@pytest.mark.db
+def test_returns_go_to_the_right_hold(db):
+    result = hold_queue.stress_test(db, workers=9, rounds=5, pool_size=3)
+    assert result.passed, result.problems
+    assert result.returns
+
+
+def _query(db, sql, params=()):
+    def work(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+    return db.run(work)
+
+
+@pytest.mark.db
+def test_notices_are_sent_with_no_transaction_open(db):
+    isbn, (lender, holder) = _query(db, SINGLE_COPY_SQL)
+    circulation.checkout(db, lender, [isbn])
+    hold_id = hold_queue.place(db, holder, [isbn])[0].hold_id
+    notice_id, = _query(db, "INSERT INTO hold_notices (hold_id, kind) VALUES (%s, 'ready') "
+                            "RETURNING id", (hold_id,))
+    seen = []
+
+    def failing(notice):
+        if notice.id == notice_id:
+            raise OSError("gateway down")
+
+    def checking(notice):
+        if notice.id == notice_id:
+            # Claimed and committed: another session can lock the row
+            seen.append(_query(db, "SELECT claimed_at IS NOT NULL, sent_at FROM hold_notices "
+                                   "WHERE id = %s FOR UPDATE NOWAIT", (notice_id,)))
+
+    try:
+        hold_queue.deliver_notices(db, failing)
+        assert _query(db, "SELECT claimed_at, sent_at FROM hold_notices WHERE id = %s",
+                      (notice_id,)) == (None, None)
+        hold_queue.deliver_notices(db, checking)
+        assert seen == [(True, None)]
+        assert _query(db, "SELECT sent_at IS NOT NULL FROM hold_notices WHERE id = %s",
+                      (notice_id,)) == (True,)
+    finally:
+        hold_queue.cancel(db, holder, [isbn])
+        circulation.checkin(db, [isbn])
@@ -0,0 +1,51 @@
+import asyncio
+import json
+from http import HTTPStatus
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import library_api
+from library_api import LibraryApi, Request
+
+
+def dispatch(api, method, path, headers=None):
+    return asyncio.run(api.dispatch(Request(method, path, {}, headers or {}, b'')))
+
+
+def test_a_token_is_required():
+    with pytest.raises(ValueError):
+        LibraryApi(None, None)
+
+
+@pytest.mark.parametrize('method, path', [
+    ('GET', '/api/members'), ('GET', '/api/books'), ('GET', '/metrics'),
+    ('POST', '/api/borrow'), ('GET', '/nowhere'),
+])
+def test_every_route_needs_the_token(method, path):
+    api = LibraryApi(None, 's3cret')
+    for headers in ({}, {'authorization': 'Bearer wrong'}, {'authorization': 's3cret'}):
+        status, _, body = dispatch(api, method, path, headers)
+        assert status == HTTPStatus.UNAUTHORIZED
+        assert json.loads(body) == {'error': "Missing or wrong API token"}
+
+
+def test_the_right_token_gets_through():
+    api = LibraryApi(None, 's3cret')
+    status, headers, _ = dispatch(api, 'GET', '/metrics', {'authorization': 'Bearer s3cret'})
+    assert status == HTTPStatus.OK
+    status, _, _ = dispatch(api, 'GET', '/nowhere', {'authorization': 'Bearer s3cret'})
+    assert status == HTTPStatus.NOT_FOUND
+
+
+def test_members_payload_has_no_contact_details():
+    assert 'email' not in library_api.MEMBER_FIELDS
+    assert 'contact' not in library_api.MEMBER_FIELDS
+
+
+def test_cursor_round_trip():
+    cursor = library_api.encode_cursor(('Emma', 12))
+    assert library_api.decode_cursor(cursor) == ['Emma', 12]
+    with pytest.raises(library_api.ApiError):
+        library_api.decode_cursor('not-a-cursor')
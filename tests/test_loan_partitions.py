@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+
+@pytest.mark.db
+def test_loans_for_a_missing_month_wait_in_the_default_partition(db):
+    # Everything runs in one transaction that is rolled back at the end
+    conn = db.connect()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT to_regclass('public.loans_1999_03')")
+        assert cursor.fetchone()[0] is None
+        cursor.execute("""
+            INSERT INTO loans (book_id, member_id, borrow_date, due_date, return_date, status)
+            SELECT (SELECT MIN(id) FROM books), (SELECT MIN(id) FROM members),
+                   '1999-03-10', '1999-03-17', '1999-03-15', 'Returned'
+            RETURNING id, tableoid::regclass::text
+        """)
+        loan_id, partition = cursor.fetchone()
+        assert partition == 'loans_default'
+
+        cursor.execute("SELECT ensure_loan_partitions(CURRENT_DATE, CURRENT_DATE)")
+        assert cursor.fetchone()[0] == 1
+        cursor.execute("SELECT tableoid::regclass::text FROM loans WHERE id = %s", (loan_id,))
+        assert cursor.fetchone()[0] == 'loans_1999_03'
+        cursor.execute("SELECT COUNT(*) FROM loans_default WHERE borrow_date < '1999-04-01'")
+        assert cursor.fetchone()[0] == 0
+    finally:
+        cursor.close()
+        conn.rollback()
+        conn.close()
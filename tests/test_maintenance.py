@@ -0,0 +1,55 @@
+import logging
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import maintenance
+
+
+class FailingDatabase:
+    config = {'hold_notifier': 'log'}
+
+    def run(self, work, retry=False):
+        raise RuntimeError('permission denied for schema public')
+
+    def connect(self):
+        raise RuntimeError('connection refused')
+
+
+def test_overdue_sweep_runs_first():
+    job = maintenance.Maintenance(FailingDatabase())
+    assert job.steps[0][0] == 'overdue sweep'
+
+
+def test_only_the_daemon_folds_recommendations():
+    desk = maintenance.Maintenance(FailingDatabase())
+    daemon = maintenance.Maintenance(FailingDatabase(), recommendations=True)
+    assert 'recommendation update' not in dict(desk.steps)
+    assert daemon.steps[-1][0] == 'recommendation update'
+
+
+def test_every_failing_step_is_logged_and_the_rest_still_run(caplog, monkeypatch):
+    job = maintenance.Maintenance(FailingDatabase(), recommendations=True)
+    ran = []
+    monkeypatch.setattr(job, 'steps', [
+        (name, lambda name=name, step=step: ran.append(name) or step())
+        for name, step in job.steps])
+    with caplog.at_level(logging.WARNING, logger='smartlibrary.maintenance'):
+        assert job.run() == {}
+    assert ran == [name for name, _ in job.steps]
+    failed = [record.args[0] for record in caplog.records if record.levelno == logging.ERROR]
+    # Without numpy the recommendation update is skipped rather than failed
+    assert set(ran) - set(failed) <= {'recommendation update'}
+
+
+def test_results_of_the_steps_that_worked(monkeypatch):
+    job = maintenance.Maintenance(FailingDatabase())
+    monkeypatch.setattr(job, 'steps', [('a', lambda: 1), ('b', lambda: 1 / 0), ('c', lambda: 3)])
+    assert job.run() == {'a': 1, 'c': 3}
+
+
+@pytest.mark.db
+def test_maintenance_against_the_database(db):
+    results = maintenance.Maintenance(db).run()
+    assert 'overdue sweep' in results and 'hold expiry' in results
@@ -0,0 +1,146 @@
+from paged_tree import PagedTreeview, TreeRows
+
+
+def render(row):
+    return row, ('late',) if row[1].endswith('!') else ()
+
+
+class Scrollbar:
+    def set(self, first, last):
+        pass
+
+
+class Pages:
+    """fetch_page over a sorted list of (id, title) rows, keyed by (title, id)."""
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda row: (row[1], row[0]))
+        self.requests = []
+        self.held = None
+
+    def __call__(self, direction, key, limit, done):
+        self.requests.append((direction, key, limit))
+        keys = [(title, id_) for id_, title in self.rows]
+        if direction == 'after':
+            page = [row for row, k in zip(self.rows, keys) if key is None or k > tuple(key)]
+            page = page[:limit]
+        else:
+            page = [row for row, k in zip(self.rows, keys) if k < tuple(key)][-limit:]
+        if self.held is not None:
+            self.held.append(lambda: done(page))
+        else:
+            done(page)
+
+
+def make_view(tree, rows, page_size=3, max_pages=2):
+    pages = Pages(rows)
+    view = PagedTreeview(tree, Scrollbar(), pages, lambda row: (row[1], row[0]), render,
+                         page_size=page_size, max_pages=max_pages)
+    return view, pages
+
+
+BOOKS = [(i, f'Book {i:02}') for i in range(1, 11)]
+
+
+def test_tree_rows_redraws_only_changed_rows(tree):
+    rows = TreeRows(tree, render)
+    rows.sync([(1, 'A'), (2, 'B')])
+    tree.calls.clear()
+    rows.sync([(1, 'A'), (2, 'B!')])
+    assert tree.calls == [('item', '2')]
+    assert tree.data['2'] == ((2, 'B!'), ('late',))
+
+
+def test_tree_rows_sync_moves_inserts_and_removes(tree):
+    rows = TreeRows(tree, render)
+    rows.sync([(1, 'A'), (2, 'B'), (3, 'C')])
+    tree.calls.clear()
+    shown = rows.sync([(3, 'C'), (4, 'D'), (1, 'A')])
+    assert shown == ['3', '4', '1']
+    assert tree.get_children() == ('3', '4', '1')
+    assert ('delete', '2') in tree.calls
+    assert not any(call == ('insert', '1') or call == ('insert', '3') for call in tree.calls)
+
+
+def test_tree_rows_sync_leaves_rows_above_start(tree):
+    rows = TreeRows(tree, render)
+    rows.sync([(1, 'A'), (2, 'B')])
+    rows.sync([(5, 'E')], start=1)
+    assert tree.get_children() == ('1', '5')
+
+
+def test_pages_load_and_window_is_trimmed(tree):
+    view, pages = make_view(tree, BOOKS)
+    view.reset()
+    assert tree.get_children() == ('1', '2', '3')
+    view.load_next()
+    view.load_next()
+    # Only max_pages pages are kept; the first fell off the top
+    assert tree.get_children() == ('4', '5', '6', '7', '8', '9')
+    assert not view.at_start and not view.at_end
+    view.load_prev()
+    assert tree.get_children() == ('1', '2', '3', '4', '5', '6')
+    assert pages.requests[-1] == ('before', ('Book 04', 4), 3)
+    assert not view.at_end
+    # A full page back may not be the first; the next, empty one says so
+    view.load_prev()
+    assert view.at_start
+    assert tree.get_children() == ('1', '2', '3', '4', '5', '6')
+
+
+def test_last_short_page_ends_the_list(tree):
+    view, _ = make_view(tree, BOOKS[:4])
+    view.reset()
+    view.load_next()
+    assert tree.get_children() == ('1', '2', '3', '4')
+    assert view.at_end
+
+
+def test_show_rows_is_fixed(tree):
+    view, pages = make_view(tree, BOOKS)
+    view.show_rows([(5, 'Book 05'), (2, 'Book 02')])
+    assert tree.get_children() == ('5', '2')
+    assert view.at_start and view.at_end
+    assert pages.requests == []
+
+
+def test_stale_page_is_ignored_after_clear(tree):
+    view, pages = make_view(tree, BOOKS)
+    pages.held = []
+    view.reset()
+    view.show_rows([(42, 'Search hit')])
+    pages.held.pop()()
+    assert tree.get_children() == ('42',)
+
+
+def test_patch_updates_inserts_in_order_and_removes(tree):
+    view, _ = make_view(tree, BOOKS[:4])
+    view.reset()
+    view.load_next()
+    view.patch([2, 3, 20], [(2, 'Book 02!'), (20, 'Book 025')])
+    assert tree.get_children() == ('1', '2', '20', '4')
+    assert tree.data['2'][1] == ('late',)
+
+
+def test_patch_outside_window_is_left_to_paging(tree):
+    view, _ = make_view(tree, BOOKS)
+    view.reset()
+    view.patch([99], [(99, 'Zzz')])
+    assert '99' not in tree.get_children()
+
+
+def test_fixed_results_only_update_shown_rows(tree):
+    view, _ = make_view(tree, BOOKS)
+    view.show_rows([(5, 'Book 05'), (2, 'Book 02')])
+    view.patch([5, 7], [(5, 'Renamed'), (7, 'Book 07')])
+    assert tree.get_children() == ('5', '2')
+    assert tree.data['5'][0] == (5, 'Renamed')
+
+
+def test_refresh_rereads_the_window(tree):
+    view, pages = make_view(tree, BOOKS)
+    view.reset()
+    pages.rows[0] = (1, 'Book 01!')
+    view.refresh()
+    assert pages.requests[-1] == ('after', None, 3)
+    assert tree.data['1'][0] == (1, 'Book 01!')
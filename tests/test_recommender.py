@@ -0,0 +1,50 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+pytest.importorskip('psycopg2')
+
+import recommender
+from recommender import chunks, top_k
+
+
+def test_top_k_per_row_by_score_then_column():
+    rows = np.array([0, 0, 0, 1, 1, 0])
+    cols = np.array([5, 3, 4, 9, 8, 2])
+    scores = np.array([0.5, 0.9, 0.5, 0.1, 0.7, 0.2])
+    keep, rank = top_k(rows, cols, scores, 2)
+    picked = sorted(zip(rows[keep].tolist(), rank.tolist(), cols[keep].tolist()))
+    # Row 0: 3 (0.9) then 4 before 5 on the tie; row 1: 8 then 9
+    assert picked == [(0, 1, 3), (0, 2, 4), (1, 1, 8), (1, 2, 9)]
+
+
+def test_top_k_of_nothing():
+    keep, rank = top_k(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0), 3)
+    assert len(keep) == len(rank) == 0
+
+
+def test_chunks_cover_every_index_once():
+    weights = [4, 1, 3, 5, 2, 2]
+    ranges = list(chunks(weights, 6))
+    assert ranges == [(0, 2), (2, 3), (3, 4), (4, 6)]
+    assert [i for start, stop in ranges for i in range(start, stop)] == list(range(6))
+
+
+def test_chunks_give_an_oversized_weight_its_own_range():
+    assert list(chunks([1, 50, 1], 10)) == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_chunks_of_nothing():
+    assert list(chunks([], 10)) == []
+
+
+@pytest.mark.db
+def test_update_skips_while_the_queue_is_held(db):
+    holder, updater = db.connect(), db.connect()
+    try:
+        holder.cursor().execute(recommender.LOCK_SQL)
+        assert recommender.update(updater, wait=False) is None
+    finally:
+        holder.rollback()
+        holder.close()
+        updater.close()
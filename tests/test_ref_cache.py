@@ -0,0 +1,100 @@
+import select
+import time
+
+import pytest
+
+import ref_cache
+from ref_cache import ReferenceCache
+
+
+@pytest.fixture
+def cache():
+    cache = ReferenceCache(max_entries=2, ttl=60)
+    cache.set_listening(True)
+    return cache
+
+
+def fill(cache, key, value, tables=('authors',)):
+    cache.put(key, value, tables, cache.begin(tables))
+
+
+def test_hit_after_fill(cache):
+    fill(cache, 'authors_list', ['Asimov'])
+    assert cache.get('authors_list') == ['Asimov']
+    assert cache.stats()['hits'] == 1
+
+
+def test_nothing_served_while_not_listening():
+    cache = ReferenceCache()
+    fill(cache, 'authors_list', ['Asimov'])
+    assert cache.get('authors_list') is None
+
+
+def test_least_recently_used_is_evicted(cache):
+    fill(cache, 'a', 1)
+    fill(cache, 'b', 2)
+    cache.get('a')
+    fill(cache, 'c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ref_cache.time, 'monotonic', lambda: now[0])
+    fill(cache, 'authors_list', ['Asimov'])
+    now[0] += 61
+    assert cache.get('authors_list') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_invalidate_drops_entries_reading_the_table(cache):
+    fill(cache, 'authors_list', ['Asimov'])
+    fill(cache, 'clubs_list', ['Sci-Fi'], ('book_clubs',))
+    cache.invalidate('authors')
+    assert cache.get('authors_list') is None
+    assert cache.get('clubs_list') == ['Sci-Fi']
+
+
+def test_change_during_fill_is_not_cached(cache):
+    token = cache.begin(('authors',))
+    cache.invalidate('authors')
+    cache.put('authors_list', ['stale'], ('authors',), token)
+    assert cache.get('authors_list') is None
+
+
+def test_reconnect_during_fill_is_not_cached(cache):
+    token = cache.begin(('authors',))
+    cache.set_listening(True)
+    cache.put('authors_list', ['stale'], ('authors',), token)
+    assert cache.get('authors_list') is None
+
+
+def test_every_cached_statement_is_defined():
+    library_db = pytest.importorskip('library_db')
+    assert set(ref_cache.CACHED_STATEMENTS) <= set(library_db.STATEMENTS)
+
+
+@pytest.mark.db
+def test_writes_to_cached_tables_notify(db):
+    listener, writer = db.connect(), db.connect()
+    try:
+        listener.autocommit = True
+        listener.cursor().execute(f"LISTEN {ref_cache.REFERENCE_CHANNEL}")
+        tables = sorted({table for tables in ref_cache.CACHED_STATEMENTS.values()
+                         for table in tables})
+        cursor = writer.cursor()
+        for table in tables:
+            # Statement triggers fire even when no row matches
+            cursor.execute(f"UPDATE {table} SET name = name WHERE id < 0")
+        writer.commit()
+        deadline = time.monotonic() + 5
+        while len(listener.notifies) < len(tables) and time.monotonic() < deadline:
+            select.select([listener], [], [], 0.1)
+            listener.poll()
+        assert sorted(notify.payload for notify in listener.notifies) == tables
+    finally:
+        writer.rollback()
+        listener.close()
+        writer.close()
@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from report_export import guess_format
+
+
+@pytest.mark.parametrize('path, expected', [
+    ('loans.csv', ('csv', 'none')),
+    ('loans.CSV.GZ', ('csv', 'gzip')),
+    ('members.jsonl.zst', ('jsonl', 'zstd')),
+    ('members.ndjson', ('jsonl', 'none')),
+    ('exports/catalog.parquet', ('parquet', 'none')),
+])
+def test_guess_format(path, expected):
+    assert guess_format(path) == expected
+
+
+@pytest.mark.parametrize('path', ['loans.xlsx', 'loans.gz', 'loans'])
+def test_guess_format_rejects_unknown(path):
+    with pytest.raises(ValueError, match='Unknown export format'):
+        guess_format(path)